@@ -0,0 +1,321 @@
+""" Automated feature tracking, the batch version of feature_tracking.py.
+A grid of points is seeded over the first image of a segment, inside a mask of the icefall (required, the rock and
+snow around it only give noise tracks) and optionally only in the upper or lower icefall. The boundary between them
+is a list of points in image pixels (icefall_boundary.csv), made once from the blue line of icefall_boundaries_ft.png
+by registering that annotation on a tracking image. The points are tracked image to image through
+filtered_for_tracking with pyramidal Lucas-Kanade or normalized cross-correlation. A point is dropped as soon as
+tracking it back to the previous image does not return within max_fb_error pixels of where it started
+(forward-backward check). Each image pair depends on the positions of the pair before, so the sequence is cut into
+segments of segment_length images that are tracked in parallel in a process pool.
+
+Every tracked point is written as a track csv (filename, timestamp, x, y) like the ones of feature_tracking.py,
+named region letter + track_prefix + segment_point (e.g. lauto003_0412.csv), so project_tracked_features.py and
+calculate_flow_speed.py use them as they are. """
+
+#%%
+import csv
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from frame_selection import read_selection_index, SELECTION_INDEX
+from template_tracking import extract_template, match_template
+
+
+def read_grey(path):
+    """ 8 bit grey image """
+    img = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise IOError(f"Could not read {path}")
+    return img
+
+
+def blue_line(rgb):
+    """ Pixels of a blue line drawn on an RGB image
+
+    Returns:
+        tuple: the boolean mask of the line, and arrays x and y of the line (mean row of every column it crosses)
+    """
+    rgb = rgb.astype(int)
+    blue = (rgb[:, :, 2] - rgb[:, :, 0] > 100) & (rgb[:, :, 2] > 180)  # the ice is blueish too, but not as much
+    ys, xs = np.nonzero(blue)
+    if len(xs) == 0:
+        return blue, np.array([]), np.array([])
+    columns, inverse = np.unique(xs, return_inverse=True)
+    return blue, columns.astype(float), np.bincount(inverse, weights=ys) / np.bincount(inverse)
+
+
+def register_annotation(annotation, image, min_inliers=25, distance_ratio_lowe=0.75, mask=None):
+    """ Homography from the pixels of an annotation (e.g. a cropped, scaled screenshot of a timelapse image) to the
+    pixels of a timelapse image, fitted on SIFT matches with RANSAC
+
+    Args:
+        annotation, image: grey images
+        min_inliers: fewer RANSAC inliers than this raise a ValueError
+        distance_ratio_lowe: ratio of Lowe's test
+        mask: optional uint8 mask of the annotation pixels to detect features in (e.g. without the drawn line)
+
+    Returns:
+        np.ndarray: 3x3 homography
+    """
+    sift = cv2.SIFT_create()
+    kp_a, des_a = sift.detectAndCompute(annotation, mask)
+    kp_i, des_i = sift.detectAndCompute(image, None)
+    if des_a is None or des_i is None:
+        raise ValueError("No features to register the annotation on")
+    matches = cv2.BFMatcher(cv2.NORM_L2).knnMatch(des_a, des_i, k=2)
+    good = [pair[0] for pair in matches if len(pair) == 2 and pair[0].distance < distance_ratio_lowe * pair[1].distance]
+    if len(good) < min_inliers:
+        raise ValueError(f"Only {len(good)} matches between the annotation and the image, {min_inliers} are required")
+    src = np.float32([kp_a[m.queryIdx].pt for m in good]).reshape(-1, 1, 2)
+    dst = np.float32([kp_i[m.trainIdx].pt for m in good]).reshape(-1, 1, 2)
+    H, inliers = cv2.findHomography(src, dst, cv2.RANSAC, 3.0)
+    if H is None or inliers.sum() < min_inliers:
+        raise ValueError(f"Only {0 if inliers is None else int(inliers.sum())} consistent matches between the "
+                         f"annotation and the image, {min_inliers} are required")
+    return H
+
+
+def boundary_from_png(png_path, image_path):
+    """ The blue line between upper and lower icefall drawn on icefall_boundaries_ft.png, in pixels of a timelapse
+    image: the png is registered on the image (it is a cropped and scaled view, not a full frame)
+
+    Args:
+        png_path: image of the icefall with the boundary drawn in blue
+        image_path: timelapse image to register the png on
+
+    Returns:
+        tuple: arrays x and y of the line in image pixels, sorted by x
+    """
+    rgb = np.asarray(Image.open(png_path).convert('RGB'))
+    line, x, y = blue_line(rgb)
+    if len(x) == 0:
+        raise ValueError(f"No blue boundary line found in {png_path}")
+    not_line = np.where(cv2.dilate(line.astype(np.uint8), np.ones((15, 15), np.uint8)) > 0, 0, 255).astype(np.uint8)
+    H = register_annotation(cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY), read_grey(image_path), mask=not_line)
+    points = cv2.perspectiveTransform(np.column_stack([x, y]).reshape(-1, 1, 2), H).reshape(-1, 2)
+    points = points[np.argsort(points[:, 0], kind='stable')]
+    return points[:, 0], points[:, 1]
+
+
+def save_boundary(path, boundary):
+    """ Write the boundary points (x, y in image pixels) as a csv """
+    np.savetxt(path, np.column_stack(boundary), fmt='%.1f', delimiter=',', header='x,y', comments='')
+
+
+def load_boundary(path):
+    """ Boundary points (x, y in image pixels) of a csv written by save_boundary (or by hand), sorted by x """
+    points = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2)
+    points = points[np.argsort(points[:, 0], kind='stable')]
+    return points[:, 0], points[:, 1]
+
+
+def point_regions(points, boundary=None, default_region="l"):
+    """ 'u' for points above the boundary line, 'l' below, '' for points left or right of the ends of the line
+    (not labelled, rather than extending the line) """
+    if boundary is None:
+        return np.full(len(points), default_region)
+    line_x, line_y = boundary
+    regions = np.where(points[:, 1] < np.interp(points[:, 0], line_x, line_y), "u", "l")
+    return np.where((points[:, 0] >= line_x[0]) & (points[:, 0] <= line_x[-1]), regions, "")
+
+
+def seed_grid(image_size, spacing, margin=50, mask=None):
+    """ Grid points (x, y) with the given spacing, at least margin pixels from the image border
+
+    Args:
+        image_size: (width, height)
+        spacing: pixels between points
+        margin: pixels from the border
+        mask: optional boolean array (height, width), only points where it is True
+    """
+    xs = np.arange(margin, image_size[0] - margin, spacing)
+    ys = np.arange(margin, image_size[1] - margin, spacing)
+    points = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2).astype(np.float32)
+    if mask is not None:
+        points = points[mask[points[:, 1].astype(int), points[:, 0].astype(int)]]
+    return points
+
+
+def load_mask(mask_path, image_size):
+    """ Boolean mask (height, width) from an image, True where it is not black """
+    mask = Image.open(mask_path).convert('L').resize(image_size, Image.NEAREST)
+    return np.asarray(mask) > 0
+
+
+def _inside(points, shape):
+    return (points[:, 0] >= 0) & (points[:, 1] >= 0) & (points[:, 0] < shape[1]) & (points[:, 1] < shape[0])
+
+
+def track_pair_lk(prev, next_img, points, max_fb_error=1.0, win_size=31, max_level=3):
+    """ Track points from prev to next_img with pyramidal Lucas-Kanade
+
+    Returns:
+        tuple: new positions (n, 2) and a boolean array of the points that passed the forward-backward check
+    """
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01)
+    lk = dict(winSize=(win_size, win_size), maxLevel=max_level, criteria=criteria)
+    p0 = points.reshape(-1, 1, 2).astype(np.float32)
+    p1, status, _ = cv2.calcOpticalFlowPyrLK(prev, next_img, p0, None, **lk)
+    back, back_status, _ = cv2.calcOpticalFlowPyrLK(next_img, prev, p1, None, **lk)
+    fb_error = np.linalg.norm(p0 - back, axis=2).ravel()
+    p1 = p1.reshape(-1, 2)
+    ok = (status.ravel() == 1) & (back_status.ravel() == 1) & (fb_error < max_fb_error) & _inside(p1, prev.shape)
+    return p1, ok
+
+
+def track_pair_ncc(prev, next_img, points, max_fb_error=1.0, half_size=15, search_radius=40, min_score=0.7):
+    """ Track points from prev to next_img with normalized cross-correlation (template_tracking.match_template)
+
+    Returns:
+        tuple: new positions (n, 2) and a boolean array of the points that passed the forward-backward check
+            and have a correlation of at least min_score
+    """
+    new_points = np.array(points, dtype=np.float32)
+    ok = np.zeros(len(points), dtype=bool)
+    for k, (x, y) in enumerate(points):
+        template = extract_template(prev, x, y, half_size)
+        if template is None:
+            continue
+        x1, y1, score = match_template(next_img, template, x, y, search_radius)
+        back_template = extract_template(next_img, x1, y1, half_size)
+        if score < min_score or back_template is None:
+            continue
+        x0, y0, _ = match_template(prev, back_template, x1, y1, search_radius)
+        new_points[k] = (x1, y1)
+        ok[k] = np.hypot(x0 - round(x), y0 - round(y)) < max_fb_error
+    return new_points, ok
+
+
+TRACKERS = {"lk": track_pair_lk, "ncc": track_pair_ncc}
+
+
+def track_segment(files, seeds, method="lk", **options):
+    """ Track the seed points of the first image through the images of a segment
+
+    Returns:
+        array: positions (len(files), len(seeds), 2), NaN from the image a point is lost
+    """
+    track_pair = TRACKERS[method]
+    positions = np.full((len(files), len(seeds), 2), np.nan, dtype=np.float32)
+    positions[0] = seeds
+    alive = np.ones(len(seeds), dtype=bool)
+    prev = read_grey(files[0])
+    for i in range(1, len(files)):
+        if not alive.any():
+            break
+        next_img = read_grey(files[i])
+        tracked = np.flatnonzero(alive)
+        points, ok = track_pair(prev, next_img, positions[i - 1, tracked], **options)
+        positions[i, tracked[ok]] = points[ok]
+        alive[tracked[~ok]] = False
+        prev = next_img
+    return positions
+
+
+def track_sequence(files, seeds, segment_length=10, method="lk", n_workers=None, **options):
+    """ Track seed points through segments of the image sequence, the segments in parallel
+
+    Segment k starts at image k * (segment_length - 1), so consecutive segments share an image and every image
+    pair is tracked.
+
+    Returns:
+        list: (index of the first image of the segment, positions of track_segment)
+    """
+    step = segment_length - 1
+    starts = list(range(0, len(files) - 1, step))
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(track_segment, [str(f) for f in files[s:s + segment_length]], seeds, method, **options)
+                   for s in starts]
+        return [(s, future.result()) for s, future in zip(starts, futures)]
+
+
+def write_tracks(output_folder, files, times, segments, regions, track_prefix="auto", min_track_length=3):
+    """ Write each tracked point of each segment as a track csv (filename, timestamp, x, y)
+
+    Returns:
+        int: number of tracks written
+    """
+    n_tracks = 0
+    for k, (start, positions) in enumerate(segments):
+        for j in range(positions.shape[1]):
+            tracked = np.flatnonzero(~np.isnan(positions[:, j, 0]))
+            if len(tracked) < min_track_length:
+                continue
+            with open(Path(output_folder) / f"{regions[j]}{track_prefix}{k:03d}_{j:04d}.csv", 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['filename', 'timestamp', 'x', 'y'])
+                for i in tracked:
+                    x, y = positions[i, j]
+                    writer.writerow([files[start + i].name, times[start + i], int(x), int(y)])
+            n_tracks += 1
+    return n_tracks
+
+
+if __name__ == "__main__":
+
+    image_folder = Path("./filtered_for_tracking")
+    output_folder = Path("./csv_tracking/")  # the tracks of feature_tracking.py, auto tracks are added
+    track_prefix = "auto"  # earlier tracks with this prefix are replaced
+
+    method = "lk"  # "lk": pyramidal Lucas-Kanade, "ncc": normalized cross-correlation
+    options = dict(max_fb_error=1.0)  # pixels, and the keyword arguments of track_pair_lk / track_pair_ncc
+    segment_length = 10  # images per track, segments are tracked in parallel
+    min_track_length = 3
+    n_workers = None
+
+    grid_spacing = 100  # pixels between seed points
+    margin = 50
+    # mask of the icefall, white where points are seeded and black on rock, snow fields and sky (required)
+    mask_path = Path("./icefall_mask.png")
+    # upper/lower boundary as points (x, y) in image pixels, None: all points get default_region. If the file does
+    # not exist it is made from the blue line of boundary_png, registered on the first image (check the preview)
+    boundary_path = Path("./icefall_boundary.csv")
+    boundary_png = Path("./icefall_boundaries_ft.png")
+    default_region = "l"
+    seed_regions = ("u", "l")  # only seed points in these regions (points beyond the ends of the line have none)
+
+    # same image list and timestamps as feature_tracking.py
+    selection_index = image_folder / SELECTION_INDEX
+    if selection_index.exists():
+        image_files, image_times = read_selection_index(selection_index)
+    else:
+        image_files = sorted([f for f in image_folder.iterdir() if f.suffix.lower() in ['.jpg', '.jpeg', '.png']])
+        image_times = [datetime.strptime(f.name.split('.')[0], '%Y%m%d%H%M%S') for f in image_files]
+
+    if mask_path is None or not Path(mask_path).exists():
+        raise FileNotFoundError(f"No icefall mask at {mask_path}. Draw one (white on the icefall, black elsewhere, "
+                                f"same size as the images): seeding the whole frame only tracks rock, snow and sky")
+    first_image = read_grey(image_files[0])
+    height, width = first_image.shape
+    mask = load_mask(mask_path, (width, height))
+    seeds = seed_grid((width, height), grid_spacing, margin, mask)
+
+    boundary = None
+    if boundary_path is not None:
+        if not boundary_path.exists():
+            save_boundary(boundary_path, boundary_from_png(boundary_png, image_files[0]))
+            preview = cv2.cvtColor(first_image, cv2.COLOR_GRAY2BGR)
+            cv2.polylines(preview, [np.int32(np.column_stack(load_boundary(boundary_path)))], False, (255, 0, 0), 3)
+            cv2.imwrite(str(boundary_path.with_suffix(".png")), preview)
+            print(f"Registered the boundary of {boundary_png} on {image_files[0].name}, saved to {boundary_path}. "
+                  f"Check it on {boundary_path.with_suffix('.png')} and correct the points in the csv if needed")
+        boundary = load_boundary(boundary_path)
+    regions = point_regions(seeds, boundary, default_region)
+    seeds, regions = seeds[np.isin(regions, seed_regions)], regions[np.isin(regions, seed_regions)]
+    print(f"{len(seeds)} seed points, {len(image_files)} images")
+
+    start = datetime.now()
+    segments = track_sequence(image_files, seeds, segment_length, method, n_workers, **options)
+
+    # project_tracked_features.py and calculate_flow_speed.py remove the outputs and store rows of removed tracks
+    output_folder.mkdir(parents=True, exist_ok=True)
+    for old_track in output_folder.glob(f"[ul]{track_prefix}*.csv"):
+        old_track.unlink()
+    n_tracks = write_tracks(output_folder, image_files, image_times, segments, regions, track_prefix,
+                            min_track_length)
+    print(f"Wrote {n_tracks} tracks to {output_folder} in {datetime.now() - start}")
@@ -0,0 +1,62 @@
+""" Benchmark of the ray marching used in project_tracked_features: fixed 0.5 m steps versus
+empty-space skipping with the max-elevation DEM pyramid. Reports the number of steps per ray. """
+
+#%%
+import time
+import numpy as np
+import rasterio
+from pathlib import Path
+
+from terrain_projection import ray_to_world, dem_to_array, intersect_terrain, load_max_pyramid, intersect_terrain_pyramid
+
+dem_path = Path("./VL_DEM_ibai_UTM.tif")
+
+# camera position and properties, as in project_tracked_features.py
+cam_x, cam_y, cam_z = 887045, 6540858, 1373  # UTM
+pitch_deg, yaw_deg = 0, 135
+image_width, image_height = 1920, 1440
+focal_mm = 34
+sensor_width_mm = 22.3
+sensor_height_mm = 14.9
+
+max_dist = 5000
+march_step = 0.5
+n_rays = 5000
+
+#%%
+with rasterio.open(dem_path) as dem_ds:
+    dem = dem_to_array(dem_ds.read(1, masked=True))
+    transform = dem_ds.transform
+
+start = time.perf_counter()
+pyramid = load_max_pyramid(dem_path, dem)
+print(f"pyramid: {len(pyramid)} levels, loaded/built in {time.perf_counter() - start:.2f} s")
+
+# random pixels over the whole frame
+rng = np.random.default_rng(0)
+x_pix = rng.uniform(0, image_width, n_rays)
+y_pix = rng.uniform(0, image_height, n_rays)
+ray_origin = np.array([cam_x, cam_y, cam_z])
+ray_dirs = ray_to_world(x_pix, y_pix, yaw_deg, pitch_deg, image_width / 2, image_height / 2, focal_mm,
+                        sensor_width_mm / image_width, sensor_height_mm / image_height)
+
+start = time.perf_counter()
+fixed = intersect_terrain(ray_origin, ray_dirs, dem, transform, max_dist=max_dist, step=march_step)
+time_fixed = time.perf_counter() - start
+
+start = time.perf_counter()
+*skipped, pyramid_steps = intersect_terrain_pyramid(ray_origin, ray_dirs, dem, transform, pyramid,
+                                                    max_dist=max_dist, return_steps=True)
+time_pyramid = time.perf_counter() - start
+
+# the fixed march takes one step per 0.5 m up to the hit, or all steps for a miss
+hit_dist = np.linalg.norm(np.column_stack(fixed) - ray_origin, axis=1)
+fixed_steps = np.where(np.isnan(hit_dist), np.ceil(max_dist / march_step), np.floor(hit_dist / march_step) + 1)
+
+print(f"rays: {n_rays}, hits: {np.sum(~np.isnan(skipped[0]))}")
+print(f"fixed step:  {fixed_steps.mean():8.1f} steps/ray, {time_fixed:.3f} s")
+print(f"pyramid:     {pyramid_steps.mean():8.1f} steps/ray (max {pyramid_steps.max()}), {time_pyramid:.3f} s")
+print(f"steps saved: {np.mean(fixed_steps - pyramid_steps):8.1f} per ray ({1 - pyramid_steps.sum() / fixed_steps.sum():.1%})")
+
+distance = np.hypot(fixed[0] - skipped[0], fixed[1] - skipped[1])
+print(f"hits within one step of the fixed march: {np.mean(distance[~np.isnan(distance)] <= march_step):.1%}")
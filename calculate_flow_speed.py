@@ -5,6 +5,10 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 
+from track_manifest import config_hash, load_manifest, save_manifest, rows_to_process, removed_inputs
+from track_velocities import load_tracks, compute_velocities
+from track_store import TrackStore
+
 # === CONFIGURATION ===
 input_dir = Path("./csv_projected")      # Where projected CSVs are located
 output_dir = Path("./csv_velocities")    # Where to save velocity CSVs
@@ -16,35 +20,68 @@ x1, y1 = 886806.161, 6540336.018
 line_vec = np.array([x1 - x0, y1 - y0])
 line_unit = line_vec / np.linalg.norm(line_vec)
 
-# === Process Each CSV ===
-for csv_path in input_dir.glob("*_projected.csv"):
-    df = pd.read_csv(csv_path)
-    df = df.sort_values("timestamp")
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
+# === Manifest: only tracks whose projection changed are recalculated ===
+manifest_path = output_dir / "manifest.json"
+manifest = load_manifest(manifest_path)
+config = config_hash(line=[x0, y0, x1, y1])
+
+# also write one table with all tracks (track_id column) next to the per-track files
+write_combined = True
+combined_path = output_dir / "velocities_all_tracks.csv"
 
-    displacements = []
-    speeds = []
+# also keep the velocities in the columnar track store (table 'velocities')
+use_track_store = True
+track_store_dir = Path("./track_store")
 
-    for i in range(1, len(df)):
-        # Position delta
-        p1 = df.iloc[i - 1][['utm_x', 'utm_y']].values
-        p2 = df.iloc[i][['utm_x', 'utm_y']].values
-        delta = p2 - p1
+# === Find the changed tracks ===
+changed = {}
+for csv_path in input_dir.glob("*_projected.csv"):
+    out_name = csv_path.stem.replace("_projected", "") + "_velocities.csv"
+    entry = manifest.get(csv_path.name)
+    first_row, current = rows_to_process(csv_path, entry, config)
+    if first_row is None and ((output_dir / out_name).exists() or entry["rows"] == 0):
+        continue
+    changed[csv_path] = current
 
-        # Time delta
-        dt = (df.iloc[i]['timestamp'] - df.iloc[i - 1]['timestamp']).total_seconds()
+# === Calculate all changed tracks at once ===
+tracks = load_tracks(changed)
+velocities = compute_velocities(tracks, line_unit)
 
-        # Project onto reference line
-        proj_disp = np.dot(delta, line_unit)
-        proj_speed = proj_disp / dt if dt > 0 else np.nan
-        proj_speed_mpy = proj_speed * (31_536_000) # 86_400  # m/day
+# Save each track with _velocities suffix
+track_paths = {p.stem.replace("_projected", ""): p for p in changed}
+track_velocities = dict(tuple(velocities.groupby('track_id', sort=False)))
+for track_id, csv_path in track_paths.items():
+    out_path = output_dir / f"{track_id}_velocities.csv"
+    df = track_velocities.get(track_id)
+    if df is not None:
+        df.drop(columns='track_id').to_csv(out_path, index=False)
+    else:
+        out_path.unlink(missing_ok=True)  # no points left, do not keep outdated velocities
+    # tracks without velocities get an entry too, so they are not recalculated on every run
+    manifest[csv_path.name] = dict(changed[csv_path], rows=0 if df is None else len(df), config=config)
 
-        displacements.append(proj_disp)
-        speeds.append(proj_speed_mpy)
+# tracks whose projection was removed (deleted track): remove their velocities too
+removed = removed_inputs(manifest, input_dir)
+for name in removed:
+    (output_dir / (name.replace("_projected.csv", "") + "_velocities.csv")).unlink(missing_ok=True)
+    del manifest[name]
+save_manifest(manifest_path, manifest)
 
-    df['line_displacement_m'] = [np.nan] + displacements
-    df['line_speed_mpy'] = [np.nan] + speeds
+if use_track_store:
+    track_store = TrackStore(track_store_dir)
+    if not track_store.exists('velocities'):
+        # fill a new store with all velocities, not only the changed ones
+        track_store.import_csv('velocities', [p for p in output_dir.glob("*_velocities.csv")
+                                              if p.stem.replace("_velocities", "") not in track_paths],
+                               suffix="_velocities")
+    if changed or removed:
+        track_store.replace_tracks('velocities', velocities,
+                                   list(track_paths) + [name.replace("_projected.csv", "") for name in removed])
 
-    # Save with _velocities suffix
-    out_name = csv_path.stem.replace("_projected", "") + "_velocities.csv"
-    df.to_csv(output_dir / out_name, index=False)
+if write_combined and (changed or removed or not combined_path.exists()):
+    all_tracks = [pd.read_csv(p).assign(track_id=p.stem.replace("_velocities", ""))
+                  for p in output_dir.glob("*_velocities.csv")]
+    if all_tracks:
+        pd.concat(all_tracks, ignore_index=True).to_csv(combined_path, index=False)
+    else:
+        combined_path.unlink(missing_ok=True)
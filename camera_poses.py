@@ -0,0 +1,87 @@
+""" Per-image camera pose corrections for the projection of tracked features.
+The camera drifts slightly between frames. The CameraShiftCalculator from camera_shift/ gives the rotation
+of every frame relative to a fixed reference frame (the frame the camera pose in project_tracked_features
+was set up for). The angles are cached in a pose table, one row per image filename, and only computed for
+frames that are not in the table yet. Clicked pixels are mapped back into the reference frame before they
+are projected, which applies the corrected pose to each point. """
+
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from scipy.spatial.transform import Rotation
+
+POSE_COLUMNS = ['filename', 'reference', 'roll_deg', 'pitch_deg', 'yaw_deg', 'n_matches', 'n_inliers', 'method']
+
+
+def update_pose_table(image_files, reference_path, table_path, focal_mm, sensor_x_mm, sensor_y_mm, n_workers=None,
+                      phase_correlation=True):
+    """ Add the rotation of all frames that are not in the pose table yet and return the table.
+
+    Rows computed against another reference frame are dropped and recomputed. Frames that failed
+    (unreadable file, too few matches) are reported and not stored, so they are retried on the next
+    update; they get NaN angles when the table is reindexed.
+
+    Args:
+        image_files: image paths to estimate the pose for
+        reference_path: image with the pose used in the projection
+        table_path: csv file holding the pose table
+        focal_mm, sensor_x_mm, sensor_y_mm: camera properties
+        n_workers: number of processes for the camera shift calculation
+        phase_correlation: measure small drifts by phase correlation, features only when its peak is weak
+
+    Returns:
+        pd.DataFrame: the pose table, indexed by filename
+    """
+    from camera_shift.calculate_camera_shift import calculate_camera_shifts  # needs cv2, only used here
+
+    table_path = Path(table_path)
+    reference_path = Path(reference_path)
+    if table_path.exists():
+        table = pd.read_csv(table_path)
+        table = table[table['reference'] == reference_path.name]
+    else:
+        table = pd.DataFrame(columns=POSE_COLUMNS)
+
+    known = set(table['filename'])
+    new_files = [f for f in image_files if Path(f).name not in known]
+    if new_files:
+        table_path.parent.mkdir(parents=True, exist_ok=True)
+        # reference features are cached next to the pose table and loaded once per worker
+        shifts = calculate_camera_shifts(reference_path, new_files, focal_mm, sensor_x_mm, sensor_y_mm,
+                                         reference_cache=table_path.with_suffix(".reference.npz"),
+                                         n_workers=n_workers, phase_correlation=phase_correlation)
+        for shift in shifts:
+            if shift['error'] is not None:
+                print(f"No pose for {shift['filename']}: {shift['error']}")
+        # a failed frame may be a file that is still being copied or locked, keep it out of the table to retry it
+        new_rows = [[shift['filename'], reference_path.name, shift['roll_deg'], shift['pitch_deg'],
+                     shift['yaw_deg'], shift['n_matches'], shift['n_inliers'], shift['method']]
+                    for shift in shifts if shift['error'] is None]
+
+        table = pd.concat([table, pd.DataFrame(new_rows, columns=POSE_COLUMNS)], ignore_index=True)
+        table.to_csv(table_path, index=False)
+
+    return table.set_index('filename')
+
+
+def correct_pixels(x_pix, y_pix, roll_deg, pitch_deg, yaw_deg, fx, fy, cx, cy):
+    """ Map pixels of a rotated frame to the pixels they correspond to in the reference frame.
+
+    The angles are those of CameraShiftCalculator (Euler "xyz" angles of the rotation R from the
+    reference to the shifted frame, so x_shifted ~ K R K^-1 x_reference). For a pure rotation
+    x_reference ~ K R^T K^-1 x_shifted. Points with NaN angles are left unchanged.
+
+    Returns:
+        tuple: x_pix, y_pix in the reference frame
+    """
+    angles = np.column_stack([roll_deg, pitch_deg, yaw_deg]).astype(float)
+    known = ~np.isnan(angles).any(axis=1)
+    angles[~known] = 0.0
+
+    K = np.array([[fx, 0, cx], [0, fy, cy], [0, 0, 1]])
+    R = Rotation.from_euler("xyz", angles, degrees=True).as_matrix()
+    points = np.column_stack([x_pix, y_pix, np.ones(len(angles))]).astype(float)
+    rays = points @ np.linalg.inv(K).T
+    rays = np.einsum('nji,nj->ni', R, rays)  # R^T @ ray for every point
+    points = rays @ K.T
+    return points[:, 0] / points[:, 2], points[:, 1] / points[:, 2]
@@ -0,0 +1,82 @@
+""" Benchmark of the feature backends of CameraShiftCalculator on the images in data/.
+
+For every backend the script reports frames per second and the angle error on
+    - a synthetic frame: the reference image rotated by a known rotation, so the true angles are known
+    - the real shifted image: the difference to the first row, the current SIFT configuration (Lowe ratio 0.3,
+      features detected on both images for every frame)
+"""
+import time
+import cv2 as cv
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+from calculate_camera_shift import CameraShiftCalculator, ReferenceFeatures, FOCAL_MM, SENSOR_X_MM, SENSOR_Y_MM
+
+N_REPEATS = 3
+DISTANCE_RATIO_LOWE = 0.7  # the binary backends need a less strict ratio than the 0.3 used for SIFT
+TRUE_ANGLES_DEG = (0.2, -1.5, 0.3)  # roll, pitch, yaw of the synthetic frame
+
+# (name, detector, matcher, mode, Lowe ratio); mode "both": detect on both images (current default path),
+# "cached": cached reference features like the batch mode, "coarse-to-fine": get_features_coarse_to_fine
+BACKENDS = [
+    ("sift current (0.3)", "sift", "flann", "both", 0.3),
+    ("sift + flann", "sift", "flann", "cached", DISTANCE_RATIO_LOWE),
+    ("orb + lsh", "orb", "lsh", "cached", DISTANCE_RATIO_LOWE),
+    ("orb + bf hamming", "orb", "bf", "cached", DISTANCE_RATIO_LOWE),
+    ("akaze + lsh", "akaze", "lsh", "cached", DISTANCE_RATIO_LOWE),
+    ("akaze + bf hamming", "akaze", "bf", "cached", DISTANCE_RATIO_LOWE),
+    ("sift coarse-to-fine", "sift", "flann", "coarse-to-fine", DISTANCE_RATIO_LOWE),
+]
+
+
+def estimate(refer_img, shift_img, reference, detector, matcher, mode, ratio):
+    """ Run one estimate, returns roll, pitch, yaw """
+    if mode == "coarse-to-fine":
+        calc = CameraShiftCalculator(refer_img, shift_img, FOCAL_MM, SENSOR_X_MM, SENSOR_Y_MM,
+                                     detector=detector, matcher=matcher)
+        calc.get_features_coarse_to_fine(distance_ratio_lowe=ratio)
+    elif mode == "both":
+        calc = CameraShiftCalculator(refer_img, shift_img, FOCAL_MM, SENSOR_X_MM, SENSOR_Y_MM,
+                                     detector=detector, matcher=matcher)
+        calc.get_features(distance_ratio_lowe=ratio)
+    else:
+        # only the shifted frame is processed per frame
+        calc = CameraShiftCalculator(None, shift_img, FOCAL_MM, SENSOR_X_MM, SENSOR_Y_MM, reference=reference)
+        calc.get_features(distance_ratio_lowe=ratio)
+    calc.find_homography(method=cv.RANSAC)
+    calc.calc_rotation_matrix()
+    return np.array(calc.get_angles())
+
+
+if __name__ == "__main__":
+
+    refer_img = cv.imread("data/reference_pic.png")
+    shift_img = cv.imread("data/shifted_pic.png")
+
+    # synthetic frame with known rotation: x_shifted ~ K R K^-1 x_reference
+    h, w = refer_img.shape[:2]
+    fx = (FOCAL_MM / SENSOR_X_MM) * w
+    fy = (FOCAL_MM / SENSOR_Y_MM) * h
+    K = np.array([[fx, 0, w / 2], [0, fy, h / 2], [0, 0, 1]])
+    R = Rotation.from_euler("xyz", TRUE_ANGLES_DEG, degrees=True).as_matrix()
+    synthetic_img = cv.warpPerspective(refer_img, K @ R @ np.linalg.inv(K), (w, h))
+
+    sift_angles = None
+    print(f"{'backend':<22}{'frames/s':>10}{'synthetic error (deg)':>24}{'diff to SIFT (deg)':>21}")
+    for name, detector, matcher, mode, ratio in BACKENDS:
+        reference = ReferenceFeatures.from_image(refer_img, detector, matcher) if mode == "cached" else None
+        try:
+            synthetic = estimate(refer_img, synthetic_img, reference, detector, matcher, mode, ratio)
+            start = time.perf_counter()
+            for _ in range(N_REPEATS):
+                real = estimate(refer_img, shift_img, reference, detector, matcher, mode, ratio)
+            fps = N_REPEATS / (time.perf_counter() - start)
+        except RuntimeError as e:
+            print(f"{name:<22} failed: {e}")
+            continue
+
+        if sift_angles is None:
+            sift_angles = real
+        synthetic_error = np.abs(synthetic - TRUE_ANGLES_DEG).max()
+        sift_diff = np.abs(real - sift_angles).max()
+        print(f"{name:<22}{fps:>10.2f}{synthetic_error:>24.3f}{sift_diff:>21.3f}")
@@ -1,4 +1,8 @@
+import hashlib
 import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 from scipy.spatial.transform import Rotation
 import cv2 as cv
 import numpy as np
@@ -13,6 +17,157 @@ FOCAL_MM = 34
 SENSOR_X_MM = 22.3
 SENSOR_Y_MM = 14.9
 
+# feature detector backends: SIFT (float descriptors) or ORB / AKAZE (binary descriptors, much faster)
+DETECTORS = ("sift", "orb", "akaze")
+ORB_N_FEATURES = 5000
+
+def create_detector(detector: str = "sift"):
+    """ Create the feature detector for a backend
+
+    Args:
+        detector: one of "sift", "orb" or "akaze"
+    """
+    if detector == "sift":
+        return cv.SIFT_create()
+    if detector == "orb":
+        return cv.ORB_create(nfeatures=ORB_N_FEATURES)
+    if detector == "akaze":
+        return cv.AKAZE_create()
+    raise ValueError(f"Unknown detector '{detector}', choose from {DETECTORS}")
+
+def create_matcher(detector: str = "sift", matcher: str = None):
+    """ Create the descriptor matcher for a backend
+
+    Args:
+        detector: the detector the descriptors come from
+        matcher: "flann" (KD-tree, SIFT only), "lsh" (FLANN LSH, binary descriptors) or "bf" (brute force,
+            Hamming distance for binary descriptors). Defaults to "flann" for SIFT and "lsh" otherwise.
+    """
+    matcher = matcher or ("flann" if detector == "sift" else "lsh")
+    if matcher == "flann":
+        FLANN_INDEX_KDTREE = 1
+        index_params = dict(algorithm = FLANN_INDEX_KDTREE, trees = 5)
+        search_params = dict(checks = 50)
+        return cv.FlannBasedMatcher(index_params, search_params)
+    if matcher == "lsh":
+        FLANN_INDEX_LSH = 6
+        index_params = dict(algorithm = FLANN_INDEX_LSH, table_number = 6, key_size = 12, multi_probe_level = 1)
+        search_params = dict(checks = 50)
+        return cv.FlannBasedMatcher(index_params, search_params)
+    if matcher == "bf":
+        return cv.BFMatcher(cv.NORM_L2 if detector == "sift" else cv.NORM_HAMMING)
+    raise ValueError(f"Unknown matcher '{matcher}', choose from ('flann', 'lsh', 'bf')")
+
+def ratio_test(matches: list, distance_ratio_lowe: float) -> list:
+    """ Keep the matches that pass Lowe's ratio test (LSH can return less than two neighbours, those are dropped) """
+    return [pair[0] for pair in matches if len(pair) == 2 and pair[0].distance < distance_ratio_lowe*pair[1].distance]
+
+def _as_mask(mask: np.ndarray) -> np.ndarray:
+    """ Static mask as uint8 (255 where features may be detected), as the OpenCV detectors expect it """
+    return None if mask is None else (np.asarray(mask) > 0).astype(np.uint8) * 255
+
+def _mask_hash(mask: np.ndarray) -> str:
+    """ Short identifier of a static mask, stored with cached reference features """
+    return "" if mask is None else hashlib.sha1(np.ascontiguousarray(mask)).hexdigest()[:16]
+
+
+class ReferenceFeatures():
+    """ Keypoints and descriptors of a reference image, together with a matcher index built on them.
+    Computed once per reference image and cached on disk, so a batch of shifted images does not have to
+    run the detector on the reference and build the index again for every image.
+    """
+    def __init__(
+            self,
+            keypoints: tuple,
+            descriptors: np.ndarray,
+            image_shape: tuple,
+            detector: str = "sift",
+            matcher: str = None,
+            mask_hash: str = "",
+        ):
+        """ Initialize from already computed features
+
+        Args:
+            keypoints: cv.KeyPoint objects of the reference image
+            descriptors: descriptors belonging to the keypoints
+            image_shape: shape of the reference image
+            detector: backend the features were computed with, see create_detector
+            matcher: matcher to build on the descriptors, see create_matcher
+            mask_hash: identifier of the static mask used during detection
+        """
+        self.keypoints = keypoints
+        self.descriptors = descriptors
+        self.image_shape = tuple(image_shape)
+        self.detector = detector
+        self.matcher_name = matcher or ""
+        self.mask_hash = mask_hash
+
+        # build the index on the reference descriptors once, shifted images are queried against it
+        self.matcher = create_matcher(detector, matcher)
+        self.matcher.add([self.descriptors])
+        self.matcher.train()
+
+    @classmethod
+    def from_image(cls, refer_img: np.ndarray, detector: str = "sift", matcher: str = None, mask: np.ndarray = None) -> "ReferenceFeatures":
+        """ Run the detector on the reference image, only inside the mask if one is given """
+        mask = _as_mask(mask)
+        kp_ref, des_ref = create_detector(detector).detectAndCompute(refer_img, mask)
+        return cls(kp_ref, des_ref, refer_img.shape, detector, matcher, _mask_hash(mask))
+
+    def save(self, path):
+        """ Store keypoints and descriptors as .npz """
+        kp = np.array([(*k.pt, k.size, k.angle, k.response, k.octave, k.class_id) for k in self.keypoints], dtype=np.float64)
+        np.savez(path, keypoints=kp, descriptors=self.descriptors, image_shape=np.array(self.image_shape),
+                 detector=self.detector, matcher=self.matcher_name, mask_hash=self.mask_hash)
+
+    @classmethod
+    def load(cls, path) -> "ReferenceFeatures":
+        """ Load keypoints and descriptors stored with save() """
+        with np.load(path) as data:
+            keypoints = tuple(
+                cv.KeyPoint(x, y, size, angle, response, int(octave), int(class_id))
+                for x, y, size, angle, response, octave, class_id in data["keypoints"]
+            )
+            # caches written before the detector backends existed hold plain SIFT features
+            detector = str(data["detector"]) if "detector" in data else "sift"
+            matcher = str(data["matcher"]) if "matcher" in data else ""
+            mask_hash = str(data["mask_hash"]) if "mask_hash" in data else ""
+            return cls(keypoints, data["descriptors"], tuple(data["image_shape"]), detector, matcher or None, mask_hash)
+
+    @classmethod
+    def cached(cls, reference_path, cache_path=None, detector: str = "sift", matcher: str = None, mask: np.ndarray = None) -> "ReferenceFeatures":
+        """ Load the features of a reference image from the cache, computing them if the image, backend or mask changed.
+
+        Args:
+            reference_path: the reference image
+            cache_path: .npz file for the features, defaults to <reference image>.<detector>.npz
+            detector, matcher: backend, see create_detector and create_matcher
+            mask: static mask, features are only detected where it is nonzero
+
+        Returns:
+            ReferenceFeatures: the features of the reference image
+        """
+        reference_path = Path(reference_path)
+        cache_path = Path(cache_path) if cache_path is not None else reference_path.with_suffix(f".{detector}.npz")
+        if cache_path.exists() and cache_path.stat().st_mtime_ns >= reference_path.stat().st_mtime_ns:
+            features = cls.load(cache_path)
+            if (features.detector, features.matcher_name, features.mask_hash) == (detector, matcher or "", _mask_hash(_as_mask(mask))):
+                return features
+
+        features = cls.from_image(cv.imread(str(reference_path)), detector, matcher, mask)
+        features.save(cache_path)
+        return features
+
+    def match(self, descriptors: np.ndarray, distance_ratio_lowe: float) -> list:
+        """ Match descriptors of a shifted image against the reference, keeping matches passing Lowe's ratio test.
+
+        Returns:
+            list: cv.DMatch with queryIdx indexing the reference keypoints and trainIdx the shifted keypoints
+        """
+        matches = ratio_test(self.matcher.knnMatch(descriptors, k=2), distance_ratio_lowe)
+        return [cv.DMatch(m.trainIdx, m.queryIdx, m.distance) for m in matches]
+
+
 class CameraShiftCalculator():
     """ Class that is used to calculate the camera shifts (yawn angle) between two images.
     """
@@ -23,27 +178,40 @@ class CameraShiftCalculator():
             focal_mm: float, 
             sensor_x_mm: float, 
             sensor_y_mm: float,
-
+            reference: ReferenceFeatures = None,
+            detector: str = "sift",
+            matcher: str = None,
+            mask: np.ndarray = None,
         ):
         """ Initialize the class by providing two images
 
         Args:
-            refer_img : Reference image with known yawn angle
+            refer_img : Reference image with known yawn angle, can be None if reference is given
             shift_img: Shifted image for which we want to know the new yawn angle
             focal_mm: focal length of camera in mm
             sensor_x_mm: pixel size of sensor along x-axis (width)
             sensor_y_mm: pixel size of sensor along y-axis (height)
+            reference: precomputed features of the reference image, skips the detector on the reference
+            detector: feature detector backend, "sift", "orb" or "akaze" (taken from reference if given)
+            matcher: descriptor matcher, "flann", "lsh" or "bf" (see create_matcher)
+            mask: static mask (same size as the images, nonzero on stable terrain like bedrock),
+                features are only detected inside it so the moving ice is ignored
         """
         # attributes set from the beginning
         self.refer_img = refer_img 
         self.shift_img = shift_img
+        self.reference = reference
+        self.detector = reference.detector if reference is not None else detector
+        self.matcher = (reference.matcher_name or None) if reference is not None else matcher
+        self.mask = _as_mask(mask)
         self.focal_mm = focal_mm                # taken from project_tracked_features
         self.sensor_x_mm = sensor_x_mm          # pixel size on sensor, along x-axis
         self.sensor_y_mm = sensor_y_mm          # pixel size on sensor, along y-axis
-        self.cx = self.refer_img.shape[1] / 2   # half of width to get img center
-        self.cy = self.refer_img.shape[0] / 2   # half of height to get img center
-        self.fx = (self.focal_mm / self.sensor_x_mm) * self.refer_img.shape[1]
-        self.fy = (self.focal_mm / self.sensor_y_mm) * self.refer_img.shape[0]
+        refer_shape = self.refer_img.shape if self.refer_img is not None else self.reference.image_shape
+        self.cx = refer_shape[1] / 2   # half of width to get img center
+        self.cy = refer_shape[0] / 2   # half of height to get img center
+        self.fx = (self.focal_mm / self.sensor_x_mm) * refer_shape[1]
+        self.fy = (self.focal_mm / self.sensor_y_mm) * refer_shape[0]
 
         # attributes set during usage
         self._H = None 
@@ -53,6 +221,7 @@ class CameraShiftCalculator():
         self._shifted_points = None 
         self._reference_kp = None 
         self._shifted_kp = None
+        self._phase_response = None
 
         # the angles that can be returned in the end
         self.roll_deg = None
@@ -67,7 +236,13 @@ class CameraShiftCalculator():
 
     # If this is not working well, I need to do this manually instead
     def get_sift_features(self, min_match_count: int = 10, distance_ratio_lowe: float = 0.3) -> dict:
-        """ Retrieve SIFT features and store only good features.
+        """ Retrieve features and store only good features. Uses the detector chosen at initialization
+        (SIFT by default), see get_features.
+        """
+        self.get_features(min_match_count, distance_ratio_lowe)
+
+    def get_features(self, min_match_count: int = 10, distance_ratio_lowe: float = 0.3):
+        """ Retrieve features with the chosen detector and store only good features.
 
         Args:
             min_match_count: Minimum number of good features that must be found.
@@ -84,28 +259,99 @@ class CameraShiftCalculator():
         Raises:
             RuntimeError if not enough good matches were found
         """
-        # initiate sift detector
-        sift = cv.SIFT_create()
-
-        # find keypoints and descriptors with SIFT
-        kp_ref, des_ref = sift.detectAndCompute(self.refer_img, None)
-        kp_shi, des_shi = sift.detectAndCompute(self.shift_img, None)
+        # initiate detector
+        detector = create_detector(self.detector)
+
+        if self.reference is not None:
+            # reference features and index are already there, only the shifted image needs the detector
+            kp_ref = self.reference.keypoints
+            kp_shi, des_shi = detector.detectAndCompute(self.shift_img, self.mask)
+            good_matches = self.reference.match(des_shi, distance_ratio_lowe)
+        else:
+            # find keypoints and descriptors
+            kp_ref, des_ref = detector.detectAndCompute(self.refer_img, self.mask)
+            kp_shi, des_shi = detector.detectAndCompute(self.shift_img, self.mask)
+            good_matches = self._match(des_ref, des_shi, distance_ratio_lowe)
+
+        self._set_matches(kp_ref, kp_shi, good_matches, min_match_count)
+
+    def get_features_coarse_to_fine(
+            self,
+            scale: float = 0.25,
+            window: tuple = None,
+            tolerance_px: float = 8.0,
+            min_match_count: int = 10,
+            distance_ratio_lowe: float = 0.3,
+        ):
+        """ Estimate the homography on downscaled images first, then refine it at full resolution inside a window.
 
-        # choose algorithm here
-        FLANN_INDEX_KDTREE = 1
-        index_params = dict(algorithm = FLANN_INDEX_KDTREE, trees = 5)
-        search_params = dict(checks = 50)
-        
-        flann = cv.FlannBasedMatcher(index_params, search_params)
-        
-        matches = flann.knnMatch(des_ref,des_shi,k=2)
+        The coarse homography predicts where the window lies in the shifted image, so the detector only runs
+        on these two crops at full resolution, and matches that disagree with the prediction by more than
+        tolerance_px are dropped.
 
-        # store all the good matches as per Lowe's ratio test.
-        good_matches = []
-        for m, n in matches:
-            if m.distance < distance_ratio_lowe*n.distance:
-                good_matches.append(m)
+        Args:
+            scale: downscaling factor of the coarse pass
+            window: (x0, y0, x1, y1) full resolution window in the reference image, defaults to the central half
+            tolerance_px: maximum distance in pixels between a match and its coarse prediction
+            min_match_count: Minimum number of good features that must be found (in both passes).
+            distance_ratio_lowe: Ratio for Lowe's test.
 
+        Raises:
+            RuntimeError if not enough good matches were found
+        """
+        if self.refer_img is None:
+            raise ValueError("The coarse-to-fine mode needs the reference image itself, not only cached features")
+        detector = create_detector(self.detector)
+        h, w = self.refer_img.shape[:2]
+
+        # coarse pass on downscaled images
+        small = lambda img, interp: cv.resize(img, None, fx=scale, fy=scale, interpolation=interp)
+        small_mask = small(self.mask, cv.INTER_NEAREST) if self.mask is not None else None
+        kp_ref, des_ref = detector.detectAndCompute(small(self.refer_img, cv.INTER_AREA), small_mask)
+        kp_shi, des_shi = detector.detectAndCompute(small(self.shift_img, cv.INTER_AREA), small_mask)
+        self._set_matches(kp_ref, kp_shi, self._match(des_ref, des_shi, distance_ratio_lowe), min_match_count)
+        H_small, _ = cv.findHomography(self._reference_points, self._shifted_points, cv.RANSAC, 3.0)
+        if H_small is None:
+            raise RuntimeError("No homography could be found on the downscaled images.")
+        S = np.diag([scale, scale, 1.0])
+        H_coarse = np.linalg.inv(S) @ H_small @ S
+
+        # full resolution pass on crops: the window and the part of the shifted image it maps to
+        x0, y0, x1, y1 = window if window is not None else (w // 4, h // 4, 3 * w // 4, 3 * h // 4)
+        corners = cv.perspectiveTransform(np.float32([[x0, y0], [x1, y0], [x1, y1], [x0, y1]]).reshape(-1, 1, 2), H_coarse)
+        bx, by, bw, bh = cv.boundingRect(np.int32(corners))
+        margin = int(np.ceil(tolerance_px))
+        kp_ref, des_ref = self._detect_in_window(detector, self.refer_img, (x0, y0, x1, y1))
+        kp_shi, des_shi = self._detect_in_window(detector, self.shift_img, (bx - margin, by - margin, bx + bw + margin, by + bh + margin))
+        good_matches = self._match(des_ref, des_shi, distance_ratio_lowe)
+
+        # keep only matches that agree with the coarse homography
+        if good_matches:
+            pts_ref = np.float32([kp_ref[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
+            pts_shi = np.float32([kp_shi[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
+            distance = np.linalg.norm(cv.perspectiveTransform(pts_ref, H_coarse) - pts_shi, axis=2).ravel()
+            good_matches = [m for m, d in zip(good_matches, distance) if d < tolerance_px]
+        self._set_matches(kp_ref, kp_shi, good_matches, min_match_count)
+
+    def _detect_in_window(self, detector, img: np.ndarray, window: tuple) -> tuple:
+        """ Detect features on a crop of the image (so the detector only works on the crop), in full image coordinates """
+        h, w = img.shape[:2]
+        x0, y0 = max(int(window[0]), 0), max(int(window[1]), 0)
+        x1, y1 = min(int(window[2]), w), min(int(window[3]), h)
+        mask = self.mask[y0:y1, x0:x1] if self.mask is not None else None
+        kp, des = detector.detectAndCompute(img[y0:y1, x0:x1], mask)
+        kp = tuple(cv.KeyPoint(k.pt[0] + x0, k.pt[1] + y0, k.size, k.angle, k.response, k.octave, k.class_id) for k in kp)
+        return kp, des
+
+    def _match(self, des_ref: np.ndarray, des_shi: np.ndarray, distance_ratio_lowe: float) -> list:
+        """ Match reference against shifted descriptors and apply Lowe's ratio test """
+        if des_ref is None or des_shi is None:
+            return []
+        matcher = create_matcher(self.detector, self.matcher)
+        return ratio_test(matcher.knnMatch(des_ref, des_shi, k=2), distance_ratio_lowe)
+
+    def _set_matches(self, kp_ref: tuple, kp_shi: tuple, good_matches: list, min_match_count: int):
+        """ Check the number of good matches and store matched points and keypoints """
         # RuntimeError is a bit rough here, but let's keep it for now since it is very unlikely
         if not len(good_matches) > min_match_count:
             raise RuntimeError(f"Only {len(good_matches)} matches were found, but {min_match_count} are required. Consider setting the distance ratio for the Lowe test higher.")
@@ -121,13 +367,18 @@ class CameraShiftCalculator():
         self._reference_kp = kp_ref 
         self._shifted_kp = kp_shi
     
-    def find_homography(self):
+    def find_homography(self, method: int = 0, ransac_threshold: float = 3.0):
         """ Find the homography 
+
+        Args:
+            method: 0 for a least squares fit on all matches, or cv.RANSAC to reject outliers
+            ransac_threshold: maximum reprojection error in pixels for a match to count as inlier (RANSAC only)
+
         Sets:
                 np.ndarray: The homography
                 np.ndarray: The mask
         """
-        self._H, self._mask = cv.findHomography(self._reference_points, self._shifted_points)
+        self._H, self._mask = cv.findHomography(self._reference_points, self._shifted_points, method, ransac_threshold)
     
     def draw_matched_features(self):
         """ Find the homography and visualize the matched keypoints and the overlap.
@@ -208,6 +459,193 @@ class CameraShiftCalculator():
         """
         return self.roll_deg, self.pitch_deg, self.yaw_deg
 
+    def phase_correlation(self, log_polar: bool = False, scale: float = 0.5) -> float:
+        """ Estimate a small camera rotation with FFT phase correlation instead of features.
+
+        A small rotation of the camera shifts the whole image: a horizontal shift dx is a rotation of
+        atan(dx / fx) about the camera y-axis (pitch_deg here, the heading in project_tracked_features),
+        a vertical shift dy a rotation of -atan(dy / fy) about the x-axis (roll_deg). With log_polar,
+        the rotation about the optical axis (yaw_deg) is estimated first on the log-polar transformed
+        magnitude spectra, and removed before the shift is measured.
+
+        Args:
+            log_polar: also estimate the rotation about the optical axis
+            scale: downscaling factor of the images used for the correlation
+
+        Sets:
+            the angles, and self._H to the homography of the estimated rotation
+
+        Returns:
+            float: response of the correlation peak, a confidence between 0 and 1
+        """
+        if self.refer_img is None:
+            raise ValueError("Phase correlation needs the reference image itself, not only cached features")
+
+        def prepare(img):
+            gray = cv.cvtColor(img, cv.COLOR_BGR2GRAY) if img.ndim == 3 else img
+            return cv.resize(gray, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA).astype(np.float32)
+
+        ref = prepare(self.refer_img)
+        shi = prepare(self.shift_img)
+        window = cv.createHanningWindow(ref.shape[::-1], cv.CV_32F)
+        center = (self.cx * scale, self.cy * scale)
+
+        rotation_deg = 0.0
+        if log_polar:
+            # the magnitude spectrum does not depend on the shift, a rotation becomes a shift along the angle
+            # axis of its log-polar transform. A square crop keeps rotations of the image rotations of the spectrum.
+            n = min(ref.shape)
+            rows, cols = (ref.shape[0] - n) // 2, (ref.shape[1] - n) // 2
+            square_window = cv.createHanningWindow((n, n), cv.CV_32F)
+            ramp = np.cos(np.linspace(-np.pi / 2, np.pi / 2, n))
+            high_pass = 1 - np.outer(ramp, ramp)  # suppress the low frequencies that dominate every spectrum
+            def log_polar_spectrum(img):
+                crop = img[rows:rows + n, cols:cols + n] * square_window
+                spectrum = np.log1p(np.abs(np.fft.fftshift(np.fft.fft2(crop)))) * high_pass
+                return cv.warpPolar(spectrum.astype(np.float32), (n, n), (n / 2, n / 2), n / 2, cv.WARP_POLAR_LOG)
+            polar_ref = log_polar_spectrum(ref)
+            (_, angle_shift), _ = cv.phaseCorrelate(polar_ref, log_polar_spectrum(shi))
+            rotation_deg = 360.0 * angle_shift / n
+            # undo the rotation about the principal point before measuring the shift
+            derotate = cv.getRotationMatrix2D(center, rotation_deg, 1.0)
+            shi = cv.warpAffine(shi, derotate, shi.shape[::-1], flags=cv.INTER_LINEAR, borderMode=cv.BORDER_REFLECT)
+
+        (dx, dy), response = cv.phaseCorrelate(ref, shi, window)
+        dx, dy = dx / scale, dy / scale
+
+        self.roll_deg = -math.degrees(math.atan2(dy, self.fy))
+        self.pitch_deg = math.degrees(math.atan2(dx, self.fx))
+        self.yaw_deg = rotation_deg
+        K = np.array([[self.fx, 0, self.cx], [0, self.fy, self.cy], [0, 0, 1]])
+        R = Rotation.from_euler("xyz", [self.roll_deg, self.pitch_deg, self.yaw_deg], degrees=True).as_matrix()
+        self._H = K @ R @ np.linalg.inv(K)
+        self._phase_response = response
+        return response
+
+    def estimate_angles(
+            self,
+            min_response: float = 0.3,
+            log_polar: bool = False,
+            min_match_count: int = MIN_MATCH_COUNT,
+            distance_ratio_lowe: float = DISTANCE_RATIO_LOWE,
+        ) -> str:
+        """ Estimate the angles with phase correlation, and only run the feature pipeline when the
+        correlation peak is weak (large drift, clouds, snow) or there is no reference image to correlate with.
+
+        Args:
+            min_response: minimum correlation peak response to accept the phase correlation
+            log_polar: also estimate the rotation about the optical axis by phase correlation
+            min_match_count, distance_ratio_lowe: settings of the feature fallback
+
+        Returns:
+            str: "phase" or "features", the method that produced the angles
+        """
+        if self.refer_img is not None and self.phase_correlation(log_polar) >= min_response:
+            return "phase"
+        self.get_features(min_match_count, distance_ratio_lowe)
+        self.find_homography(method=cv.RANSAC)
+        self.calc_rotation_matrix()
+        return "features"
+
+# state of a worker process in calculate_camera_shifts, loaded once per worker
+_worker_reference = None
+_worker_refer_img = None
+_worker_mask = None
+
+def _init_worker(reference_cache: str, mask: np.ndarray, reference_path: str):
+    """ Load the cached reference features (and build the matcher index) once per worker process,
+    and the reference image itself if the phase correlation fast path is used """
+    global _worker_reference, _worker_refer_img, _worker_mask
+    _worker_reference = ReferenceFeatures.load(reference_cache)
+    _worker_refer_img = cv.imread(reference_path) if reference_path is not None else None
+    _worker_mask = mask
+
+def _shift_for_image(args: tuple) -> dict:
+    """ Estimate the shift of one image against the worker's reference, returns one row of the table """
+    image_path, focal_mm, sensor_x_mm, sensor_y_mm, min_match_count, distance_ratio_lowe, min_response, log_polar = args
+    row = dict(filename=Path(image_path).name, H=None, n_matches=0, n_inliers=0,
+               roll_deg=np.nan, pitch_deg=np.nan, yaw_deg=np.nan, method=None, response=np.nan, error=None)
+    try:
+        shift_img = cv.imread(str(image_path))
+        if shift_img is None:
+            raise IOError(f"Could not read {image_path}")
+        calc = CameraShiftCalculator(
+            _worker_refer_img,
+            shift_img,
+            focal_mm,
+            sensor_x_mm,
+            sensor_y_mm,
+            reference=_worker_reference,
+            mask=_worker_mask,
+        )
+        row["method"] = calc.estimate_angles(min_response, log_polar, min_match_count, distance_ratio_lowe)
+    except Exception as e:  # one unreadable or unusable frame must not stop the whole batch
+        row["error"] = str(e)
+        return row
+    row["H"] = calc._H
+    row["response"] = calc._phase_response if calc._phase_response is not None else np.nan
+    if row["method"] == "features":
+        row["n_matches"] = len(calc._good_matches)
+        row["n_inliers"] = int(calc._mask.sum())
+    row["roll_deg"], row["pitch_deg"], row["yaw_deg"] = calc.get_angles()
+    return row
+
+def calculate_camera_shifts(
+        reference_path,
+        image_paths: list,
+        focal_mm: float,
+        sensor_x_mm: float,
+        sensor_y_mm: float,
+        reference_cache=None,
+        min_match_count: int = MIN_MATCH_COUNT,
+        distance_ratio_lowe: float = DISTANCE_RATIO_LOWE,
+        n_workers: int = None,
+        detector: str = "sift",
+        matcher: str = None,
+        mask: np.ndarray = None,
+        phase_correlation: bool = False,
+        min_response: float = 0.3,
+        log_polar: bool = False,
+    ) -> list:
+    """ Calculate the camera shift of many images against one reference image.
+
+    The reference keypoints and descriptors are computed once and cached on disk (see
+    ReferenceFeatures.cached). The images are spread over a process pool, every worker loads the
+    cached reference state and builds the matcher index once, then streams its images through it.
+    Homographies are fitted with RANSAC so the inlier count is meaningful. With phase_correlation,
+    small drifts are measured by FFT phase correlation and the features are only used for frames
+    with a weak correlation peak (see CameraShiftCalculator.estimate_angles).
+
+    Args:
+        reference_path: reference image with known angles
+        image_paths: shifted images
+        focal_mm, sensor_x_mm, sensor_y_mm: camera properties
+        reference_cache: .npz file for the reference features, defaults to <reference image>.<detector>.npz
+        min_match_count: minimum number of good matches
+        distance_ratio_lowe: ratio for Lowe's test
+        n_workers: number of processes, defaults to the number of CPUs
+        detector, matcher: feature backend, see create_detector and create_matcher
+        mask: static mask, features are only detected where it is nonzero
+        phase_correlation: try phase correlation first
+        min_response: minimum correlation peak response to accept the phase correlation
+        log_polar: also estimate the rotation about the optical axis by phase correlation
+
+    Returns:
+        list: one dict per image (in input order) with filename, H, n_matches, n_inliers, roll_deg,
+            pitch_deg, yaw_deg, method ("phase" or "features"), response (phase correlation peak)
+            and error (None if the estimate succeeded)
+    """
+    reference_path = Path(reference_path)
+    reference_cache = Path(reference_cache) if reference_cache is not None else reference_path.with_suffix(f".{detector}.npz")
+    ReferenceFeatures.cached(reference_path, reference_cache, detector, matcher, mask)
+
+    tasks = [(p, focal_mm, sensor_x_mm, sensor_y_mm, min_match_count, distance_ratio_lowe, min_response, log_polar) for p in image_paths]
+    n_workers = n_workers or os.cpu_count()
+    initargs = (str(reference_cache), _as_mask(mask), str(reference_path) if phase_correlation else None)
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=initargs) as pool:
+        return list(pool.map(_shift_for_image, tasks, chunksize=max(1, len(tasks) // (4 * n_workers))))
+
+
 if __name__ == "__main__":
 
     refer_img = cv.imread("data/reference_pic.png")
@@ -0,0 +1,131 @@
+""" Fast drawing of the track map of plot_figures.py.
+The DEM is read at the resolution of the figure (rasterio decimated read with out_shape, only the part in
+bounds) and turned into a coloured hillshade once; the RGBA raster is cached in ./cache, keyed by the DEM file,
+bounds, size and shading. All tracks are drawn as one LineCollection, coloured by speed or region, instead of
+one line (and legend entry) per track. """
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import rasterio
+from affine import Affine
+from matplotlib import colormaps
+from matplotlib.collections import LineCollection
+from matplotlib.colors import LightSource, Normalize, to_rgba_array
+from matplotlib.lines import Line2D
+from rasterio.windows import Window, from_bounds
+
+from pixel_lut import lut_key
+from track_velocities import SECONDS_PER_YEAR
+from velocity_aggregation import track_region
+
+SPEED_PERCENTILES = (2, 98)  # range of the speed colormap, a few outliers do not stretch it
+
+
+def read_dem_decimated(dem_path, width, bounds=None):
+    """ Read the DEM (or the part within bounds) resampled to width columns
+
+    Args:
+        dem_path: DEM file
+        width: number of columns to read, rows follow from the aspect ratio (never more than the DEM has)
+        bounds: (left, bottom, right, top), None for the whole DEM
+
+    Returns:
+        tuple: float32 array with NaN for nodata and its affine transform
+    """
+    with rasterio.open(dem_path) as dem_ds:
+        window = Window(0, 0, dem_ds.width, dem_ds.height)
+        if bounds is not None:
+            window = from_bounds(*bounds, transform=dem_ds.transform).round_offsets(op='floor') \
+                .round_lengths(op='ceil').intersection(window)
+        out_width = max(min(int(width), int(window.width)), 1)
+        out_height = max(round(window.height * out_width / window.width), 1)
+        dem = dem_ds.read(1, window=window, out_shape=(out_height, out_width), masked=True)
+        transform = dem_ds.window_transform(window) * Affine.scale(window.width / out_width,
+                                                                   window.height / out_height)
+    return np.ma.filled(dem.astype(np.float32), np.nan), transform
+
+
+def shade_dem(dem, transform, cmap='terrain', azimuth=315, altitude=45, vert_exag=1):
+    """ Coloured hillshade of a DEM as an RGBA uint8 image, transparent where the DEM has no data """
+    nodata = np.isnan(dem)
+    filled = np.where(nodata, np.nanmin(dem) if not nodata.all() else 0, dem)
+    light = LightSource(azdeg=azimuth, altdeg=altitude)
+    rgba = light.shade(filled, cmap=colormaps[cmap], blend_mode='overlay', vert_exag=vert_exag,
+                       dx=abs(transform.a), dy=abs(transform.e))
+    rgba[nodata, 3] = 0
+    return (rgba * 255).astype(np.uint8)
+
+
+def load_shaded_dem(dem_path, cache_dir, width, bounds=None, cmap='terrain', azimuth=315, altitude=45):
+    """ Cached coloured hillshade of the DEM at width columns, built first if it is not in cache_dir
+
+    Returns:
+        tuple: RGBA uint8 image and its extent (left, right, bottom, top) for imshow
+    """
+    cache_dir = Path(cache_dir)
+    key = lut_key(dem_path, width=width, bounds=None if bounds is None else list(bounds), cmap=cmap,
+                  light=[azimuth, altitude])
+    image_path = cache_dir / f"dem_shaded_{key}.npy"
+    meta_path = cache_dir / f"dem_shaded_{key}.json"
+
+    if not (image_path.exists() and meta_path.exists()):
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        for old in cache_dir.glob("dem_shaded_*"):
+            old.unlink()
+        dem, transform = read_dem_decimated(dem_path, width, bounds)
+        west, south, east, north = rasterio.transform.array_bounds(*dem.shape, transform)
+        np.save(image_path, shade_dem(dem, transform, cmap, azimuth, altitude))
+        with open(meta_path, 'w') as f:
+            json.dump(dict(extent=[west, east, south, north]), f)
+
+    with open(meta_path) as f:
+        extent = json.load(f)['extent']
+    return np.load(image_path), extent
+
+
+def track_collection(tracks, color_by="speed", cmap='viridis', bounds=None, percentiles=SPEED_PERCENTILES, **kwargs):
+    """ All tracks as one LineCollection of the segments between consecutive points
+
+    Args:
+        tracks: frame with track_id, timestamp, utm_x and utm_y
+        color_by: "speed" (horizontal speed of each segment in m/yr) or "region" (upper / lower icefall)
+        cmap: colormap of the speeds
+        bounds: (min, max) m/yr, speeds outside are left out of the colormap range
+        percentiles: percentiles of the speeds that span the colormap, speeds beyond get its end colours
+        kwargs: passed to LineCollection
+
+    Returns:
+        tuple: LineCollection for ax.add_collection, and legend handles of the regions (empty for speed,
+            use a colorbar of the collection with extend='both')
+    """
+    df = tracks.sort_values(['track_id', 'timestamp'], kind='stable')
+    ids = df['track_id'].to_numpy()
+    xy = df[['utm_x', 'utm_y']].to_numpy(dtype=float)
+    same_track = ids[1:] == ids[:-1]
+    segments = np.stack([xy[:-1], xy[1:]], axis=1)[same_track]
+
+    if color_by == "speed":
+        seconds = pd.to_datetime(df['timestamp']).diff().dt.total_seconds().to_numpy()[1:][same_track]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speed = np.hypot(*(segments[:, 1] - segments[:, 0]).T) / seconds * SECONDS_PER_YEAR
+        speed = np.where(seconds > 0, speed, np.nan)
+        valid = speed[np.isfinite(speed)]
+        if bounds is not None:
+            valid = valid[(valid >= bounds[0]) & (valid <= bounds[1])]
+        vmin, vmax = np.percentile(valid, percentiles) if len(valid) else (0, 1)
+        lines = LineCollection(segments, cmap=cmap, norm=Normalize(vmin, vmax), **kwargs)
+        lines.set_array(speed)
+        handles = []
+    elif color_by == "region":
+        track_regions = {track_id: track_region(track_id) for track_id in pd.unique(ids)}
+        regions = pd.Series(ids[:-1][same_track]).map(track_regions).to_numpy()
+        names = sorted(set(track_regions.values()))
+        palette = to_rgba_array([f"C{i}" for i in range(len(names))])
+        lines = LineCollection(segments, colors=palette[np.searchsorted(names, regions)], **kwargs)
+        handles = [Line2D([], [], color=f"C{i}", label=f"{name} icefall") for i, name in enumerate(names)]
+    else:
+        raise ValueError(f"Unknown color_by {color_by}, use 'speed' or 'region'")
+    return lines, handles
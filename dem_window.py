@@ -0,0 +1,87 @@
+""" Reads only the part of the DEM the camera can see.
+The horizontal field of view of the camera, out to max_dist, is a wedge; its bounding box is read from the DEM
+with a rasterio Window and cached as a float32 .npy file (NaN for nodata) with its affine transform, keyed like
+the pixel lookup table by the DEM file and the camera pose. Later runs memory-map the cached window, so startup
+time and memory follow the visible area and not the size of the survey DEM. """
+
+import json
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.windows import Window, from_bounds
+
+from pixel_lut import lut_key
+
+
+def horizontal_fov(focal_mm, sensor_width_mm):
+    """ Horizontal field of view in degrees """
+    return 2 * np.degrees(np.arctan(sensor_width_mm / 2 / focal_mm))
+
+
+def view_bounds(cam_x, cam_y, yaw_deg, hfov_deg, max_dist, margin_deg=5, n_arc=64):
+    """ Bounding box of the wedge seen by the camera out to max_dist
+
+    Args:
+        cam_x, cam_y: camera position
+        yaw_deg: heading of the optical axis, clockwise from north (as in terrain_projection.ray_to_world)
+        hfov_deg: horizontal field of view
+        max_dist: maximum distance along the ray in m
+        margin_deg: extra angle on both sides, e.g. for the drift corrections of camera_poses.py
+
+    Returns:
+        tuple: left, bottom, right, top
+    """
+    half = hfov_deg / 2 + margin_deg
+    angles = np.radians(np.linspace(yaw_deg - half, yaw_deg + half, n_arc))
+    xs = np.append(cam_x + max_dist * np.sin(angles), cam_x)
+    ys = np.append(cam_y + max_dist * np.cos(angles), cam_y)
+    return xs.min(), ys.min(), xs.max(), ys.max()
+
+
+def read_dem_window(dem_path, bounds):
+    """ Read the part of the DEM within bounds (left, bottom, right, top)
+
+    Returns:
+        tuple: float32 array with NaN for nodata and the affine transform of the window
+    """
+    with rasterio.open(dem_path) as dem_ds:
+        window = from_bounds(*bounds, transform=dem_ds.transform)
+        window = window.round_offsets(op='floor').round_lengths(op='ceil')
+        window = window.intersection(Window(0, 0, dem_ds.width, dem_ds.height))
+        dem = dem_ds.read(1, window=window, masked=True)
+        transform = dem_ds.window_transform(window)
+    return np.ma.filled(dem.astype(np.float32), np.nan), transform
+
+
+def load_dem_window(dem_path, cache_dir, cam_x, cam_y, yaw_deg, hfov_deg, max_dist, margin_deg=5):
+    """ Memory-map the visible part of the DEM, reading and caching it first if it is not in cache_dir yet
+
+    Returns:
+        tuple:
+            np.ndarray: float32 DEM window, NaN for nodata (read-only memmap)
+            Affine: transform of the window
+            Path: the cached .npy file (e.g. to key derived data such as terrain_projection.load_max_pyramid)
+    """
+    cache_dir = Path(cache_dir)
+    key = lut_key(dem_path, cam=[cam_x, cam_y], yaw=yaw_deg, hfov=hfov_deg, max_dist=max_dist, margin=margin_deg)
+    window_path = cache_dir / f"dem_window_{key}.npy"
+    meta_path = cache_dir / f"dem_window_{key}.json"
+
+    if not (window_path.exists() and meta_path.exists()):
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # windows of an older pose or dem are no longer valid
+        for old in cache_dir.glob("dem_window_*"):
+            old.unlink()
+        bounds = view_bounds(cam_x, cam_y, yaw_deg, hfov_deg, max_dist, margin_deg)
+        dem, transform = read_dem_window(dem_path, bounds)
+        tmp_path = cache_dir / f"dem_window_{key}.tmp.npy"
+        np.save(tmp_path, dem)
+        tmp_path.replace(window_path)
+        with open(meta_path, 'w') as f:
+            json.dump(dict(transform=list(transform)[:6], shape=list(dem.shape), dem_path=str(dem_path)), f)
+
+    with open(meta_path) as f:
+        transform = Affine(*json.load(f)['transform'])
+    return np.load(window_path, mmap_mode='r'), transform, window_path
@@ -0,0 +1,164 @@
+""" Python version of wrapper.m: mean ice velocity per image pair from the EMT Trajectories_ObjectPoints_ImgPair_*.dat files.
+The .dat files are read with numpy in one go instead of line by line (the layouts of importfile_lower_icefall.m,
+importfile_LSM_consecutive_img.m and importfile_fixed_master_img.m), only files with a malformed line are parsed
+line by line. Folders are processed in parallel and the velocities are filtered as in wrapper.m. The result is written to LowerIcefallMeanVel.csv (DateTime, mean_vel_md).
+
+get_date.m, which wrapper.m uses for the acquisition times of an image pair, is not part of this repository.
+Here the times come from the image file names (%Y%m%d%H%M%S, as in feature_tracking.py): image i of a pair
+"ImgPair_i-j" is the i-th image of the sorted image folder that was given to EMT. """
+
+#%%
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# (first data line, column names, field widths or None for whitespace separated columns)
+LAYOUTS = {
+    "lower_icefall": (8, ["TrajectoryID", "dXm", "dYm", "dZm", "dxpix", "dypix", "sdxpix", "sdypix",
+                          "s0LSMgreyValue", "CC_Coeff", "usedPixel", "vmd"], None),
+    "lsm_consecutive": (8, ["TrajectoryID", "dXm", "dYm", "dZm", "dxpix", "dypix", "sdxpix", "sdypix",
+                            "s0LSMgreyValue", "CC_Coeff", "vmd"], None),
+    "fixed_master": (6, ["TrajectoryID", "DXm", "DYm", "DZm", "Dxpi", "xDypi", "xSdxpix", "Sdypix", "CC_Coeff",
+                         "vmd"], [10, 17, 12, 12, 17, 12, 17, 12, 17, 17]),
+}
+
+# velocity filter of wrapper.m, m/day
+MIN_VEL_MD = 0
+MAX_VEL_MD = 10
+MAX_STD_MD = 1.5
+
+
+def read_dat(filename, layout="lower_icefall"):
+    """ Read a Trajectories_ObjectPoints_ImgPair_*.dat file
+
+    Args:
+        filename: .dat file
+        layout: key of LAYOUTS
+
+    Returns:
+        pd.DataFrame: one column per field, empty fields are NaN. As with ExtraColumnsRule="ignore" of the MATLAB
+            importers, extra fields of a line are ignored, missing or unreadable ones are NaN
+    """
+    first_line, columns, widths = LAYOUTS[layout]
+    lines = Path(filename).read_bytes().splitlines()[first_line - 1:]
+    lines = [line for line in lines if line.strip()]
+    if not lines:
+        return pd.DataFrame(columns=columns, dtype=float)
+
+    if widths is None:
+        # whitespace separated: all numbers at once, one row per line
+        fields = [line.split() for line in lines]
+        if all(len(f) == len(columns) for f in fields):
+            try:
+                return pd.DataFrame(np.array(fields, dtype=float), columns=columns)
+            except ValueError:
+                pass
+        # a malformed line somewhere, parse the lines one by one
+        return pd.DataFrame([_parse_fields(f, len(columns)) for f in fields], columns=columns)
+
+    # fixed width: cut every field out of all lines at once
+    edges = np.concatenate([[0], np.cumsum(widths)])
+    text = np.array([line.ljust(edges[-1]) for line in lines], dtype=f"S{max(edges[-1], max(map(len, lines)))}")
+    chars = text.view("S1").reshape(len(lines), -1)
+    data = {}
+    for name, start, end in zip(columns, edges[:-1], edges[1:]):
+        field = np.char.strip(chars[:, start:end].copy().view(f"S{end - start}").ravel())
+        empty = field == b""
+        field[empty] = b"nan"
+        data[name] = field.astype(float)
+    return pd.DataFrame(data)
+
+
+def _parse_fields(fields, n_columns):
+    """ Numbers of one whitespace separated line, truncated or padded with NaN to n_columns """
+    values = np.full(n_columns, np.nan)
+    for k, field in enumerate(fields[:n_columns]):
+        try:
+            values[k] = float(field)
+        except ValueError:
+            pass
+    return values
+
+
+def pair_images(filename):
+    """ Indices of the two images of a pair, from the "ImgPair_i-j" part of the file name """
+    match = re.search(r"ImgPair_(\d+)-(\d+)", Path(filename).name)
+    if match is None:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+
+def image_times_from_folder(image_folder):
+    """ Acquisition time of every image of the (sorted) image folder, NaT for names that are not a time """
+    image_files = sorted(f for f in Path(image_folder).iterdir() if f.suffix.lower() in ['.jpg', '.jpeg', '.png'])
+    return pd.to_datetime([f.stem for f in image_files], format='%Y%m%d%H%M%S', errors='coerce')
+
+
+def filtered_velocity(vmd):
+    """ Median velocity of an image pair after the filter of wrapper.m, NaN if the velocities scatter too much """
+    vels = np.where((vmd < MIN_VEL_MD) | (vmd > MAX_VEL_MD), np.nan, vmd)
+    n_valid = np.count_nonzero(~np.isnan(vels))
+    if n_valid == 0:
+        return np.nan
+    if n_valid > 1 and np.nanstd(vels, ddof=1) > MAX_STD_MD:
+        return np.nan
+    return np.nanmedian(vels)
+
+
+def process_file(args):
+    """ DateTime (middle of the pair) and filtered velocity of one .dat file, None if the time is unknown or
+    the file cannot be read """
+    filename, layout, image_times = args
+    pair = pair_images(filename)
+    if pair is None or max(pair) >= len(image_times):
+        return None
+    t0, t1 = image_times[pair[0]], image_times[pair[1]]
+    if pd.isna(t0) or pd.isna(t1):
+        return None
+    try:
+        vmd = read_dat(filename, layout)['vmd'].to_numpy()
+    except (OSError, ValueError) as e:  # one broken file must not stop the other files and folders
+        print(f"Skipping {filename}: {e}")
+        return None
+    return t1 - (t1 - t0) / 2, filtered_velocity(vmd)
+
+
+def mean_velocities(folder_layouts, image_times, n_workers=None):
+    """ Filtered velocity of every image pair in the folders, sorted by time per folder (as in wrapper.m)
+
+    Args:
+        folder_layouts: list of (folder with .dat files, layout)
+        image_times: acquisition times of the images EMT was run on, in EMT order
+        n_workers: number of processes, None for all cores
+
+    Returns:
+        pd.DataFrame: DateTime, mean_vel_md
+    """
+    tables = []
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        for folder, layout in folder_layouts:
+            files = sorted(Path(folder).glob("Trajectories_ObjectPoints_ImgPair_*.dat"))
+            results = pool.map(process_file, [(f, layout, image_times) for f in files], chunksize=16)
+            rows = [r for r in results if r is not None]
+            table = pd.DataFrame(rows, columns=['DateTime', 'mean_vel_md'])
+            tables.append(table.sort_values('DateTime', kind='stable'))
+    return pd.concat(tables, ignore_index=True)
+
+
+if __name__ == "__main__":
+
+    # folders with EMT output and their layout, see LAYOUTS
+    folder_layouts = [(Path("D:/JIRP/JIRP_TL/full_trial/output_lower_icefall/"), "lower_icefall")]
+    #                 (Path("D:/JIRP/JIRP_TL/full_trial/output/"), "fixed_master")]
+    image_folder = Path("D:/JIRP/JIRP_TL/full_trial/images/")  # images EMT was run on
+
+    start = datetime.now()
+    velocities = mean_velocities(folder_layouts, image_times_from_folder(image_folder))
+
+    csv_path = folder_layouts[0][0] / "LowerIcefallMeanVel.csv"
+    velocities.to_csv(csv_path, index=False, date_format='%Y-%m-%d %H:%M:%S')
+    print(f"Data has been written to {csv_path} ({len(velocities)} image pairs, {datetime.now() - start})")
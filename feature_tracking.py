@@ -14,13 +14,19 @@ If that is the case, simply ciopy past this script into a cell and then run it.
 #%%
 import os
 import csv
+from bisect import bisect_left, bisect_right
 from datetime import datetime
 from pathlib import Path
 import matplotlib.pyplot as plt
-from matplotlib.image import imread
 import ipywidgets as widgets
 from IPython.display import display
 
+from image_catalog import ImageCatalog
+from frame_selection import read_selection_index, SELECTION_INDEX
+from frame_cache import FramePrefetcher
+from template_tracking import TemplatePredictor
+from image_pyramid import load_pyramid
+
 # It would be annoying to have to go from the very beginning each time. Here you can set a start-date. 
 ##############################################################
 # Set a cutoff datetime to start after #######################
@@ -31,6 +37,31 @@ start_after = datetime(2025, 5, 1, 0, 0, 0) ##################
 image_folder = Path("./filtered_for_tracking")  # to the images dowloaded from google drive
 output_folder = Path("./csv_tracking/")  # to the location of the output csvs
 
+# find the start image with a time query on the image catalog instead of parsing all file names
+use_catalog = True
+catalog_path = Path("./cache/image_catalog.sqlite")
+
+# decode the next (and previous) images in the background, so the next image shows right after a click
+prefetch_ahead = 3
+prefetch_behind = 1
+max_cached_frames = 8
+
+# draw the images from tiled pyramids (image_pyramid.py, built in pyramid_dir when an image is first needed):
+# only the tiles of the current view are drawn, at the resolution of the screen, which keeps zooming in fast
+use_pyramid = True
+pyramid_dir = Path("./cache/pyramids")
+
+# assisted tracking: every click or accepted prediction sets the template, its position in the next images is predicted
+# by normalized cross-correlation (red +). Press 'a' to accept the prediction or click to correct it, 'g' accepts
+# predictions automatically until the correlation drops below min_correlation (or 'g' again).
+assisted_tracking = True
+template_half_size = 25  # the template is 2 * half_size + 1 pixels square
+search_radius = 60  # pixels around the last position
+min_correlation = 0.7
+predict_ahead = 3
+auto_advance_ms = 300  # time between automatically accepted images
+prediction_poll_ms = 50  # a prediction that is not ready when the image is shown is drawn as soon as it is
+
 
 
 ##### End of user input #########################################################################################
@@ -55,7 +86,12 @@ track_name = input(prompt).strip()
 output_folder.mkdir(parents=True, exist_ok=True)
 csv_path = output_folder / f"{track_name}.csv"
 
-image_files = sorted([f for f in image_folder.iterdir() if f.suffix.lower() in ['.jpg', '.jpeg', '.png']])
+# frames selected by filter_to_one_per_day.py in index mode are read in place from the selection index
+selection_index = image_folder / SELECTION_INDEX
+if selection_index.exists():
+    image_files, image_times = read_selection_index(selection_index)
+else:
+    image_files = sorted([f for f in image_folder.iterdir() if f.suffix.lower() in ['.jpg', '.jpeg', '.png']])
 
 # Write CSV header if needed
 if not csv_path.exists():
@@ -67,16 +103,47 @@ if not csv_path.exists():
 
 # Find index of first image after the cutoff
 index = 0
-for i, img_file in enumerate(image_files):
-    try:
-        ts = datetime.strptime(img_file.stem, '%Y%m%d%H%M%S')
-        if ts > start_after:
-            index = i
-            break
-    except ValueError:
-        continue  # Skip files with unexpected names
+if selection_index.exists():
+    first = bisect_right(image_times, start_after)
+    if first < len(image_files):
+        index = first
+elif use_catalog:
+    catalog = ImageCatalog(catalog_path)
+    catalog.update([image_folder], recursive=False)
+    first = catalog.first_after(image_folder, start_after)
+    if first is not None:
+        # position of the image in the (time sorted) file names, also if the list does not contain it
+        first = bisect_left([f.name for f in image_files], first[0].name)
+        if first < len(image_files):
+            index = first
+else:
+    for i, img_file in enumerate(image_files):
+        try:
+            ts = datetime.strptime(img_file.stem, '%Y%m%d%H%M%S')
+            if ts > start_after:
+                index = i
+                break
+        except ValueError:
+            continue  # Skip files with unexpected names
+
+if use_pyramid:
+    frames = FramePrefetcher(image_files, prefetch_ahead, prefetch_behind, max_cached_frames, start=index,
+                             loader=lambda f: load_pyramid(f, pyramid_dir))
+    full_image = lambda i: frames.peek(i).level(0)
+else:
+    frames = FramePrefetcher(image_files, prefetch_ahead, prefetch_behind, max_cached_frames, start=index)
+    full_image = frames.peek
+
+if assisted_tracking:
+    predictor = TemplatePredictor(full_image, len(image_files), template_half_size, search_radius, predict_ahead,
+                                  min_correlation)
+prediction = None  # (x, y, correlation) in the image on screen
+auto_advance = False
 
 fig, ax = None, None
+image_artist = None  # the AxesImage on screen, its data is replaced for every new image
+image_shape = None
+prediction_marker = None
 
 def record_click_and_advance(x, y):
     global index
@@ -99,39 +166,123 @@ def onclick(event):
         index += 1
         show_image()
     elif event.xdata is not None and event.ydata is not None:
+        if assisted_tracking:
+            predictor.accept(index, event.xdata, event.ydata)  # new template or corrected position
         record_click_and_advance(event.xdata, event.ydata)
 
 
+def accept_prediction():
+    if prediction is not None:
+        x, y, score = prediction
+        predictor.accept(index, x, y)
+        record_click_and_advance(x, y)
+
+def auto_step():
+    global auto_advance
+    if prediction is None and index < len(image_files) and predictor.is_pending(index):
+        return  # try again on the next tick
+    if index >= len(image_files) or prediction is None or prediction[2] < min_correlation:
+        auto_advance = False
+        auto_timer.stop()
+        return
+    accept_prediction()
+
 def onkey(event):
-    global index
+    global index, auto_advance
     if event.key == 'k':  # ← Use 'k' instead of 's' to skip
         index += 1
         show_image()
+    elif event.key == 'a' and assisted_tracking:
+        accept_prediction()
+    elif event.key == 'g' and assisted_tracking:
+        auto_advance = not auto_advance
+        if auto_advance:
+            auto_timer.start()
+        else:
+            auto_timer.stop()
 
 def skip_clicked(b):
     global index
     index += 1
     show_image()
 
+def update_view(*args):
+    # draw the pyramid tiles of the current view, called for every zoom or pan
+    if image_artist is None or index >= len(image_files):
+        return
+    tiles, extent = frames.peek(index).view(ax.get_xlim(), ax.get_ylim(), ax.get_window_extent().width)
+    image_artist.set_data(tiles)
+    image_artist.set_extent(extent)
+
 def show_image():
-    global fig, ax, index
+    global fig, ax, index, image_artist, image_shape, prediction, prediction_marker
+    img = None
+    while index < len(image_files) and img is None:
+        try:
+            img = frames.get(index)
+        except Exception as e:  # unreadable frame, cached as failed by the prefetcher
+            print(f"Skipping {image_files[index].name}: {e}")
+            index += 1
     if index >= len(image_files):
         ax.clear()
+        image_artist = None
+        prediction = None
         ax.set_title("✅ Done reviewing all images.")
         fig.canvas.draw()
         return
 
-    img = imread(image_files[index])
-    ax.clear()
-    ax.imshow(img)
-    ax.set_title(f"{image_files[index].name} — Click to record or right click to skip")
-    fig.canvas.draw()
+    if image_artist is None or image_shape != img.shape:
+        ax.clear()
+        image_shape = img.shape
+        if use_pyramid:
+            height, width = img.shape[:2]
+            image_artist = ax.imshow(img.level(-1), extent=(-0.5, width - 0.5, height - 0.5, -0.5))
+            ax.set_autoscale_on(False)
+            ax.callbacks.connect('xlim_changed', update_view)  # ax.clear() removes the callbacks
+            ax.callbacks.connect('ylim_changed', update_view)
+        else:
+            image_artist = ax.imshow(img)
+        prediction_marker, = ax.plot([], [], '+', color='red', markersize=20, scalex=False, scaley=False)
+    elif not use_pyramid:
+        image_artist.set_data(img)  # keeps the axes, only the pixels change
+    if use_pyramid:
+        update_view()  # same view (zoom) as the image before
+    show_prediction()
+
+def show_prediction():
+    # marker and title of the prediction of the image on screen; the image is shown right away, a prediction
+    # that is still being computed is drawn by poll_prediction when it is ready
+    global prediction
+    title = f"{image_files[index].name} — Click to record or right click to skip"
+    prediction = predictor.predict(index, timeout=0) if assisted_tracking else None
+    if prediction is not None:
+        x, y, score = prediction
+        prediction_marker.set_data([x], [y])
+        title = f"{image_files[index].name} — correlation {score:.2f}: 'a' to accept, click to correct"
+    else:
+        prediction_marker.set_data([], [])
+        if assisted_tracking and predictor.is_pending(index):
+            title = f"{image_files[index].name} — predicting…, click to record or right click to skip"
+            prediction_timer.start()
+    ax.set_title(title)
+    fig.canvas.draw_idle()
+
+def poll_prediction():
+    if index >= len(image_files) or image_artist is None:
+        prediction_timer.stop()
+    elif not predictor.is_pending(index):
+        prediction_timer.stop()
+        show_prediction()
 
 # init figure
 if fig is None or ax is None:
     fig, ax = plt.subplots(figsize=(12, 8))
     fig.canvas.mpl_connect('button_press_event', onclick)
     fig.canvas.mpl_connect('key_press_event', onkey)  # ← Keyboard support
+    auto_timer = fig.canvas.new_timer(interval=auto_advance_ms)
+    auto_timer.add_callback(auto_step)
+    prediction_timer = fig.canvas.new_timer(interval=prediction_poll_ms)
+    prediction_timer.add_callback(poll_prediction)
 
 skip_button = widgets.Button(description="Skip")
 skip_button.on_click(skip_clicked)
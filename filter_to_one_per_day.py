@@ -1,9 +1,16 @@
 
 #%%
 import os
-import shutil
+import datetime
 from pathlib import Path
-from collections import defaultdict
+
+from image_catalog import ImageCatalog, name_time
+from image_quality import best_frames, MIN_BRIGHTNESS, MAX_BRIGHTNESS, MIN_CONTRAST
+from ingest_manifest import output_sources
+from timelapse_stamp import MANIFEST_NAME
+from frame_selection import (time_bins, bin_signature, place_frame, remove_frame, write_selection_index,
+                             SELECTION_INDEX, SELECTION_STATE)
+from track_manifest import config_hash, load_manifest, save_manifest
 
 # === CONFIGURATION ===
 # === CONFIGURATION ===
@@ -11,32 +18,112 @@ input_folder = Path("./timelapse_corrected_times")  # Change this
 output_folder = Path("./filtered_for_tracking")    # ← CHANGE THIS
 image_extensions = ('.png')
 
-# === CREATE OUTPUT FOLDER ===
-output_folder.mkdir(parents=True, exist_ok=True)
-
-# === GROUP FILES BY DATE ===
-files_by_date = defaultdict(list)
-
-for file in input_folder.iterdir():
-    if file.suffix.lower() not in image_extensions or not file.is_file():
-        continue
-
-    name = file.stem
-    try:
-        # Assumes filename starts with YYYYMMDD
-        date_str = name[:8]
-        if len(date_str) == 8 and date_str.isdigit():
-            files_by_date[date_str].append(file)
-    except Exception as e:
-        print(f"Skipping {file.name}: {e}")
-
-# === COPY LARGEST FILE PER DAY ===
-for date, files in files_by_date.items():
-    largest = max(files, key=lambda f: f.stat().st_size)
-    destination = output_folder / largest.name
-    shutil.copy2(largest, destination)
-    print(f"Copied: {largest.name} ({largest.stat().st_size/1024:.1f} KB)")
-
-print("✅ Done.")
+# group the images by day with the image catalog (only new images are scanned) instead of listing the folder
+use_catalog = True
+catalog_path = Path("./cache/image_catalog.sqlite")
+
+# keep the sharpest frame of each day that passes the quality filter (image_quality.py) instead of the largest file.
+# Frames made by timelapse_maker use the scores of their source JPEG, found through the ingest manifest.
+use_quality = True
+min_brightness, max_brightness = MIN_BRIGHTNESS, MAX_BRIGHTNESS  # mean grey value (0 - 255)
+min_contrast = MIN_CONTRAST  # std of the grey values
+
+# how many frames to keep per interval
+frames_per_bin = 1
+bin_interval = datetime.timedelta(days=1)
+
+# how the selected frames end up in output_folder:
+#   "copy": copies (as before), "hardlink" / "symlink": links to the input files without using extra space,
+#   "index": only output_folder/selection.csv, which feature_tracking.py reads instead of the folder
+selection_mode = "copy"
+
+# the pool of the quality scores starts worker processes, which import this script again (spawn on Windows)
+if __name__ == "__main__":
+    # === CREATE OUTPUT FOLDER ===
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    # === GROUP FILES BY TIME BIN ===
+    if use_catalog or use_quality:
+        catalog = ImageCatalog(catalog_path)
+        catalog.update([input_folder], recursive=False)
+
+    if use_catalog:
+        frames = [(file, time) for file, time in catalog.between(input_folder)
+                  if file.suffix.lower() in image_extensions]
+    else:
+        frames = []
+        for file in input_folder.iterdir():
+            if file.suffix.lower() not in image_extensions or not file.is_file():
+                continue
+
+            try:
+                # Assumes filename starts with YYYYMMDDHHMMSS (or at least YYYYMMDD)
+                time = name_time(file) or datetime.datetime.strptime(file.stem[:8], '%Y%m%d')
+                frames.append((file, time))
+            except Exception as e:
+                print(f"Skipping {file.name}: {e}")
+
+    files_by_bin = time_bins([file for file, time in frames], [time for file, time in frames], bin_interval)
+
+    # === FIND CHANGED BINS ===
+    # bins with the same frames and settings as in the last run keep their selection
+    state_path = output_folder / SELECTION_STATE
+    state = load_manifest(state_path)
+    config = config_hash(mode=selection_mode, n=frames_per_bin, interval=bin_interval.total_seconds(),
+                         quality=[min_brightness, max_brightness, min_contrast] if use_quality else None)
+    if state.get('config') != config:
+        for name in [name for entry in state.get('bins', {}).values() for name in entry['selected']]:
+            remove_frame(name, output_folder, state.get('mode', selection_mode))
+        state = {'config': config, 'mode': selection_mode, 'bins': {}}
+
+    signatures = {key: bin_signature(bin_frames) for key, bin_frames in files_by_bin.items()}
+    changed = [key for key in files_by_bin if state['bins'].get(key, {}).get('signature') != signatures[key]]
+
+    # === SCORE FILES ===
+    if use_quality:
+        all_files = [file for key in changed for file, time in files_by_bin[key]]
+        sources = output_sources(input_folder / MANIFEST_NAME)
+        source_scores = catalog.scores({sources[f.name] for f in all_files if f.name in sources})
+        scores = {f: source_scores[sources[f.name]] for f in all_files if sources.get(f.name) in source_scores}
+        # frames without a scored source are scored themselves (pngs have no reduced decode, so this is slower)
+        missing = [f for f in all_files if f not in scores]
+        catalog.score(missing)
+        scores.update(catalog.scores(missing))
+
+    # === SELECT LARGEST (OR BEST) FILES PER BIN ===
+    for key in changed:
+        files = [file for file, time in files_by_bin[key]]
+        if use_quality:
+            selected = best_frames(files, scores, frames_per_bin, min_brightness=min_brightness,
+                                   max_brightness=max_brightness, min_contrast=min_contrast)
+            if not selected:
+                print(f"No good frame in {key}")
+        else:
+            selected = sorted(files, key=lambda f: f.stat().st_size, reverse=True)[:frames_per_bin]
+
+        old = set(state['bins'].get(key, {}).get('selected', []))
+        for name in old - {f.name for f in selected}:
+            remove_frame(name, output_folder, selection_mode)
+        for file in selected:
+            place_frame(file, output_folder, selection_mode)
+            print(f"Selected: {file.name} ({file.stat().st_size/1024:.1f} KB)")
+        state['bins'][key] = {'signature': signatures[key], 'selected': [f.name for f in selected],
+                              'paths': [os.path.abspath(f) for f in selected]}
+
+    # bins without any frames left
+    for key in [key for key in state['bins'] if key not in files_by_bin]:
+        for name in state['bins'].pop(key)['selected']:
+            remove_frame(name, output_folder, selection_mode)
+
+    if selection_mode == "index":
+        times = {file.name: time for file, time in frames}
+        write_selection_index(output_folder / SELECTION_INDEX,
+                              [(key, times[Path(path).name], path) for key, entry in state['bins'].items()
+                               for path in entry['paths']])
+    elif (output_folder / SELECTION_INDEX).exists():
+        (output_folder / SELECTION_INDEX).unlink()  # feature_tracking.py would read it instead of the folder
+    save_manifest(state_path, state)
+
+    print(f"✅ Done. {len(changed)} of {len(files_by_bin)} bins reselected.")
 
 # %%
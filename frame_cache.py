@@ -0,0 +1,87 @@
+""" Background prefetch of decoded frames for feature_tracking.py.
+A thread decodes the next (and previous) frames around the one on screen into a bounded LRU cache, so moving
+to the next image after a click does not wait on reading and decoding the file. A frame that cannot be read is
+cached as its error, so it is not read again on the UI thread. """
+
+import threading
+from collections import OrderedDict
+
+from matplotlib.image import imread
+
+
+class FramePrefetcher():
+    """ Bounded LRU cache of decoded frames, filled by a background thread around the current frame.
+    """
+    def __init__(self, files, n_ahead=3, n_behind=1, max_frames=8, start=0, loader=imread):
+        """ Start the prefetch thread
+
+        Args:
+            files: image paths, in display order
+            n_ahead, n_behind: number of frames after / before the current one to keep decoded
+            max_frames: maximum number of decoded frames in memory
+            start: frame to prefetch around until the first get
+            loader: function path -> image array
+        """
+        self.files = files
+        self.n_ahead = n_ahead
+        self.n_behind = n_behind
+        self.max_frames = max(max_frames, n_ahead + n_behind + 1)
+        self.loader = loader
+        self.frames = OrderedDict()
+        self.current = start
+        self.lock = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _wanted(self):
+        """ Frames to have decoded, most urgent first: the current one, the next ones, then the previous ones """
+        ahead = range(self.current, min(self.current + self.n_ahead + 1, len(self.files)))
+        behind = range(self.current - 1, max(self.current - self.n_behind, 0) - 1, -1)
+        return list(ahead) + list(behind)
+
+    def _store(self, i, frame):
+        with self.lock:
+            self.frames[i] = frame
+            self.frames.move_to_end(i)
+            while len(self.frames) > self.max_frames:
+                self.frames.popitem(last=False)  # least recently used
+
+    def _run(self):
+        while True:
+            with self.lock:
+                missing = [i for i in self._wanted() if i not in self.frames]
+                if not missing:
+                    self.lock.wait()  # until the current frame moves
+                    continue
+            i = missing[0]
+            try:
+                frame = self.loader(self.files[i])
+            except Exception as e:
+                print(f"Could not read {self.files[i]}: {e}")
+                frame = e  # raised by get / peek
+            self._store(i, frame)
+
+    def get(self, i):
+        """ Decoded frame i (read now if it is not cached yet), and start prefetching around it.
+        Raises the error of a frame that could not be read. """
+        with self.lock:
+            self.current = i
+            self.lock.notify()
+        return self.peek(i)
+
+    def peek(self, i):
+        """ Decoded frame i without moving the prefetch window (read now if it is not cached yet).
+        Raises the error of a frame that could not be read. """
+        with self.lock:
+            frame = self.frames.get(i)
+            if frame is not None:
+                self.frames.move_to_end(i)
+        if frame is None:
+            try:
+                frame = self.loader(self.files[i])
+            except Exception as e:
+                frame = e
+            self._store(i, frame)
+        if isinstance(frame, Exception):
+            raise frame
+        return frame
@@ -0,0 +1,87 @@
+""" Output of the frame selection of filter_to_one_per_day.py.
+The selected frames can be copied (as before), hardlinked or symlinked into the output folder, or only listed
+in a selection index (selection.csv) that feature_tracking.py and project_tracked_features.py read in place of
+the folder. A state file records per time bin a signature of its frames and the selected frames, so a rerun
+only reselects bins that changed. """
+
+import csv
+import datetime
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+MODES = ("copy", "hardlink", "symlink", "index")
+SELECTION_INDEX = "selection.csv"
+SELECTION_STATE = "selection_state.json"
+
+
+def time_bins(files, times, interval=datetime.timedelta(days=1)):
+    """ Group frames into time bins of a fixed interval (bins start at multiples of the interval since 1970)
+
+    Returns:
+        dict: {bin start as YYYYMMDDHHMMSS: list of (file, time)}, in time order
+    """
+    epoch = datetime.datetime(1970, 1, 1)
+    bins = {}
+    for file, time in sorted(zip(files, times), key=lambda ft: (ft[1], str(ft[0]))):
+        start = epoch + ((time - epoch) // interval) * interval
+        bins.setdefault(start.strftime('%Y%m%d%H%M%S'), []).append((file, time))
+    return bins
+
+
+def bin_signature(frames):
+    """ Hash of the names, sizes and mtimes of the frames of a bin, changes when a frame is added or replaced """
+    sha1 = hashlib.sha1()
+    for file, time in frames:
+        stat = os.stat(file)
+        sha1.update(f"{Path(file).name}|{stat.st_size}|{stat.st_mtime_ns};".encode())
+    return sha1.hexdigest()
+
+
+def place_frame(src, output_folder, mode):
+    """ Put a selected frame into the output folder (nothing to do for the index mode) """
+    if mode == "index":
+        return
+    destination = Path(output_folder) / Path(src).name
+    if destination.exists() or destination.is_symlink():
+        destination.unlink()
+    if mode == "copy":
+        shutil.copy2(src, destination)
+    elif mode == "hardlink":
+        os.link(src, destination)  # the input and output folder must be on the same drive
+    elif mode == "symlink":
+        os.symlink(os.path.abspath(src), destination)
+    else:
+        raise ValueError(f"Unknown selection mode {mode}, use one of {MODES}")
+
+
+def remove_frame(name, output_folder, mode):
+    """ Remove a frame that is no longer selected from the output folder """
+    destination = Path(output_folder) / name
+    if mode != "index" and (destination.exists() or destination.is_symlink()):
+        destination.unlink()
+
+
+def write_selection_index(index_path, rows):
+    """ Write the selection index: rows of (bin, time, path), sorted by time """
+    index_path = Path(index_path)
+    tmp_path = index_path.with_suffix(".tmp")
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['bin', 'timestamp', 'path'])
+        writer.writerows(sorted(rows, key=lambda row: (row[1], row[2])))
+    os.replace(tmp_path, index_path)
+
+
+def read_selection_index(index_path):
+    """ Read the selection index
+
+    Returns:
+        tuple: list of Paths of the selected frames and list of their datetimes, sorted by time
+    """
+    with open(index_path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    files = [Path(row['path']) for row in rows]
+    times = [datetime.datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S') for row in rows]
+    return files, times
@@ -0,0 +1,260 @@
+""" Catalog of timelapse images in SQLite, so scripts can query images by time instead of rescanning folders.
+Folders are walked with os.scandir and for JPEGs only the EXIF header is read (no image decoding); other
+images (e.g. the stamped pngs) get the time from their file name (%Y%m%d%H%M%S). Unchanged files (same size
+and mtime) are not read again on an update. The table has an index on (folder, timestamp), so time-range
+and per-day queries are index (binary) searches. The quality scores of image_quality.py are cached here too. """
+
+import datetime
+import os
+import sqlite3
+import struct
+from pathlib import Path
+
+from image_quality import score_images
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+EXIF_DATETIME, EXIF_MAKE, EXIF_MODEL = 306, 271, 272
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    folder TEXT,
+    name TEXT,
+    camera TEXT,
+    timestamp INTEGER,  -- seconds since 1970-01-01 of the (naive) image time
+    day INTEGER,        -- YYYYMMDD of the image time
+    size INTEGER,
+    mtime INTEGER,
+    brightness_mean REAL,  -- brightness
+    brightness_std REAL,   -- contrast
+    sharpness REAL
+);
+CREATE INDEX IF NOT EXISTS images_time ON images (folder, timestamp);
+CREATE INDEX IF NOT EXISTS images_day ON images (folder, day);
+"""
+
+
+def read_exif_header(path, max_segments=16):
+    """ DateTime (tag 306) and camera (Make Model) from the EXIF APP1 segment of a JPEG, without decoding it
+
+    Returns:
+        tuple: datetime or None, camera string or None (also for a truncated or malformed header)
+    """
+    try:
+        return _read_exif_header(path, max_segments)
+    except (struct.error, IndexError, ValueError, OSError):
+        return None, None
+
+
+def _read_exif_header(path, max_segments):
+    with open(path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return None, None
+        for _ in range(max_segments):
+            marker = f.read(4)
+            if len(marker) < 4 or marker[0] != 0xFF or marker[1] in (0xD9, 0xDA):
+                return None, None  # end of image or start of the image data: no EXIF
+            length = struct.unpack('>H', marker[2:])[0]
+            if length < 2:
+                return None, None
+            if marker[1] == 0xE1:
+                data = f.read(length - 2)
+                if data[:6] == b'Exif\x00\x00':
+                    return _parse_ifd0(data[6:])
+            else:
+                f.seek(length - 2, os.SEEK_CUR)
+    return None, None
+
+
+def _parse_ifd0(tiff):
+    """ Read the ascii tags DateTime, Make and Model from the first IFD of a TIFF (EXIF) block """
+    order = '<' if tiff[:2] == b'II' else '>'
+    offset = struct.unpack(order + 'I', tiff[4:8])[0]
+    n_entries = struct.unpack(order + 'H', tiff[offset:offset + 2])[0]
+    values = {}
+    for i in range(n_entries):
+        entry = tiff[offset + 2 + 12 * i: offset + 14 + 12 * i]
+        tag, kind, count = struct.unpack(order + 'HHI', entry[:8])
+        if tag in (EXIF_DATETIME, EXIF_MAKE, EXIF_MODEL) and kind == 2:  # ascii
+            start = struct.unpack(order + 'I', entry[8:])[0] if count > 4 else None
+            raw = entry[8:8 + count] if start is None else tiff[start:start + count]
+            values[tag] = raw.split(b'\x00')[0].decode(errors='replace').strip()
+
+    timestamp = None
+    if EXIF_DATETIME in values:
+        try:
+            timestamp = datetime.datetime.strptime(values[EXIF_DATETIME], '%Y:%m:%d %H:%M:%S')
+        except ValueError:
+            pass
+    camera = " ".join(values[tag] for tag in (EXIF_MAKE, EXIF_MODEL) if values.get(tag)) or None
+    return timestamp, camera
+
+
+def name_time(path):
+    """ Time in a file name like 20250501120000.png, None if the name is not a time """
+    try:
+        return datetime.datetime.strptime(Path(path).stem[:14], '%Y%m%d%H%M%S')
+    except ValueError:
+        return None
+
+
+def _scan(folder, recursive):
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir() and recursive:
+                yield from _scan(entry.path, recursive)
+            elif entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield entry
+
+
+def _epoch(t):
+    return int((t - datetime.datetime(1970, 1, 1)).total_seconds())
+
+
+def _from_epoch(seconds):
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=seconds)
+
+
+class ImageCatalog():
+    """ SQLite catalog of image paths, cameras, times, sizes and (optionally) brightness.
+    """
+    def __init__(self, db_path):
+        """ Open the catalog, created if it does not exist yet
+
+        Args:
+            db_path: sqlite file, e.g. ./cache/image_catalog.sqlite
+        """
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(images)")]
+        if 'sharpness' not in columns:  # catalog made before the quality scores
+            self.db.execute("ALTER TABLE images ADD COLUMN sharpness REAL")
+
+    def update(self, folders, recursive=True, camera=None, quality=False, n_workers=None):
+        """ Add new and changed images of the folders, and remove images that are gone
+
+        Args:
+            folders: folders to scan
+            recursive: also scan subfolders
+            camera: camera name to store, None for the EXIF Make/Model
+            quality: also store the quality scores (image_quality.py, decodes images at 1/8 resolution)
+                of new images and of images that have none yet
+            n_workers: number of processes for the quality scores
+
+        Returns:
+            int: number of new or changed images
+        """
+        known = {path: (size, mtime) for path, size, mtime in self.db.execute("SELECT path, size, mtime FROM images")}
+        rows, seen = [], set()
+        for folder in folders:
+            for entry in _scan(folder, recursive):
+                path = os.path.abspath(entry.path)
+                stat = entry.stat()
+                seen.add(path)
+                if known.get(path) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                if entry.name.lower().endswith(('.jpg', '.jpeg')):
+                    timestamp, exif_camera = read_exif_header(entry.path)
+                else:
+                    timestamp, exif_camera = None, None
+                timestamp = timestamp or name_time(entry.name)
+                rows.append((path, os.path.dirname(path), entry.name, camera or exif_camera,
+                             _epoch(timestamp) if timestamp else None,
+                             int(timestamp.strftime('%Y%m%d')) if timestamp else None,
+                             stat.st_size, stat.st_mtime_ns, None, None, None))
+
+        scanned = [os.path.abspath(folder) for folder in folders]
+        in_scanned = (lambda path: path.startswith(tuple(f + os.sep for f in scanned))) if recursive \
+            else (lambda path: os.path.dirname(path) in scanned)
+        gone = [(path,) for path in known if path not in seen and in_scanned(path)]
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO images (path, folder, name, camera, timestamp, day, size, mtime, "
+                                "brightness_mean, brightness_std, sharpness) VALUES (?,?,?,?,?,?,?,?,?,?,?)", rows)
+            self.db.executemany("DELETE FROM images WHERE path = ?", gone)
+
+        if quality:
+            self.score(seen, n_workers)
+        return len(rows)
+
+    def score(self, paths, n_workers=None):
+        """ Compute the quality scores of the cataloged images in paths that have none yet """
+        paths = {os.path.abspath(path) for path in paths}
+        unscored = [path for path, in self.db.execute("SELECT path FROM images WHERE sharpness IS NULL")
+                    if path in paths]
+        scores = score_images(unscored, n_workers)
+        with self.db:
+            self.db.executemany("UPDATE images SET brightness_mean = ?, brightness_std = ?, sharpness = ? "
+                                "WHERE path = ?", [(*score, path) for path, score in zip(unscored, scores)])
+
+    def scores(self, paths):
+        """ Cached quality scores of images
+
+        Returns:
+            dict: {path as given: (brightness, contrast, sharpness)} for the images that have scores
+        """
+        scores = {}
+        for path in paths:
+            row = self.db.execute("SELECT brightness_mean, brightness_std, sharpness FROM images "
+                                  "WHERE path = ? AND sharpness IS NOT NULL", [os.path.abspath(path)]).fetchone()
+            if row is not None:
+                scores[path] = row
+        return scores
+
+    def times(self, paths):
+        """ Cataloged times of images
+
+        Returns:
+            dict: {path as given: datetime or None (no EXIF or file name time)} for the cataloged images
+        """
+        times = {}
+        for path in paths:
+            row = self.db.execute("SELECT timestamp FROM images WHERE path = ?", [os.path.abspath(path)]).fetchone()
+            if row is not None:
+                times[path] = None if row[0] is None else _from_epoch(row[0])
+        return times
+
+    def between(self, folder, start=None, end=None):
+        """ Images of a folder with start <= time < end (None for open ends), sorted by time
+
+        Returns:
+            list: (Path, datetime) tuples
+        """
+        query = "SELECT path, timestamp FROM images WHERE folder = ? AND timestamp IS NOT NULL"
+        args = [os.path.abspath(folder)]
+        if start is not None:
+            query += " AND timestamp >= ?"
+            args.append(_epoch(start))
+        if end is not None:
+            query += " AND timestamp < ?"
+            args.append(_epoch(end))
+        rows = self.db.execute(query + " ORDER BY timestamp, path", args)
+        return [(Path(path), datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=t)) for path, t in rows]
+
+    def first_after(self, folder, t):
+        """ First image of a folder with a time after t, None if there is none
+
+        Returns:
+            tuple: Path, datetime
+        """
+        row = self.db.execute("SELECT path, timestamp FROM images WHERE folder = ? AND timestamp > ? "
+                              "ORDER BY timestamp, path LIMIT 1", [os.path.abspath(folder), _epoch(t)]).fetchone()
+        if row is None:
+            return None
+        return Path(row[0]), datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=row[1])
+
+    def per_day(self, folder):
+        """ Images of a folder grouped by day
+
+        Returns:
+            dict: {"YYYYMMDD": list of (Path, size)}, days and images sorted by time
+        """
+        days = {}
+        rows = self.db.execute("SELECT day, path, size FROM images WHERE folder = ? AND day IS NOT NULL "
+                               "ORDER BY day, timestamp, path", [os.path.abspath(folder)])
+        for day, path, size in rows:
+            days.setdefault(str(day), []).append((Path(path), size))
+        return days
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,155 @@
+""" Tiled multi-resolution pyramids of the tracking images, so the feature_tracking.py viewer only draws the part
+of an image that is on screen, at the resolution of the screen.
+Each level halves the size of the one before, until it fits in one tile. A level is stored as one .npy file of
+tiles (tile rows, tile columns, tile_size, tile_size, 3), padded to whole tiles, so every tile is a contiguous block
+on disk. The files are in a folder per image in ./cache/pyramids (keyed by the image path, size and mtime) and read
+memory-mapped, so a view only reads the tiles it covers. The pyramid of an image is about 1.33x its uncompressed
+size (RGB). """
+
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from frame_selection import read_selection_index, SELECTION_INDEX
+
+TILE_SIZE = 512
+META = "pyramid.json"
+FORMAT = 2  # 1: levels stored as whole images
+
+
+def pyramid_folder(image_path, cache_dir):
+    """ Cache folder of the pyramid of an image, changes when the image changes """
+    stat = os.stat(image_path)
+    key = f"{os.path.abspath(image_path)}|{stat.st_size}|{stat.st_mtime_ns}|{FORMAT}"
+    return Path(cache_dir) / f"{Path(image_path).stem}-{hashlib.sha1(key.encode()).hexdigest()[:10]}"
+
+
+def to_tiles(level, tile_size):
+    """ Image as an array of tiles (tile rows, tile columns, tile_size, tile_size, bands), zero padded """
+    height, width = level.shape[:2]
+    rows, cols = -(-height // tile_size), -(-width // tile_size)
+    padded = np.zeros((rows * tile_size, cols * tile_size) + level.shape[2:], level.dtype)
+    padded[:height, :width] = level
+    return padded.reshape(rows, tile_size, cols, tile_size, -1).swapaxes(1, 2)
+
+
+def build_pyramid(image_path, cache_dir, tile_size=TILE_SIZE):
+    """ Build the pyramid of an image, if it is not cached yet
+
+    Returns:
+        Path: the pyramid folder
+    """
+    folder = pyramid_folder(image_path, cache_dir)
+    if (folder / META).exists():
+        return folder
+
+    tmp_folder = folder.with_name(folder.name + f".tmp{os.getpid()}")
+    tmp_folder.mkdir(parents=True, exist_ok=True)
+    with Image.open(image_path) as img:
+        level = np.asarray(img.convert('RGB'))
+    height, width = level.shape[:2]
+    level_shapes = []
+    while True:
+        np.save(tmp_folder / f"level{len(level_shapes)}.npy", to_tiles(level, tile_size))
+        level_shapes.append(level.shape[:2])
+        if max(level.shape[:2]) <= tile_size:
+            break
+        level = cv2.resize(level, (max(level.shape[1] // 2, 1), max(level.shape[0] // 2, 1)),
+                           interpolation=cv2.INTER_AREA)
+    with open(tmp_folder / META, 'w') as f:
+        json.dump(dict(source=str(image_path), width=width, height=height, levels=level_shapes,
+                       tile_size=tile_size), f)
+    try:
+        os.replace(tmp_folder, folder)
+    except OSError:  # built at the same time by another process
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+    return folder
+
+
+def build_pyramids(image_paths, cache_dir, tile_size=TILE_SIZE, n_workers=None):
+    """ Build the missing pyramids of many images in a process pool """
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        return list(pool.map(build_pyramid, image_paths, [cache_dir] * len(image_paths),
+                             [tile_size] * len(image_paths)))
+
+
+class ImagePyramid():
+    """ Memory-mapped tiled levels of the pyramid of one image.
+    """
+    def __init__(self, folder):
+        """ Open a pyramid folder made by build_pyramid """
+        with open(Path(folder) / META) as f:
+            meta = json.load(f)
+        self.width, self.height, self.tile_size = meta['width'], meta['height'], meta['tile_size']
+        self.level_shapes = [tuple(shape) for shape in meta['levels']]
+        self.tiles = [np.load(Path(folder) / f"level{k}.npy", mmap_mode='r') for k in range(len(self.level_shapes))]
+        self.shape = self.level_shapes[0] + self.tiles[0].shape[4:]
+
+    def read(self, k, r0, r1, c0, c1):
+        """ Pixels [r0:r1, c0:c1] of level k, reading only the tiles they overlap """
+        t = self.tile_size
+        tiles = self.tiles[k][r0 // t:-(-r1 // t), c0 // t:-(-c1 // t)]
+        block = tiles.swapaxes(1, 2).reshape(tiles.shape[0] * t, tiles.shape[1] * t, -1)
+        r_start, c_start = r0 // t * t, c0 // t * t
+        return np.asarray(block[r0 - r_start:r1 - r_start, c0 - c_start:c1 - c_start])
+
+    def level(self, k):
+        """ Whole level k as an image array (k = 0 is the full resolution image) """
+        height, width = self.level_shapes[k]
+        return self.read(k, 0, height, 0, width)
+
+    def level_for(self, view_width, display_width):
+        """ Coarsest level that still has at least one pixel per screen pixel for a view view_width image
+        pixels wide shown display_width screen pixels wide """
+        k = int(np.log2(max(view_width / max(display_width, 1), 1)))
+        return min(k, len(self.level_shapes) - 1)
+
+    def view(self, xlim, ylim, display_width):
+        """ The tiles of the right level that cover a view
+
+        Args:
+            xlim, ylim: view limits in full resolution pixel coordinates (as the axes limits of imshow)
+            display_width: width of the view on screen in pixels
+
+        Returns:
+            tuple: image array and its extent (left, right, bottom, top) in full resolution pixel coordinates
+        """
+        (x0, x1), (y0, y1) = sorted(xlim), sorted(ylim)
+        k = self.level_for(x1 - x0, display_width)
+        height, width = self.level_shapes[k]
+        scale_x, scale_y = self.width / width, self.height / height
+        t = self.tile_size
+        c0 = int(max(x0 + 0.5, 0) / scale_x) // t * t
+        r0 = int(max(y0 + 0.5, 0) / scale_y) // t * t
+        c1 = min(-(-int(np.ceil((x1 + 0.5) / scale_x)) // t) * t, width)
+        r1 = min(-(-int(np.ceil((y1 + 0.5) / scale_y)) // t) * t, height)
+        if c1 <= c0 or r1 <= r0:  # view outside the image
+            c0, c1, r0, r1 = 0, width, 0, height
+        extent = (c0 * scale_x - 0.5, c1 * scale_x - 0.5, r1 * scale_y - 0.5, r0 * scale_y - 0.5)
+        return self.read(k, r0, r1, c0, c1), extent
+
+
+def load_pyramid(image_path, cache_dir, tile_size=TILE_SIZE):
+    """ ImagePyramid of an image, built first if it is not cached """
+    return ImagePyramid(build_pyramid(image_path, cache_dir, tile_size))
+
+
+if __name__ == "__main__":
+
+    # build the pyramids of all tracking images in advance (feature_tracking.py builds missing ones on first view)
+    image_folder = Path("./filtered_for_tracking")
+    cache_dir = Path("./cache/pyramids")
+
+    if (image_folder / SELECTION_INDEX).exists():
+        image_files, _ = read_selection_index(image_folder / SELECTION_INDEX)
+    else:
+        image_files = sorted(f for f in image_folder.iterdir() if f.suffix.lower() in ['.jpg', '.jpeg', '.png'])
+    build_pyramids(image_files, cache_dir)
+    print(f"Pyramids of {len(image_files)} images in {cache_dir}")
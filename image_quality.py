@@ -0,0 +1,76 @@
+""" Content-based quality scores of timelapse frames, to drop night/dark frames and pick the best frame of a day.
+JPEGs are decoded at 1/8 resolution (PIL draft mode, the scaling is done in the JPEG decoder), so no frame is
+decoded at full resolution. Scores are computed in a process pool and cached in the image catalog.
+    brightness: mean grey value (0 - 255)
+    contrast: std of the grey values
+    sharpness: variance of the Laplacian of the grey values """
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageFile
+
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+REDUCE = 8
+
+# default filter: darker or flatter frames are night, fog or snow on the lens
+MIN_BRIGHTNESS = 40
+MAX_BRIGHTNESS = 250
+MIN_CONTRAST = 10
+
+
+def quality_scores(path, reduce=REDUCE):
+    """ Brightness, contrast and sharpness of an image at 1/reduce resolution
+
+    JPEGs are decoded at the reduced size, other formats are decoded and then reduced. A file that cannot be
+    decoded gets NaN scores, so it fails every filter instead of stopping the scoring of a whole folder.
+    """
+    try:
+        with Image.open(path) as img:
+            size = (img.width // reduce, img.height // reduce)
+            img.draft('L', size)
+            grey = img.convert('L')
+            if grey.width > 1.5 * size[0]:  # no draft mode for this format
+                grey = grey.reduce(round(grey.width / size[0]))
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as e:
+        print(f"Could not score {path}: {e}")
+        return np.nan, np.nan, np.nan
+    grey = np.asarray(grey, dtype=np.float32)
+    laplacian = (grey[:-2, 1:-1] + grey[2:, 1:-1] + grey[1:-1, :-2] + grey[1:-1, 2:] - 4 * grey[1:-1, 1:-1])
+    return float(grey.mean()), float(grey.std()), float(laplacian.var())
+
+
+def score_images(paths, n_workers=None):
+    """ quality_scores of many images in a process pool, in the order of paths """
+    if len(paths) < 2:
+        return [quality_scores(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        return list(pool.map(quality_scores, paths, chunksize=8))
+
+
+def is_good(scores, min_brightness=MIN_BRIGHTNESS, max_brightness=MAX_BRIGHTNESS, min_contrast=MIN_CONTRAST):
+    """ True if a frame (brightness, contrast, sharpness) passes the filter """
+    brightness, contrast, sharpness = scores
+    if brightness is None or np.isnan(brightness):
+        return False
+    return min_brightness <= brightness <= max_brightness and contrast >= min_contrast
+
+
+def best_frames(files, scores, n=1, **limits):
+    """ The n sharpest frames that pass the filter, sharpest first (fewer if fewer pass)
+
+    Args:
+        files: candidate frames (e.g. of one day)
+        scores: {file: (brightness, contrast, sharpness)}
+        n: number of frames to select
+        limits: min_brightness, max_brightness, min_contrast of is_good
+    """
+    good = [f for f in files if f in scores and is_good(scores[f], **limits)]
+    return sorted(good, key=lambda f: scores[f][2], reverse=True)[:n]
+
+
+def best_frame(files, scores, **limits):
+    """ Sharpest frame that passes the filter, None if none does """
+    frames = best_frames(files, scores, 1, **limits)
+    return frames[0] if frames else None
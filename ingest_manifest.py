@@ -0,0 +1,63 @@
+""" Manifest of ingested camera images, so a rerun on a card dump only processes new files.
+The manifest is a JSON lines file with one entry per processed source image: its path, size and mtime,
+the hash of the settings it was processed with (override time, output format), the parsed (AKDT) time and
+the output file name. Entries are appended as soon as a file is done, so an interrupted run resumes where it
+stopped; a cut-off last line is ignored. """
+
+import json
+import os
+
+
+def source_key(path, stat=None):
+    """ Key of a source image: path, size and mtime (a changed file gets a new key) """
+    stat = stat or os.stat(path)
+    return f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def load_ingest_manifest(manifest_path):
+    """ Load the manifest as {source_key: entry}, later entries win """
+    manifest = {}
+    if not os.path.exists(manifest_path):
+        return manifest
+    with open(manifest_path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # line of an interrupted write
+            manifest[entry['key']] = entry
+    return manifest
+
+
+def output_sources(manifest_path):
+    """ {output name: absolute source path} of the images in a manifest """
+    return {entry['output']: entry['key'].rsplit('|', 2)[0]
+            for entry in load_ingest_manifest(manifest_path).values()}
+
+
+class IngestLog():
+    """ Appends entries to the manifest, one line per file, flushed right away
+    """
+    def __init__(self, manifest_path):
+        # finish a line cut off by an interrupted run, so the next entry starts on its own line
+        cut_off = os.path.exists(manifest_path) and os.path.getsize(manifest_path) > 0
+        if cut_off:
+            with open(manifest_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                cut_off = f.read(1) != b"\n"
+        self.f = open(manifest_path, "a")
+        if cut_off:
+            self.f.write("\n")
+
+    def add(self, key, **entry):
+        self.f.write(json.dumps(dict(entry, key=key)) + "\n")
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,115 @@
+""" Per-pixel georeference lookup table for the fixed timelapse camera.
+Every pixel of the image is projected onto the DEM once, the resulting (height, width, 3) UTM table and
+hit mask are stored as .npy files that are memory-mapped afterwards. Projecting tracked points is then a
+bilinear lookup in that table (except next to a depth discontinuity or a miss). The files are keyed by a hash
+of the camera pose, the intrinsics and the DEM file, so they are rebuilt automatically whenever one of those
+changes. """
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+MAX_CORNER_SPREAD = 50.0  # m, neighbouring pixels further apart are on both sides of a depth discontinuity
+
+
+def lut_key(dem_path, **camera):
+    """ Hash of the DEM file (path, size, mtime) and all camera parameters passed as keywords. """
+    stat = os.stat(dem_path)
+    config = dict(camera, dem_path=str(Path(dem_path).resolve()), dem_size=stat.st_size, dem_mtime=stat.st_mtime_ns)
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=float).encode()).hexdigest()[:16]
+
+
+def load_pixel_lut(cache_dir, key, image_width, image_height, project_pixels, rows_per_chunk=64):
+    """ Memory-map the lookup table for `key`, computing it first if it is not in `cache_dir` yet.
+
+    Args:
+        cache_dir: folder holding the pixel_lut_<key>.npy / pixel_lut_<key>_hit.npy files
+        key: hash from lut_key
+        image_width, image_height: image size in pixels
+        project_pixels: function (x_pix, y_pix) -> (utm_x, utm_y, utm_z), NaN for misses
+        rows_per_chunk: number of image rows projected at once while building
+
+    Returns:
+        tuple:
+            np.ndarray: (height, width, 3) UTM coordinates of each pixel, NaN where the ray misses
+            np.ndarray: (height, width) bool hit mask
+    """
+    cache_dir = Path(cache_dir)
+    lut_path = cache_dir / f"pixel_lut_{key}.npy"
+    hit_path = cache_dir / f"pixel_lut_{key}_hit.npy"
+
+    if not (lut_path.exists() and hit_path.exists()):
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # tables of an older pose or dem are no longer valid
+        for old in cache_dir.glob("pixel_lut_*.npy"):
+            old.unlink()
+
+        # write to temporary files first so an interrupted build never leaves a half-filled table behind
+        tmp_lut = cache_dir / f"pixel_lut_{key}.tmp.npy"
+        tmp_hit = cache_dir / f"pixel_lut_{key}_hit.tmp.npy"
+        lut = np.lib.format.open_memmap(tmp_lut, mode="w+", dtype=np.float64, shape=(image_height, image_width, 3))
+        hit = np.lib.format.open_memmap(tmp_hit, mode="w+", dtype=bool, shape=(image_height, image_width))
+        x_pix = np.arange(image_width, dtype=float)
+        for row in range(0, image_height, rows_per_chunk):
+            rows = np.arange(row, min(row + rows_per_chunk, image_height), dtype=float)
+            grid_x, grid_y = np.meshgrid(x_pix, rows)
+            utm_x, utm_y, utm_z = project_pixels(grid_x.ravel(), grid_y.ravel())
+            lut[row:row + len(rows)] = np.stack([utm_x, utm_y, utm_z], axis=-1).reshape(len(rows), image_width, 3)
+            hit[row:row + len(rows)] = ~np.isnan(utm_x).reshape(len(rows), image_width)
+        lut.flush()
+        hit.flush()
+        del lut, hit
+        os.replace(tmp_lut, lut_path)
+        os.replace(tmp_hit, hit_path)
+
+    return np.load(lut_path, mmap_mode="r"), np.load(hit_path, mmap_mode="r")
+
+
+def lookup_pixels(lut, hit, x_pix, y_pix, max_spread=MAX_CORNER_SPREAD, project_pixels=None):
+    """ Bilinear lookup of UTM coordinates for (sub)pixel positions.
+
+    The four neighbouring pixels are only interpolated when they all hit the terrain and lie within max_spread
+    of each other. Across a depth discontinuity (a ridge or an occlusion edge) the neighbours can be hundreds
+    of metres apart and an interpolated point would float in between, so such points, and points next to a
+    miss, are ray-marched with project_pixels if given, else take the value of the nearest pixel.
+
+    Args:
+        lut, hit: table and hit mask from load_pixel_lut
+        x_pix, y_pix: pixel coordinates
+        max_spread: largest 3D extent of the neighbouring pixels that is interpolated, in m
+        project_pixels: function (x_pix, y_pix) -> (utm_x, utm_y, utm_z), as given to load_pixel_lut
+
+    Returns:
+        tuple: utm_x, utm_y, utm_z arrays, NaN outside the image and where the terrain is missed
+    """
+    x_pix = np.asarray(x_pix, dtype=float)
+    y_pix = np.asarray(y_pix, dtype=float)
+    height, width = hit.shape
+    utm = np.full(x_pix.shape + (3,), np.nan)
+
+    inside = (x_pix >= 0) & (x_pix <= width - 1) & (y_pix >= 0) & (y_pix <= height - 1)
+    x, y = x_pix[inside], y_pix[inside]
+    x0 = np.minimum(np.floor(x).astype(np.intp), width - 2)
+    y0 = np.minimum(np.floor(y).astype(np.intp), height - 2)
+    wx = x - x0
+    wy = y - y0
+    weights = np.stack([(1 - wx) * (1 - wy), wx * (1 - wy), (1 - wx) * wy, wx * wy])
+    corners = np.stack([lut[y0 + dy, x0 + dx] for dy, dx in ((0, 0), (0, 1), (1, 0), (1, 1))])
+    # corners with zero weight do not matter, so integer pixels next to a miss or an edge still resolve
+    used = (weights > 0)[..., None]
+    values = np.einsum('kn,knj->nj', weights, np.where(used, corners, 0.0))
+    # unused corners are replaced by the interpolated value, which lies within the used ones; misses are NaN
+    corners = np.where(used, corners, values)
+    spread = np.linalg.norm(corners.max(axis=0) - corners.min(axis=0), axis=-1)
+    edge = ~(spread <= max_spread)
+
+    if edge.any():
+        if project_pixels is not None:
+            values[edge] = np.column_stack(project_pixels(x[edge], y[edge]))
+        else:
+            values[edge] = lut[np.rint(y[edge]).astype(np.intp), np.rint(x[edge]).astype(np.intp)]
+    utm[inside] = values
+    return utm[..., 0], utm[..., 1], utm[..., 2]
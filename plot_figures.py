@@ -6,66 +6,130 @@ import matplotlib.pyplot as plt
 import rasterio
 from pathlib import Path
 
+from track_store import TrackStore
+from track_velocities import load_tracks
+from velocity_aggregation import aggregate_velocities, BOUNDS_MPY, STD_CUTOFF_MPY
+from dem_window import load_dem_window, horizontal_fov, view_bounds
+from dem_render import load_shaded_dem, track_collection
+
 # define csv path and dem
 projected_dir = Path("./csv_projected")
 velocity_dir = Path("./csv_velocities")
+
+# read all tracks from the columnar track store in one read instead of the csv folders
+use_track_store = True
+track_store_dir = Path("./track_store")
 dem_path = Path("./VL_DEM_ibai_UTM.tif")
 
+# only read the part of the dem the camera sees (dem_window.py), the same cached window as project_tracked_features.py
+use_dem_window = True
+cache_dir = Path("./cache")
+cam_x, cam_y = 887045, 6540858  # UTM
+yaw_deg = 135
+focal_mm, sensor_width_mm = 34, 22.3
+max_dist = 5000   # m
+window_margin_deg = 5
+
+# fast track map: the dem is read at the figure resolution and drawn as a cached coloured hillshade (dem_render.py),
+# all tracks are one LineCollection coloured by track_color instead of one line and legend entry per track
+fast_render = True
+track_color = "speed"  # "speed" (m/yr of each segment) or "region"
+figure_dpi = 300
+
 track_plot_path = Path("./figures_out/all_tracks_on_dem.png")
 velocity_plot_path = Path("./figures_out/all_velocity_timeseries.png")
 
-# load dem tif
-with rasterio.open(dem_path) as dem_ds:
-    dem = dem_ds.read(1, masked=True)
-    bounds = dem_ds.bounds
-    dem_extent = [bounds.left, bounds.right, bounds.bottom, bounds.top]
+# the average velocity is the median per region (upper / lower icefall) and time bin, filtered like wrapper.m
+velocity_bin = "1D"  # pandas frequency, e.g. "1h" or "7D"
+velocity_bounds = BOUNDS_MPY  # (min, max) m/yr of the speed magnitude, velocities outside are not used
+velocity_std_cutoff = STD_CUTOFF_MPY  # m/yr, bins with a larger spread get no average
+aggregate_path = velocity_dir / "velocities_binned.csv"
 
 #% make a plot showing the tracks of the clicked points on the dem.
 fig1, ax1 = plt.subplots(figsize=(12, 10))
-ax1.imshow(dem, extent=dem_extent, cmap='terrain', origin='upper')
 
-for i, csv_path in enumerate(projected_dir.glob("*_projected.csv")):
-    df = pd.read_csv(csv_path)
-    label = csv_path.stem.replace("_projected", "")
-    ax1.plot(df['utm_x'], df['utm_y'], marker='o', markersize=4, linewidth=1.5, label=label)
+# load dem tif
+if fast_render:
+    view = None
+    if use_dem_window:
+        view = view_bounds(cam_x, cam_y, yaw_deg, horizontal_fov(focal_mm, sensor_width_mm), max_dist,
+                           window_margin_deg)
+    shaded_dem, dem_extent = load_shaded_dem(dem_path, cache_dir, int(fig1.get_figwidth() * figure_dpi), view)
+    ax1.imshow(shaded_dem, extent=dem_extent, origin='upper', interpolation='nearest')  # already at figure size
+else:
+    if use_dem_window:
+        dem, dem_transform, _ = load_dem_window(dem_path, cache_dir, cam_x, cam_y, yaw_deg,
+                                                horizontal_fov(focal_mm, sensor_width_mm), max_dist,
+                                                window_margin_deg)
+        west, south, east, north = rasterio.transform.array_bounds(*dem.shape, dem_transform)
+        dem_extent = [west, east, south, north]
+    else:
+        with rasterio.open(dem_path) as dem_ds:
+            dem = dem_ds.read(1, masked=True)
+            bounds = dem_ds.bounds
+            dem_extent = [bounds.left, bounds.right, bounds.bottom, bounds.top]
+    ax1.imshow(dem, extent=dem_extent, cmap='terrain', origin='upper')
+
+track_store = TrackStore(track_store_dir) if use_track_store else None
+if track_store is not None and track_store.exists('projected'):
+    projected = track_store.read('projected', columns=['track_id', 'timestamp', 'utm_x', 'utm_y'])
+else:
+    if track_store is not None:
+        print(f"No projected tracks in {track_store_dir}, reading {projected_dir}")
+    projected = load_tracks(projected_dir.glob("*_projected.csv"), suffix="_projected")
+
+if fast_render:
+    track_lines, region_handles = track_collection(projected, track_color, bounds=velocity_bounds, linewidth=1.5)
+    ax1.add_collection(track_lines)
+    if track_color == "speed":
+        fig1.colorbar(track_lines, ax=ax1, label="Speed (m/yr)", shrink=0.7, extend='both')
+    else:
+        ax1.legend(handles=region_handles, loc='upper right')
+else:
+    for label, df in projected.groupby('track_id', sort=False):
+        ax1.plot(df['utm_x'], df['utm_y'], marker='o', markersize=4, linewidth=1.5, label=label)
+    ax1.legend(loc='upper right')
 
 ax1.set_title("All Projected Tracks on DEM")
 ax1.set_xlabel("Easting (m)")
 ax1.set_ylabel("Northing (m)")
 ax1.set_aspect('equal')
-ax1.legend(loc='upper right')
 ax1.grid(True)
 plt.tight_layout()
-plt.savefig(track_plot_path, dpi=300)
+plt.savefig(track_plot_path, dpi=figure_dpi)
 
 
 #%%
 # plot the ice velocities
 fig2, ax2 = plt.subplots(figsize=(12, 6))
 
-all_series = []  # to store each track's series for averaging
-
-for csv_path in velocity_dir.glob("*_velocities.csv"):
-    df = pd.read_csv(csv_path)
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-
-    label = csv_path.stem.replace("_velocities", "")
-    ax2.plot(df['timestamp'], df['line_speed_mpy'], marker='', linestyle='-', label=label)
-
-    series = df[['timestamp', 'line_speed_mpy']].dropna()
-    series = series.set_index('timestamp')
-    all_series.append(series)
-
-# calculate average of each time step
-combined_df = pd.concat(all_series, axis=1, join='outer')
-combined_df.columns = [f"track_{i}" for i in range(len(all_series))]
-combined_df['mean_speed'] = combined_df.mean(axis=1)
+if track_store is not None and track_store.exists('velocities'):
+    velocities = track_store.read('velocities', columns=['track_id', 'timestamp', 'line_speed_mpy'])
+else:
+    if track_store is not None:
+        print(f"No velocities in {track_store_dir}, reading {velocity_dir}")
+    velocities = load_tracks(velocity_dir.glob("*_velocities.csv"), suffix="_velocities")
+    velocities['timestamp'] = pd.to_datetime(velocities['timestamp'])
+
+# all tracks as one faint line, broken between tracks, with one legend entry instead of one per track
+gap = pd.DataFrame({'timestamp': [pd.NaT], 'line_speed_mpy': [np.nan]})
+if not velocities.empty:
+    track_lines = pd.concat([part for _, df in velocities.groupby('track_id', sort=False)
+                             for part in (df[['timestamp', 'line_speed_mpy']], gap)], ignore_index=True)
+    ax2.plot(track_lines['timestamp'], track_lines['line_speed_mpy'], color='tab:blue', alpha=0.3, linewidth=0.8,
+             label='Single tracks')
+
+# robust average of each time bin, streamed track by track into the bins
+aggregate = aggregate_velocities(velocities.groupby('track_id', sort=False), freq=velocity_bin,
+                                 bounds=velocity_bounds, std_cutoff=velocity_std_cutoff)
+aggregate.to_csv(aggregate_path, index=False)
 
 # plot figure 
-ax2.plot(combined_df.index, combined_df['mean_speed'], color='black',
-         linewidth=2.5, label='Average Speed (all tracks)')
+for (region, df), color in zip(aggregate.groupby('region'), ['black', 'dimgray', 'darkgray']):
+    ax2.plot(df['bin_start'], df['velocity'], color=color, marker='o',
+             linewidth=2.5, label=f'Median Speed ({region} icefall)')
 
-ax2.set_title("Velocity Time Series (All Tracks + Mean)")
+ax2.set_title("Velocity Time Series (All Tracks + Median)")
 ax2.set_xlabel("Time")
 ax2.set_ylabel("Speed (m/yr)")
 ax2.grid(True)
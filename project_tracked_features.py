@@ -7,6 +7,14 @@ import pandas as pd
 import rasterio
 from pathlib import Path
 
+from terrain_projection import ray_to_world, dem_to_array, intersect_terrain, load_max_pyramid, intersect_terrain_pyramid
+from dem_window import load_dem_window, horizontal_fov
+from pixel_lut import lut_key, load_pixel_lut, lookup_pixels
+from track_manifest import config_hash, load_manifest, save_manifest, rows_to_process, removed_inputs
+from camera_poses import update_pose_table, correct_pixels
+from track_store import TrackStore, MAX_PARTS
+from frame_selection import read_selection_index, SELECTION_INDEX
+
 # define csv paths and dem
 csv_dir = Path("./csv_tracking")        # Folder with input CSVs
 output_dir = Path("./csv_projected")    # Folder for output CSVs
@@ -31,58 +39,169 @@ cy = image_height / 2
 pixel_size_x = sensor_width_mm / image_width
 pixel_size_y = sensor_height_mm / image_height
 
-# load dem from tif
-with rasterio.open(dem_path) as dem_ds:
-    dem = dem_ds.read(1, masked=True)
-    dem_bounds = dem_ds.bounds
-    transform = dem_ds.transform
-
-    def ray_to_world(x_pix, y_pix, base_yaw_deg, base_pitch_deg):
-        x_mm = (x_pix - cx) * pixel_size_x
-        y_mm = (y_pix - cy) * pixel_size_y
-        offset_yaw_deg = np.degrees(np.arctan2(x_mm, focal_mm))
-        offset_pitch_deg = np.degrees(np.arctan2(y_mm, focal_mm))
-        yaw = base_yaw_deg + offset_yaw_deg
-        pitch = base_pitch_deg + offset_pitch_deg
-        yaw_rad = np.radians(yaw)
-        pitch_rad = np.radians(pitch)
-        dx = np.cos(pitch_rad) * np.sin(yaw_rad)
-        dy = np.cos(pitch_rad) * np.cos(yaw_rad)
-        dz = -np.sin(pitch_rad)
-        return np.array([dx, dy, dz])
-
-    def terrain_intersection(ray_origin, ray_dir, max_dist=5000, step=0.5):
-        for t in np.arange(0, max_dist, step):
-            pos = ray_origin + ray_dir * t
-            utm_x, utm_y = pos[0], pos[1]
-            if not (dem_bounds.left <= utm_x <= dem_bounds.right and
-                    dem_bounds.bottom <= utm_y <= dem_bounds.top):
-                continue
-            row, col = dem_ds.index(utm_x, utm_y)
-            if 0 <= row < dem.shape[0] and 0 <= col < dem.shape[1]:
-                ground_z = dem[row, col]
-                if pos[2] <= ground_z:
-                    return utm_x, utm_y, ground_z
-        return None
-
-    # dynamic part of the script, loop through each csv (track) and then loop through each point.
+# ray marching settings: results match the old 0.5 m per-pixel loop to within one 0.5 m step along the ray
+max_dist = 5000   # m
+march_step = 0.5  # m, can be made coarser since the crossing is refined by bisection
+n_bisect = 10
+use_dem_pyramid = True  # skip open air with a max-elevation pyramid (stored next to the dem), exact per dem cell
+
+# only read the part of the dem in the horizontal field of view of the camera (out to max_dist),
+# cached as a memory-mapped float32 window in cache_dir
+use_dem_window = True
+window_margin_deg = 5  # extra view angle on both sides, covers the camera drift corrections
+
+# project every pixel of the image once and cache it as a memory-mapped lookup table in cache_dir.
+# The table is keyed by the camera pose, intrinsics and dem file and rebuilt when any of them changes.
+use_pixel_lut = True
+lut_max_spread = 50.0  # m, points between pixels further apart (ridges, occlusion edges) are ray-marched
+cache_dir = Path("./cache")
+
+# correct for camera drift: the rotation of every image relative to a reference image is estimated with
+# camera_shift/calculate_camera_shift.py and stored in a pose table, new images are added on each run.
+# The pose above (yaw_deg, pitch_deg) is the pose of the reference image. Needs the tracking images and cv2.
+use_pose_table = False
+image_folder = Path("./filtered_for_tracking")
+pose_reference_image = None  # None: first image in image_folder
+pose_table_path = cache_dir / "camera_poses.csv"
+
+# also keep the clicked and projected tracks in the columnar track store (tables 'tracking' and 'projected'),
+# the csv output is written as before. The 'tracking' table is filled from the csv files of csv_dir only.
+use_track_store = True
+track_store_dir = Path("./track_store")
+
+# the camera drift estimation starts a process pool, whose workers import this script again (spawn on Windows)
+if __name__ == "__main__":
+    # load dem from tif
+    if use_dem_window:
+        dem, transform, dem_window_path = load_dem_window(dem_path, cache_dir, cam_x, cam_y, yaw_deg,
+                                                          horizontal_fov(focal_mm, sensor_width_mm), max_dist,
+                                                          window_margin_deg)
+    else:
+        with rasterio.open(dem_path) as dem_ds:
+            dem = dem_to_array(dem_ds.read(1, masked=True))
+            transform = dem_ds.transform
+
+    if use_dem_pyramid:
+        # the pyramid of a window is stored next to the cached window
+        dem_pyramid = load_max_pyramid(dem_window_path if use_dem_window else dem_path, dem)
+
+    ray_origin = np.array([cam_x, cam_y, cam_z])
+
+    def project_pixels(x_pix, y_pix):
+        """ Project pixel coordinates onto the dem, returns utm_x, utm_y, utm_z (NaN where the ray misses) """
+        ray_dirs = ray_to_world(x_pix, y_pix, yaw_deg, pitch_deg, cx, cy, focal_mm, pixel_size_x, pixel_size_y)
+        if use_dem_pyramid:
+            return intersect_terrain_pyramid(ray_origin, ray_dirs, dem, transform, dem_pyramid, max_dist=max_dist)
+        return intersect_terrain(ray_origin, ray_dirs, dem, transform, max_dist=max_dist, step=march_step, n_bisect=n_bisect)
+
+    # hash of everything the projection depends on, keys both the pixel lookup table and the manifest
+    camera_config = lut_key(dem_path, cam=[cam_x, cam_y, cam_z], pose=[pitch_deg, yaw_deg, roll_deg],
+                            image=[image_width, image_height], sensor=[focal_mm, sensor_width_mm, sensor_height_mm],
+                            marching=[use_dem_pyramid, max_dist, march_step, n_bisect],
+                            dem_window=[use_dem_window, window_margin_deg])
+
+    if use_pixel_lut:
+        pixel_lut, pixel_hit = load_pixel_lut(cache_dir, camera_config, image_width, image_height, project_pixels)
+
+    if use_pose_table:
+        if (image_folder / SELECTION_INDEX).exists():
+            image_files, _ = read_selection_index(image_folder / SELECTION_INDEX)  # frames selected in index mode
+        elif image_folder.is_dir():
+            image_files = sorted(f for f in image_folder.iterdir() if f.suffix.lower() in ['.jpg', '.jpeg', '.png'])
+        else:
+            image_files = []
+        if not image_files:
+            print(f"No images in {image_folder}, projecting without camera drift correction")
+            use_pose_table = False
+
+    if use_pose_table:
+        if pose_reference_image is None:
+            pose_reference_image = image_files[0]
+        pose_table = update_pose_table(image_files, pose_reference_image, pose_table_path,
+                                       focal_mm, sensor_width_mm, sensor_height_mm)
+
+    # only new or changed tracks are projected, tracks that only got extra rows just have those rows projected
+    manifest_path = output_dir / "manifest.json"
+    manifest = load_manifest(manifest_path)
+    config = config_hash(camera=camera_config, pixel_lut=[use_pixel_lut, lut_max_spread],
+                         pose_reference=Path(pose_reference_image).name if use_pose_table else None)
+
+    if use_track_store:
+        track_store = TrackStore(track_store_dir)
+        if not track_store.exists('projected'):
+            # fill a new store with the projections made so far
+            track_store.import_csv('projected', list(output_dir.glob("*_projected.csv")), suffix="_projected")
+        store_replaced, store_appended = [], []
+
+    # dynamic part of the script, loop through each csv (track) and project all its new points at once.
     for csv_path in csv_dir.glob("*.csv"):
+        out_path = output_dir / (csv_path.stem + "_projected.csv")
+        entry = manifest.get(csv_path.name)
+        first_row, current = rows_to_process(csv_path, entry, config)
+        if first_row is None and (out_path.exists() or entry["hits"] == 0):
+            continue
+        if first_row is None or (first_row > 0 and entry["hits"] > 0 and not out_path.exists()):
+            first_row = 0  # output was removed, redo the whole track
+
         df = pd.read_csv(csv_path)
-        out_rows = []
-        for _, row in df.iterrows():
-            ray_origin = np.array([cam_x, cam_y, cam_z])
-            ray_dir = ray_to_world(row['x'], row['y'], yaw_deg, pitch_deg)
-            result = terrain_intersection(ray_origin, ray_dir)
-            if result:
-                out_rows.append({
-                    'filename': row['filename'],
-                    'timestamp': row['timestamp'],
-                    'utm_x': result[0],
-                    'utm_y': result[1],
-                    'utm_z': result[2]
-                })
-        
-        if out_rows:
-            out_df = pd.DataFrame(out_rows)
-            out_name = csv_path.stem + "_projected.csv"
-            out_df.to_csv(output_dir / out_name, index=False)
+        new_rows = df.iloc[first_row:]
+        x_pix, y_pix = new_rows['x'].to_numpy(), new_rows['y'].to_numpy()
+        if use_pose_table:
+            # pixels of frames without a pose estimate are projected with the reference pose
+            poses = pose_table.reindex(new_rows['filename'])
+            x_pix, y_pix = correct_pixels(x_pix, y_pix, poses['roll_deg'], poses['pitch_deg'], poses['yaw_deg'],
+                                          fx, fy, cx, cy)
+        if use_pixel_lut:
+            utm_x, utm_y, utm_z = lookup_pixels(pixel_lut, pixel_hit, x_pix, y_pix, lut_max_spread, project_pixels)
+        else:
+            utm_x, utm_y, utm_z = project_pixels(x_pix, y_pix)
+        out_df = pd.DataFrame({
+            'filename': new_rows['filename'],
+            'timestamp': new_rows['timestamp'],
+            'utm_x': utm_x,
+            'utm_y': utm_y,
+            'utm_z': utm_z
+        }).dropna(subset=['utm_x'])
+
+        hits = len(out_df) + (entry["hits"] if first_row > 0 else 0)
+        if first_row > 0 and out_path.exists():
+            out_df.to_csv(out_path, mode='a', header=False, index=False)
+        elif not out_df.empty:
+            out_df.to_csv(out_path, index=False)
+        elif out_path.exists():
+            out_path.unlink()  # no points left on the terrain, do not keep an outdated output
+
+        if use_track_store:
+            # the csv is what feature_tracking writes, so it replaces the track in the 'tracking' table
+            store_replaced.append((csv_path.stem, df, out_df if first_row == 0 else None))
+            if first_row > 0:
+                store_appended.append(out_df.assign(track_id=csv_path.stem))
+
+        manifest[csv_path.name] = dict(current, rows=len(df), hits=hits, config=config)
+        save_manifest(manifest_path, manifest)
+
+    # tracks whose csv was deleted: remove their projection and manifest entry too
+    removed = removed_inputs(manifest, csv_dir)
+    for name in removed:
+        (output_dir / (Path(name).stem + "_projected.csv")).unlink(missing_ok=True)
+        del manifest[name]
+    if removed:
+        save_manifest(manifest_path, manifest)
+        print(f"Removed the projections of {len(removed)} deleted tracks")
+
+    # update the store once for all changed tracks
+    if use_track_store and store_replaced:
+        track_ids = [track_id for track_id, _, _ in store_replaced]
+        track_store.replace_tracks('tracking', pd.concat([df.assign(track_id=track_id)
+                                                          for track_id, df, _ in store_replaced]), track_ids)
+        projected = [out_df.assign(track_id=track_id) for track_id, _, out_df in store_replaced if out_df is not None]
+        if projected:
+            track_store.replace_tracks('projected', pd.concat(projected),
+                                       [track_id for track_id, _, out_df in store_replaced if out_df is not None])
+        if store_appended:
+            track_store.append('projected', pd.concat(store_appended))
+            track_store.compact('projected', MAX_PARTS)  # every run with appended rows adds a part
+    if use_track_store and removed:
+        removed_ids = [Path(name).stem for name in removed]
+        track_store.replace_tracks('tracking', pd.DataFrame(), removed_ids)
+        track_store.replace_tracks('projected', pd.DataFrame(), removed_ids)
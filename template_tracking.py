@@ -0,0 +1,158 @@
+""" Template matching for the assisted mode of feature_tracking.py.
+Every clicked or accepted position of a track cuts a new template patch around the feature, since the surface of
+the icefall changes from image to image. In the next images the feature is searched with normalized
+cross-correlation (cv2.matchTemplate) in a window around its last position. A background thread predicts a few
+images ahead, each from the prediction of the image before, and stops at the first image where the correlation is
+below min_score, since the predictions after it are not reliable. """
+
+import threading
+
+import cv2
+import numpy as np
+
+
+def grey(img):
+    """ float32 grey image of an imread result (RGB(A) uint8 or float) """
+    img = np.asarray(img, dtype=np.float32)
+    if img.ndim == 3:
+        img = img[:, :, :3].mean(axis=2)
+    return np.ascontiguousarray(img)
+
+
+def extract_template(img, x, y, half_size):
+    """ Square patch of 2 * half_size + 1 pixels around (x, y) of a grey image, None if it is not inside the image """
+    x, y = int(round(x)), int(round(y))
+    if x - half_size < 0 or y - half_size < 0 or x + half_size >= img.shape[1] or y + half_size >= img.shape[0]:
+        return None
+    return img[y - half_size:y + half_size + 1, x - half_size:x + half_size + 1].copy()
+
+
+def match_template(img, template, x, y, search_radius):
+    """ Position of the template in a grey image, searched within search_radius pixels of (x, y)
+
+    Returns:
+        tuple: x, y (ints, center of the best match) and the normalized correlation (-1 to 1);
+            (x, y, -1.0) if the search window does not fit in the image
+    """
+    half = template.shape[0] // 2
+    x, y = int(round(x)), int(round(y))
+    x0, y0 = max(x - search_radius - half, 0), max(y - search_radius - half, 0)
+    x1, y1 = min(x + search_radius + half + 1, img.shape[1]), min(y + search_radius + half + 1, img.shape[0])
+    window = img[y0:y1, x0:x1]
+    if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+        return x, y, -1.0
+    correlation = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+    _, score, _, (dx, dy) = cv2.minMaxLoc(correlation)
+    return x0 + dx + half, y0 + dy + half, float(score)
+
+
+class TemplatePredictor():
+    """ Predicts the position of a clicked feature in the next images, computed ahead in a background thread.
+    """
+    def __init__(self, load, n_frames, half_size=25, search_radius=60, n_ahead=3, min_score=0.7):
+        """ Start the prediction thread
+
+        Args:
+            load: function i -> image i (e.g. FramePrefetcher.peek)
+            n_frames: number of images
+            half_size: the template is 2 * half_size + 1 pixels square
+            search_radius: pixels around the last position to search in
+            n_ahead: number of images after the current one to predict in advance
+            min_score: lowest correlation of a prediction to predict the next image from
+        """
+        self.load = load
+        self.n_frames = n_frames
+        self.half_size = half_size
+        self.search_radius = search_radius
+        self.n_ahead = n_ahead
+        self.min_score = min_score
+        self.template = None
+        self.anchor = None  # (image, x, y) of the last clicked or accepted position
+        self.predictions = {}  # {image: (x, y, score)} for the images after the anchor
+        self.current = 0
+        self.generation = 0  # changes with the anchor, to drop predictions of an old anchor
+        self.lock = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def accept(self, i, x, y):
+        """ Position of the feature in image i (clicked or an accepted prediction), the template is cut from it """
+        x, y = int(x), int(y)
+        template = extract_template(self.load(i), x, y, self.half_size)
+        if template is None and self.template is None:
+            print("Feature too close to the image border for a template, no predictions for this track")
+            return
+        with self.lock:
+            if template is not None:
+                self.template = grey(template)  # near the border the last template is kept
+            if self.predictions.get(i, (None, None))[:2] == (x, y):
+                # prediction accepted: the predictions after it still hold, the next ones use the new template
+                self.anchor = (i, x, y)
+                return
+            self.anchor = (i, x, y)
+            self.predictions = {}
+            self.generation += 1
+            self.current = i + 1
+            self.lock.notify_all()
+
+    def _next(self):
+        """ Next image to predict and the position to search around, None if there is nothing to do """
+        i, x, y = self.anchor
+        i += 1
+        while i in self.predictions:
+            x, y, score = self.predictions[i]
+            if score < self.min_score:
+                return None
+            i += 1
+        if i >= self.n_frames or i > self.current + self.n_ahead:
+            return None
+        return i, x, y
+
+    def _run(self):
+        while True:
+            with self.lock:
+                job = self._next() if self.template is not None else None
+                if job is None:
+                    self.lock.wait()  # until a new anchor or the current image moves
+                    continue
+                template, generation = self.template, self.generation
+            i, x, y = job
+            try:
+                prediction = match_template(grey(self.load(i)), template, x, y, self.search_radius)
+            except Exception as e:
+                print(f"Could not predict image {i}: {e}")
+                prediction = (x, y, -1.0)
+            with self.lock:
+                if generation == self.generation:
+                    self.predictions[i] = prediction
+                    self.lock.notify_all()
+
+    def _pending(self, i):
+        """ True if the prediction of image i is still being computed (call with the lock held) """
+        return self.template is not None and i > self.anchor[0] and i not in self.predictions \
+            and self._next() is not None
+
+    def is_pending(self, i):
+        """ True if a prediction of image i will come, but is not computed yet """
+        with self.lock:
+            return self._pending(i)
+
+    def predict(self, i, timeout=None):
+        """ Predicted position of the feature in image i, also moves the images predicted ahead to i
+
+        Args:
+            i: image
+            timeout: seconds to wait for a prediction that is still being computed, None waits until it is done
+
+        Returns:
+            tuple: x, y, correlation; None if it is not computed within timeout (see is_pending), there is no
+                template yet, i is not after the last accepted position or an image before i already had a
+                correlation below min_score
+        """
+        with self.lock:
+            self.current = i
+            self.lock.notify_all()
+            self.lock.wait_for(lambda: not self._pending(i), timeout)
+            if self.template is None or i <= self.anchor[0]:
+                return None
+            return self.predictions.get(i)
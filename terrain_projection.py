@@ -0,0 +1,271 @@
+""" Batched ray-DEM intersection used to convert clicked pixel coordinates to terrain coordinates.
+All rays are marched together in numpy, world coordinates are mapped to DEM rows/columns with the
+affine transform of the raster, and the first crossing of each ray is refined by bisection.
+A pyramid of block maxima of the DEM can be used to skip over open air (intersect_terrain_pyramid). """
+
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+def ray_to_world(x_pix, y_pix, base_yaw_deg, base_pitch_deg, cx, cy, focal_mm, pixel_size_x, pixel_size_y):
+    """ Convert pixel coordinates to unit view directions in UTM (east, north, up).
+
+    Args:
+        x_pix, y_pix: pixel coordinates, scalars or arrays of the same shape
+        base_yaw_deg: heading of the optical axis, clockwise from north
+        base_pitch_deg: tilt of the optical axis, positive looking down
+        cx, cy: principal point in pixels
+        focal_mm: focal length in mm
+        pixel_size_x, pixel_size_y: size of a pixel on the sensor in mm
+
+    Returns:
+        np.ndarray: directions with shape (..., 3)
+    """
+    x_mm = (np.asarray(x_pix, dtype=float) - cx) * pixel_size_x
+    y_mm = (np.asarray(y_pix, dtype=float) - cy) * pixel_size_y
+    yaw_rad = np.radians(base_yaw_deg + np.degrees(np.arctan2(x_mm, focal_mm)))
+    pitch_rad = np.radians(base_pitch_deg + np.degrees(np.arctan2(y_mm, focal_mm)))
+    dx = np.cos(pitch_rad) * np.sin(yaw_rad)
+    dy = np.cos(pitch_rad) * np.cos(yaw_rad)
+    dz = -np.sin(pitch_rad)
+    return np.stack([dx, dy, dz], axis=-1)
+
+
+def dem_to_array(dem):
+    """ Turn a (masked) DEM band into a float array with NaN for nodata, which never counts as a hit. """
+    return np.ma.filled(np.ma.asarray(dem).astype(np.float64), np.nan)
+
+
+def sample_dem(dem, transform, utm_x, utm_y):
+    """ Nearest-cell DEM lookup for arrays of UTM coordinates.
+
+    Uses the inverse affine transform (same floor convention as dem_ds.index). Points outside
+    the raster or on nodata cells return NaN.
+    """
+    inv = ~transform
+    col = np.floor(inv.a * utm_x + inv.b * utm_y + inv.c)
+    row = np.floor(inv.d * utm_x + inv.e * utm_y + inv.f)
+    inside = (row >= 0) & (row < dem.shape[0]) & (col >= 0) & (col < dem.shape[1])
+    ground = np.full(np.shape(utm_x), np.nan)
+    ground[inside] = dem[row[inside].astype(np.intp), col[inside].astype(np.intp)]
+    return ground
+
+
+def intersect_terrain(ray_origin, ray_dirs, dem, transform, max_dist=5000, step=0.5, n_bisect=10, block=256):
+    """ Intersect many rays with the DEM at once.
+
+    Every ray is sampled at t = 0, step, 2*step, ... like the original per-pixel loop, but the samples
+    are evaluated in blocks of `block` steps for all still-active rays together. The first sample
+    at or below the ground is then refined by `n_bisect` bisections between it and the previous
+    sample, so the crossing is located to within step / 2**n_bisect along the ray.
+
+    Compared to the old per-row loop (step=0.5, no refinement), which returns the first sample
+    below the terrain, results agree to within one legacy step (0.5 m) along the ray, and z is the
+    DEM value of the hit cell as before. Terrain thinner than `step` along the ray can be missed,
+    exactly as with the fixed-step loop.
+
+    Args:
+        ray_origin: camera position (3,) or per-ray origins (N, 3)
+        ray_dirs: view directions (N, 3), e.g. from ray_to_world
+        dem: float DEM array with NaN as nodata (see dem_to_array)
+        transform: affine transform of the DEM
+        max_dist: maximum distance along the ray in m
+        step: marching step in m
+        n_bisect: number of bisection steps used to refine the crossing
+        block: number of steps evaluated per vectorized iteration
+
+    Returns:
+        tuple: utm_x, utm_y, utm_z arrays of length N, NaN where the ray does not hit the terrain
+    """
+    ray_dirs = np.atleast_2d(np.asarray(ray_dirs, dtype=float))
+    n_rays = ray_dirs.shape[0]
+    origins = np.broadcast_to(np.asarray(ray_origin, dtype=float), (n_rays, 3))
+
+    # coarse march: first sample that is at or below the ground
+    hit_t = np.full(n_rays, np.nan)
+    active = np.arange(n_rays)
+    steps = np.arange(0, max_dist, step)
+    for start in range(0, len(steps), block):
+        if active.size == 0:
+            break
+        ts = steps[start:start + block]
+        pos = origins[active, None, :] + ray_dirs[active, None, :] * ts[None, :, None]
+        ground = sample_dem(dem, transform, pos[..., 0], pos[..., 1])
+        below = pos[..., 2] <= ground  # NaN (outside / nodata) compares False
+        found = below.any(axis=1)
+        hit_t[active[found]] = ts[below[found].argmax(axis=1)]
+        active = active[~found]
+
+    # refine by bisection between the last sample above and the first sample below the ground
+    hit = np.flatnonzero(~np.isnan(hit_t))
+    hi = hit_t[hit]
+    lo = np.maximum(hi - step, 0.0)
+    org, dirs = origins[hit], ray_dirs[hit]
+    for _ in range(n_bisect):
+        mid = 0.5 * (lo + hi)
+        pos = org + dirs * mid[:, None]
+        below = pos[:, 2] <= sample_dem(dem, transform, pos[:, 0], pos[:, 1])
+        hi = np.where(below, mid, hi)
+        lo = np.where(below, lo, mid)
+
+    utm_x = np.full(n_rays, np.nan)
+    utm_y = np.full(n_rays, np.nan)
+    utm_z = np.full(n_rays, np.nan)
+    pos = org + dirs * hi[:, None]
+    utm_x[hit], utm_y[hit] = pos[:, 0], pos[:, 1]
+    utm_z[hit] = sample_dem(dem, transform, pos[:, 0], pos[:, 1])
+    return utm_x, utm_y, utm_z
+
+
+def terrain_intersection(ray_origin, ray_dir, dem, transform, max_dist=5000, step=0.5):
+    """ Reference single-ray marcher, identical to the original per-row loop of project_tracked_features.
+    Kept to check intersect_terrain against. Returns (utm_x, utm_y, ground_z) or None.
+    """
+    for t in np.arange(0, max_dist, step):
+        pos = ray_origin + ray_dir * t
+        ground_z = sample_dem(dem, transform, np.array([pos[0]]), np.array([pos[1]]))[0]
+        if pos[2] <= ground_z:
+            return pos[0], pos[1], ground_z
+    return None
+
+
+def build_max_pyramid(dem):
+    """ Build a pyramid of block maxima: level k holds the maximum elevation of each 2**k x 2**k block.
+    Nodata is stored as -inf, so it never stops a ray. Level 0 is the DEM itself.
+    """
+    level = np.where(np.isnan(dem), -np.inf, dem)
+    levels = [level]
+    while level.shape[0] > 1 or level.shape[1] > 1:
+        rows, cols = level.shape
+        padded = np.full((rows + rows % 2, cols + cols % 2), -np.inf)
+        padded[:rows, :cols] = level
+        level = np.maximum.reduce([padded[0::2, 0::2], padded[1::2, 0::2], padded[0::2, 1::2], padded[1::2, 1::2]])
+        levels.append(level)
+    return levels
+
+
+def load_max_pyramid(dem_path, dem):
+    """ Load the max-elevation pyramid stored next to the DEM, (re)building it if the DEM changed.
+
+    The pyramid is saved as <dem name>.maxpyramid.npz, together with the size and mtime of the DEM it
+    was built from. Level 0 is not stored since it is the DEM itself.
+    """
+    dem_path = Path(dem_path)
+    pyramid_path = dem_path.with_suffix(".maxpyramid.npz")
+    stat = os.stat(dem_path)
+    if pyramid_path.exists():
+        with np.load(pyramid_path) as stored:
+            if stored["source_size"] == stat.st_size and stored["source_mtime"] == stat.st_mtime_ns:
+                n_levels = len(stored.files) - 2
+                return [np.where(np.isnan(dem), -np.inf, dem)] + [stored[f"level_{k}"] for k in range(1, n_levels + 1)]
+
+    levels = build_max_pyramid(dem)
+    np.savez(pyramid_path, source_size=stat.st_size, source_mtime=stat.st_mtime_ns,
+             **{f"level_{k}": level for k, level in enumerate(levels) if k > 0})
+    return levels
+
+
+def intersect_terrain_pyramid(ray_origin, ray_dirs, dem, transform, pyramid, max_dist=5000, return_steps=False):
+    """ Intersect many rays with the DEM, skipping empty space with a max-elevation pyramid.
+
+    At each iteration every active ray looks up the tiles containing its current position, from the
+    coarsest pyramid level down to single DEM cells, and jumps to the exit of the largest tile whose
+    maximum elevation stays below the ray. Only when even the current DEM cell cannot be skipped is the
+    ray close to the surface; the crossing then lies inside that cell and is computed exactly. Since
+    the terrain is looked up per cell, this is the exact first crossing of the nearest-cell DEM. It
+    agrees with the fixed 0.5 m march to within one step along the ray, except for rays that graze a
+    ridge for less than one step: the fixed march steps over those, this function does not.
+
+    Args:
+        ray_origin: camera position (3,) or per-ray origins (N, 3)
+        ray_dirs: view directions (N, 3)
+        dem: float DEM array with NaN as nodata
+        transform: affine transform of the DEM (north-up or rotated)
+        pyramid: levels from build_max_pyramid / load_max_pyramid
+        max_dist: maximum distance along the ray in m
+        return_steps: also return the number of iterations needed per ray
+
+    Returns:
+        tuple: utm_x, utm_y, utm_z arrays (NaN for misses), and optionally the steps per ray
+    """
+    ray_dirs = np.atleast_2d(np.asarray(ray_dirs, dtype=float))
+    n_rays = ray_dirs.shape[0]
+    origins = np.broadcast_to(np.asarray(ray_origin, dtype=float), (n_rays, 3))
+    n_rows, n_cols = dem.shape
+
+    # the ray in pixel space is linear in t as well
+    inv = ~transform
+    col0 = inv.a * origins[:, 0] + inv.b * origins[:, 1] + inv.c
+    row0 = inv.d * origins[:, 0] + inv.e * origins[:, 1] + inv.f
+    dcol = inv.a * ray_dirs[:, 0] + inv.b * ray_dirs[:, 1]
+    drow = inv.d * ray_dirs[:, 0] + inv.e * ray_dirs[:, 1]
+
+    # clip each ray to the raster, a ray that left the raster never comes back
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tc = np.stack([(0 - col0) / dcol, (n_cols - col0) / dcol])
+        tr = np.stack([(0 - row0) / drow, (n_rows - row0) / drow])
+    inside_c = (col0 >= 0) & (col0 < n_cols)
+    inside_r = (row0 >= 0) & (row0 < n_rows)
+    tc[:, dcol == 0] = np.where(inside_c[dcol == 0], [[-np.inf], [np.inf]], np.nan)
+    tr[:, drow == 0] = np.where(inside_r[drow == 0], [[-np.inf], [np.inf]], np.nan)
+    t_start = np.maximum(np.maximum(tc.min(axis=0), tr.min(axis=0)), 0.0)
+    t_end = np.minimum(np.minimum(tc.max(axis=0), tr.max(axis=0)), max_dist)
+
+    t = t_start.copy()
+    hit_t = np.full(n_rays, np.nan)
+    steps = np.zeros(n_rays, dtype=np.int64)
+    active = np.flatnonzero(t_start < t_end)
+    eps = 1e-6  # m, nudges a ray across the tile boundary it just reached
+
+    while active.size:
+        steps[active] += 1
+        ta = t[active]
+        c = col0[active] + dcol[active] * ta
+        r = row0[active] + drow[active] * ta
+        z = origins[active, 2] + ray_dirs[active, 2] * ta
+        ci = np.clip(np.floor(c).astype(np.intp), 0, n_cols - 1)
+        ri = np.clip(np.floor(r).astype(np.intp), 0, n_rows - 1)
+        dc, dr, dz = dcol[active], drow[active], ray_dirs[active, 2]
+
+        t_next = ta.copy()
+        decided = np.zeros(active.size, dtype=bool)
+        for k in range(len(pyramid) - 1, -1, -1):
+            size = 1 << k
+            c_lo = (ci >> k) * size
+            r_lo = (ri >> k) * size
+            with np.errstate(divide="ignore", invalid="ignore"):
+                dt_c = np.where(dc > 0, (c_lo + size - c) / dc, np.where(dc < 0, (c_lo - c) / dc, np.inf))
+                dt_r = np.where(dr > 0, (r_lo + size - r) / dr, np.where(dr < 0, (r_lo - r) / dr, np.inf))
+            dt = np.minimum(dt_c, dt_r)
+            tile_max = pyramid[k][ri >> k, ci >> k]
+            skip = ~decided & (np.minimum(z, z + dz * dt) > tile_max)
+            t_next[skip] = ta[skip] + dt[skip] + eps
+            decided |= skip
+
+        # the crossing lies in the current cell: either the ray is already below it, or it goes below before leaving
+        near = ~decided
+        ground = dem[ri[near], ci[near]]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t_cross = np.where(z[near] <= ground, ta[near], ta[near] + (z[near] - ground) / -dz[near])
+        hit_t[active[near]] = t_cross
+
+        t[active[decided]] = t_next[decided]
+        still = decided & (t_next < t_end[active])
+        active = active[still]
+
+    hit_t[hit_t > max_dist] = np.nan
+    hit = np.flatnonzero(~np.isnan(hit_t))
+    utm_x = np.full(n_rays, np.nan)
+    utm_y = np.full(n_rays, np.nan)
+    utm_z = np.full(n_rays, np.nan)
+    pos = origins[hit] + ray_dirs[hit] * hit_t[hit, None]
+    utm_x[hit], utm_y[hit] = pos[:, 0], pos[:, 1]
+    # z of the cell that stopped the ray, like the fixed-step march returns the ground elevation
+    inv_c = np.clip(np.floor(col0[hit] + dcol[hit] * hit_t[hit]).astype(np.intp), 0, n_cols - 1)
+    inv_r = np.clip(np.floor(row0[hit] + drow[hit] * hit_t[hit]).astype(np.intp), 0, n_rows - 1)
+    utm_z[hit] = dem[inv_r, inv_c]
+    if return_steps:
+        return utm_x, utm_y, utm_z, steps
+    return utm_x, utm_y, utm_z
@@ -0,0 +1,6 @@
+""" The modules under test are flat scripts in the repository root. """
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+
+from batch_tracking import track_pair_lk, track_pair_ncc, track_sequence, point_regions, write_tracks
+
+SHIFT = (2, 1)  # (dx, dy) pixels per image
+
+
+def make_frames(n, size=(240, 320)):
+    """ 8 bit frames of a smooth random texture moving SHIFT pixels per image """
+    rng = np.random.default_rng(0)
+    texture = cv2.GaussianBlur(rng.uniform(0, 255, (size[0] + 64, size[1] + 64)), (0, 0), 2)
+    texture = cv2.normalize(texture, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    return [np.roll(texture, (k * SHIFT[1], k * SHIFT[0]), axis=(0, 1))[:size[0], :size[1]] for k in range(n)]
+
+
+@pytest.mark.parametrize("track_pair", [track_pair_lk, track_pair_ncc])
+def test_forward_backward_check_drops_a_lost_point(track_pair):
+    prev, next_img = make_frames(2)
+    # the surface around the second point changes completely (e.g. a falling serac)
+    rng = np.random.default_rng(1)
+    next_img = next_img.copy()
+    next_img[110:190, 150:230] = cv2.GaussianBlur(rng.uniform(0, 255, (80, 80)), (0, 0), 2).astype(np.uint8)
+    points = np.array([[80.0, 60.0], [190.0, 150.0]], dtype=np.float32)
+
+    new_points, ok = track_pair(prev, next_img, points)
+    assert ok.tolist() == [True, False]
+    np.testing.assert_allclose(new_points[0], points[0] + SHIFT, atol=0.5)
+
+
+def test_segments_are_reseeded_and_share_an_image(tmp_path):
+    files = []
+    for k, frame in enumerate(make_frames(6)):
+        files.append(tmp_path / f"2023070{k + 1}120000.png")
+        cv2.imwrite(str(files[-1]), frame)
+    seeds = np.array([[80.0, 60.0], [160.0, 120.0]], dtype=np.float32)
+
+    segments = track_sequence(files, seeds, segment_length=3, n_workers=1)
+    assert [start for start, positions in segments] == [0, 2, 4]
+    for start, positions in segments:
+        assert positions.shape == (min(3, len(files) - start), 2, 2)
+        np.testing.assert_array_equal(positions[0], seeds)  # every segment starts from the seed grid
+        np.testing.assert_allclose(positions[-1] - seeds, (len(positions) - 1) * np.array([SHIFT] * 2), atol=0.5)
+
+    times = [f.stem for f in files]
+    # the last segment has only two images, too short for a track
+    assert write_tracks(tmp_path, files, times, segments, np.array(["u", "l"]), min_track_length=3) == 4
+    assert sorted(p.name for p in tmp_path.glob("*auto*.csv")) == \
+        ["lauto000_0001.csv", "lauto001_0001.csv", "uauto000_0000.csv", "uauto001_0000.csv"]
+
+
+def test_point_regions():
+    boundary = (np.array([100.0, 300.0]), np.array([50.0, 150.0]))
+    points = np.array([[150.0, 10.0], [150.0, 200.0], [50.0, 10.0], [350.0, 200.0]])
+    assert point_regions(points, boundary).tolist() == ["u", "l", "", ""]
+    assert point_regions(points).tolist() == ["l"] * 4
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from pathlib import Path
+from scipy.spatial.transform import Rotation
+
+from camera_poses import correct_pixels, update_pose_table
+
+FX, FY, CX, CY = 2900.0, 4400.0, 960.0, 720.0
+K = np.array([[FX, 0, CX], [0, FY, CY], [0, 0, 1]])
+
+
+def test_zero_and_nan_angles_leave_pixels_unchanged():
+    x, y = np.array([10.0, 960.0, 1800.0]), np.array([20.0, 720.0, 1400.0])
+    zeros = np.zeros(3)
+    x_ref, y_ref = correct_pixels(x, y, zeros, zeros, zeros, FX, FY, CX, CY)
+    np.testing.assert_allclose(x_ref, x, atol=1e-9)
+    np.testing.assert_allclose(y_ref, y, atol=1e-9)
+
+    nan = np.full(3, np.nan)
+    x_ref, y_ref = correct_pixels(x, y, nan, [1.0, 1.0, 1.0], nan, FX, FY, CX, CY)
+    np.testing.assert_allclose(x_ref, x, atol=1e-9)
+    np.testing.assert_allclose(y_ref, y, atol=1e-9)
+
+
+def test_rotated_pixels_map_back_to_the_reference():
+    rng = np.random.default_rng(0)
+    x_ref, y_ref = rng.uniform(0, 1920, 50), rng.uniform(0, 1440, 50)
+    roll, pitch, yaw = 0.3, -0.8, 1.2
+
+    # x_shifted ~ K R K^-1 x_reference
+    R = Rotation.from_euler("xyz", [roll, pitch, yaw], degrees=True).as_matrix()
+    shifted = np.column_stack([x_ref, y_ref, np.ones(50)]) @ (K @ R @ np.linalg.inv(K)).T
+    x_pix, y_pix = shifted[:, 0] / shifted[:, 2], shifted[:, 1] / shifted[:, 2]
+
+    n = np.ones(50)
+    x_back, y_back = correct_pixels(x_pix, y_pix, roll * n, pitch * n, yaw * n, FX, FY, CX, CY)
+    np.testing.assert_allclose(x_back, x_ref, atol=1e-6)
+    np.testing.assert_allclose(y_back, y_ref, atol=1e-6)
+
+
+def test_failed_frames_are_retried(tmp_path, monkeypatch):
+    shift_module = pytest.importorskip("camera_shift.calculate_camera_shift")
+    calls = []
+
+    def fake_shifts(reference_path, image_paths, *args, **kwargs):
+        calls.append([Path(f).name for f in image_paths])
+        return [dict(filename=Path(f).name, roll_deg=np.nan, pitch_deg=np.nan, yaw_deg=np.nan, n_matches=0,
+                     n_inliers=0, method=None, error="locked") if Path(f).name == "b.jpg" else
+                dict(filename=Path(f).name, roll_deg=0.1, pitch_deg=0.2, yaw_deg=0.3, n_matches=50,
+                     n_inliers=40, method="features", error=None) for f in image_paths]
+
+    monkeypatch.setattr(shift_module, "calculate_camera_shifts", fake_shifts)
+    table_path = tmp_path / "camera_poses.csv"
+    images = [tmp_path / "a.jpg", tmp_path / "b.jpg"]
+
+    table = update_pose_table(images, tmp_path / "ref.jpg", table_path, 8.0, 6.0, 4.5)
+    assert list(table.index) == ["a.jpg"]
+    assert table.reindex(["b.jpg"])['roll_deg'].isna().all()
+
+    update_pose_table(images, tmp_path / "ref.jpg", table_path, 8.0, 6.0, 4.5)
+    assert calls == [["a.jpg", "b.jpg"], ["b.jpg"]]
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from dem_render import track_collection
+from track_velocities import SECONDS_PER_YEAR
+
+
+def make_tracks():
+    """ Twenty tracks moving 1 - 2 m per day east, the last point of one of them 500 m off (a mismatched point) """
+    times = pd.date_range("2023-07-01", periods=4, freq="1D")
+    frames = []
+    for k in range(20):
+        x = 100.0 * k + np.arange(4) * (1 + k / 20)
+        if k == 7:
+            x[3] += 500
+        frames.append(pd.DataFrame(dict(track_id=f"u{k:03d}", timestamp=times, utm_x=x, utm_y=50.0 * k)))
+    return pd.concat(frames, ignore_index=True).sample(frac=1, random_state=0)  # order does not matter
+
+
+def test_speed_colours_are_not_stretched_by_outliers():
+    lines, handles = track_collection(make_tracks(), "speed")
+    assert handles == []
+
+    # segments only join points of the same track, in time order
+    segments = lines.get_segments()
+    assert len(segments) == 20 * 3
+    assert all(seg[0][1] == seg[1][1] and seg[1][0] > seg[0][0] for seg in segments)
+
+    speed = np.asarray(lines.get_array())
+    one_m_per_day = SECONDS_PER_YEAR / 86400
+    assert one_m_per_day <= np.median(speed) < 2 * one_m_per_day
+    assert speed.max() > 400 * one_m_per_day
+    # the colormap spans the common speeds, the outliers get its end colour
+    assert lines.norm.vmin >= one_m_per_day and lines.norm.vmax < 2 * one_m_per_day
+    assert lines.norm(speed.max()) > 1
+
+
+def test_bounds_keep_impossible_speeds_out_of_the_colour_range():
+    lines, _ = track_collection(make_tracks(), "speed", bounds=(0, 10 * 365), percentiles=(0, 100))
+    assert np.isclose(lines.norm.vmax, 1.95 * SECONDS_PER_YEAR / 86400)
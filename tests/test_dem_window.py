@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+import rasterio
+from affine import Affine
+
+import dem_window
+from dem_window import load_dem_window, view_bounds
+
+
+def write_dem(path, n=300, cell=2.0):
+    dem = (1000 + np.arange(n * n).reshape(n, n) * 0.01).astype(np.float32)
+    dem[160:170, 140:150] = -9999  # nodata in front of the camera
+    transform = Affine(cell, 0, 500000, 0, -cell, 6500000 + n * cell)
+    with rasterio.open(path, 'w', driver='GTiff', width=n, height=n, count=1, dtype='float32', nodata=-9999,
+                       transform=transform) as dst:
+        dst.write(dem, 1)
+    return dem, transform
+
+
+def test_window_is_cached_and_replaced_when_the_pose_changes(tmp_path, monkeypatch):
+    dem, transform = write_dem(tmp_path / "dem.tif")
+    cam_x, cam_y = 500300.0, 6500300.0  # centre of the DEM
+    cache = tmp_path / "cache"
+
+    # looking south, 200 m: the window is the bounding box of the wedge, rows and columns of the full DEM
+    window, window_transform, window_path = load_dem_window(tmp_path / "dem.tif", cache, cam_x, cam_y, 180, 40, 200)
+    left, bottom, right, top = view_bounds(cam_x, cam_y, 180, 40, 200)
+    assert top == cam_y and bottom == pytest.approx(cam_y - 200)
+    col0, row0 = ~transform * (window_transform.c, window_transform.f)
+    col0, row0 = int(round(col0)), int(round(row0))
+    assert window_transform.a == transform.a and row0 == 150 and window.shape[0] == 100
+    expected = dem[row0:row0 + window.shape[0], col0:col0 + window.shape[1]]
+    assert np.isnan(window).sum() == 100
+    np.testing.assert_array_equal(np.isnan(window), expected == -9999)
+    np.testing.assert_array_equal(window[~np.isnan(window)], expected[expected != -9999])
+
+    # the second run memory-maps the cached window without reading the DEM
+    monkeypatch.setattr(dem_window, "read_dem_window", lambda *args: pytest.fail("DEM read again"))
+    cached, cached_transform, cached_path = load_dem_window(tmp_path / "dem.tif", cache, cam_x, cam_y, 180, 40, 200)
+    assert isinstance(cached, np.memmap) and cached_path == window_path and cached_transform == window_transform
+    monkeypatch.undo()
+
+    # another pose: a new window, the old one is removed
+    _, _, new_path = load_dem_window(tmp_path / "dem.tif", cache, cam_x, cam_y, 90, 40, 200)
+    assert new_path != window_path and not window_path.exists()
+    assert sorted(p.name for p in cache.iterdir()) == sorted([new_path.name, new_path.with_suffix(".json").name])
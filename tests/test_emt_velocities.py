@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from emt_velocities import LAYOUTS, filtered_velocity, process_file, read_dat
+
+HEADER = "header\n" * 7
+
+
+def test_whitespace_layout_ignores_extra_and_pads_missing_fields(tmp_path):
+    path = tmp_path / "Trajectories_ObjectPoints_ImgPair_0-1.dat"
+    path.write_text(HEADER +
+                    "  1  0.1  0.2  0.3  1.0  2.0  0.1  0.1  3.0  0.9  25  1.5\n"
+                    "  2  0.1  0.2  0.3  1.0  2.0  0.1  0.1  3.0  0.9  25  2.5  99  99\n"
+                    "\n"
+                    "  3  0.1  0.2  0.3  1.0  2.0  0.1  0.1  3.0  0.9\n"
+                    "  4  0.1  0.2  0.3  1.0  2.0  0.1  0.1  nan?  0.9  25  3.5\n")
+
+    table = read_dat(path, "lower_icefall")
+    assert list(table.columns) == LAYOUTS["lower_icefall"][1]
+    np.testing.assert_array_equal(table['TrajectoryID'], [1, 2, 3, 4])
+    np.testing.assert_array_equal(table['vmd'], [1.5, 2.5, np.nan, 3.5])
+    assert np.isnan(table.loc[3, 's0LSMgreyValue'])
+
+
+def test_fixed_width_layout_reads_empty_fields_as_nan(tmp_path):
+    _, columns, widths = LAYOUTS["fixed_master"]
+    values = [[1, 0.5, -0.25, 0.125, 1.5, 2.5, 0.1, 0.2, 0.95, 1.75],
+              [2, 0.5, None, 0.125, 1.5, 2.5, 0.1, 0.2, 0.95, 4.0]]
+    lines = ["".join(("" if v is None else f"{v:g}").rjust(w) for v, w in zip(row, widths)) for row in values]
+    path = tmp_path / "Trajectories_ObjectPoints_ImgPair_0-1.dat"
+    path.write_text("header\n" * 5 + "\n".join(lines) + "\n")
+
+    table = read_dat(path, "fixed_master")
+    assert list(table.columns) == columns
+    np.testing.assert_array_equal(table['vmd'], [1.75, 4.0])
+    np.testing.assert_array_equal(table['DYm'], [-0.25, np.nan])
+
+
+def test_filter_of_wrapper():
+    # outside 0 - 10 m/day is dropped before the median
+    assert filtered_velocity(np.array([-1.0, 2.0, 3.0, 4.0, 50.0])) == 3.0
+    # a pair whose velocities scatter more than 1.5 m/day is dropped
+    assert np.isnan(filtered_velocity(np.array([1.0, 5.0, 9.0])))
+    assert np.isnan(filtered_velocity(np.array([np.nan, 11.0])))
+
+
+def test_unreadable_file_is_skipped(tmp_path, capsys):
+    times = pd.to_datetime(["2023-07-29 12:00", "2023-07-30 12:00"])
+    missing = tmp_path / "Trajectories_ObjectPoints_ImgPair_0-1.dat"
+    assert process_file((missing, "lower_icefall", times)) is None
+    assert "Skipping" in capsys.readouterr().out
+
+    missing.write_text(HEADER + "  1  0  0  0  0  0  0  0  0  0  0  2.0\n")
+    time, velocity = process_file((missing, "lower_icefall", times))
+    assert time == pd.Timestamp("2023-07-30 00:00") and velocity == 2.0
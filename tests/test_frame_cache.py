@@ -0,0 +1,27 @@
+import time
+
+import numpy as np
+import pytest
+
+from frame_cache import FramePrefetcher
+
+
+def test_failed_frame_is_not_read_again():
+    calls = []
+
+    def loader(path):
+        calls.append(path)
+        if path == "bad.png":
+            raise OSError("truncated file")
+        return np.zeros((4, 4))
+
+    frames = FramePrefetcher(["a.png", "bad.png", "c.png"], n_ahead=2, n_behind=0, start=0, loader=loader)
+    deadline = time.monotonic() + 5
+    while len(calls) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert frames.get(0).shape == (4, 4)
+    for _ in range(2):
+        with pytest.raises(OSError, match="truncated"):
+            frames.get(1)
+    assert calls.count("bad.png") == 1
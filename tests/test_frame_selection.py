@@ -0,0 +1,64 @@
+import datetime
+import os
+
+import pytest
+
+from frame_selection import (time_bins, bin_signature, place_frame, remove_frame, write_selection_index,
+                             read_selection_index)
+
+
+def make_frames(folder):
+    folder.mkdir()
+    times = [datetime.datetime(2023, 7, 1, 12), datetime.datetime(2023, 7, 2, 9), datetime.datetime(2023, 7, 1, 8)]
+    files = []
+    for time in times:
+        path = folder / f"{time:%Y%m%d%H%M%S}.jpg"
+        path.write_bytes(time.isoformat().encode())
+        files.append(path)
+    return files, times
+
+
+def test_time_bins_and_signature(tmp_path):
+    files, times = make_frames(tmp_path / "in")
+    bins = time_bins(files, times)
+    assert list(bins) == ["20230701000000", "20230702000000"]
+    assert [f.name for f, t in bins["20230701000000"]] == ["20230701080000.jpg", "20230701120000.jpg"]
+
+    signature = bin_signature(bins["20230701000000"])
+    files[0].write_bytes(b"replaced by a longer file")
+    assert bin_signature(bins["20230701000000"]) != signature
+
+
+@pytest.mark.parametrize("mode", ["copy", "hardlink", "symlink"])
+def test_place_and_remove_frames(tmp_path, mode):
+    files, _ = make_frames(tmp_path / "in")
+    output = tmp_path / "out"
+    output.mkdir()
+    try:
+        place_frame(files[0], output, mode)
+        place_frame(files[0], output, mode)  # placing again replaces the frame
+    except OSError as e:  # no links on this file system
+        pytest.skip(str(e))
+
+    placed = output / files[0].name
+    assert placed.read_bytes() == files[0].read_bytes()
+    assert placed.is_symlink() == (mode == "symlink")
+    if mode == "hardlink":
+        assert os.path.samefile(placed, files[0])
+    remove_frame(files[0].name, output, mode)
+    assert not placed.exists() and files[0].exists()
+
+
+def test_index_mode_round_trips(tmp_path):
+    files, times = make_frames(tmp_path / "in")
+    output = tmp_path / "out"
+    output.mkdir()
+    for file in files:
+        place_frame(file, output, "index")
+    assert list(output.iterdir()) == []
+
+    rows = [(f"{time:%Y%m%d}000000", time, str(file)) for file, time in zip(files, times)]
+    write_selection_index(output / "selection.csv", rows)
+    index_files, index_times = read_selection_index(output / "selection.csv")
+    assert index_times == sorted(times)
+    assert index_files == [files[2], files[0], files[1]]
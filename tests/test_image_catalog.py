@@ -0,0 +1,69 @@
+import datetime
+
+from PIL import Image
+
+from image_catalog import ImageCatalog, read_exif_header, EXIF_DATETIME, EXIF_MAKE, EXIF_MODEL
+
+
+def write_jpeg(path, time="2023:07:17 08:08:12"):
+    exif = Image.Exif()
+    exif[EXIF_DATETIME] = time
+    exif[EXIF_MAKE] = "Canon"
+    exif[EXIF_MODEL] = "EOS"
+    Image.new('RGB', (64, 48), 'grey').save(path, exif=exif.tobytes())
+    return path.read_bytes()
+
+
+def test_read_exif_header(tmp_path):
+    write_jpeg(tmp_path / "IMG_0001.JPG")
+    assert read_exif_header(tmp_path / "IMG_0001.JPG") == (datetime.datetime(2023, 7, 17, 8, 8, 12), "Canon EOS")
+
+    (tmp_path / "not_a_jpeg.jpg").write_bytes(b"PNG")
+    assert read_exif_header(tmp_path / "not_a_jpeg.jpg") == (None, None)
+
+
+def test_truncated_and_malformed_headers(tmp_path):
+    data = write_jpeg(tmp_path / "IMG_0001.JPG")
+    exif_start = data.index(b"Exif\x00\x00") + 6
+
+    # cut off inside the first IFD
+    (tmp_path / "truncated.jpg").write_bytes(data[:exif_start + 12])
+    assert read_exif_header(tmp_path / "truncated.jpg") == (None, None)
+
+    # IFD offset pointing past the end of the block
+    broken = bytearray(data)
+    broken[exif_start + 4:exif_start + 8] = b"\xff\xff\xff\x00" if data[exif_start] == ord('I') else b"\x00\xff\xff\xff"
+    (tmp_path / "malformed.jpg").write_bytes(bytes(broken))
+    assert read_exif_header(tmp_path / "malformed.jpg") == (None, None)
+
+    # invalid date string
+    write_jpeg(tmp_path / "bad_date.jpg", time="2023:13:45 99:00:00")
+    assert read_exif_header(tmp_path / "bad_date.jpg") == (None, "Canon EOS")
+
+
+def test_update_keeps_going_after_a_bad_file(tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    data = write_jpeg(folder / "20230717080812.jpg")
+    (folder / "20230717081312.jpg").write_bytes(data[:data.index(b"Exif") + 18])
+
+    catalog = ImageCatalog(tmp_path / "catalog.sqlite")
+    assert catalog.update([folder]) == 2
+    # the truncated file falls back to the time in its name
+    assert [(p.name, t) for p, t in catalog.between(folder)] == [
+        ("20230717080812.jpg", datetime.datetime(2023, 7, 17, 8, 8, 12)),
+        ("20230717081312.jpg", datetime.datetime(2023, 7, 17, 8, 13, 12))]
+    catalog.close()
+
+
+def test_times(tmp_path):
+    folder = tmp_path / "images"
+    folder.mkdir()
+    write_jpeg(folder / "IMG_0001.JPG")
+    (folder / "IMG_0002.JPG").write_bytes(b"\xff\xd8\xff\xd9")
+
+    catalog = ImageCatalog(tmp_path / "catalog.sqlite")
+    catalog.update([folder])
+    paths = [str(folder / "IMG_0001.JPG"), str(folder / "IMG_0002.JPG"), str(folder / "IMG_0003.JPG")]
+    assert catalog.times(paths) == {paths[0]: datetime.datetime(2023, 7, 17, 8, 8, 12), paths[1]: None}
+    catalog.close()
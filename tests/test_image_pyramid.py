@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+from PIL import Image
+
+from image_pyramid import load_pyramid
+
+
+def downsampled(image, k):
+    for _ in range(k):
+        image = cv2.resize(image, (max(image.shape[1] // 2, 1), max(image.shape[0] // 2, 1)),
+                           interpolation=cv2.INTER_AREA)
+    return image
+
+
+def test_view_equals_the_downsampled_source(tmp_path):
+    rng = np.random.default_rng(0)
+    source = rng.integers(0, 255, (900, 1300, 3), dtype=np.uint8)
+    Image.fromarray(source).save(tmp_path / "20230729120000.png")
+
+    pyramid = load_pyramid(tmp_path / "20230729120000.png", tmp_path / "pyramids", tile_size=256)
+    assert pyramid.shape == source.shape
+    assert pyramid.level_shapes == [(900, 1300), (450, 650), (225, 325), (112, 162)]
+    np.testing.assert_array_equal(pyramid.level(0), source)
+
+    # a zoomed view at full resolution: the tiles around it, cropped to the image
+    tiles, extent = pyramid.view((700, 1290), (600, 300), display_width=600)
+    np.testing.assert_array_equal(tiles, source[256:768, 512:1300])
+    assert extent == (511.5, 1299.5, 767.5, 255.5)
+
+    # the whole image on a small screen: level 2 of the pyramid
+    tiles, extent = pyramid.view((-0.5, 1299.5), (899.5, -0.5), display_width=300)
+    expected = downsampled(source, 2)
+    np.testing.assert_array_equal(tiles, expected)
+    assert tiles.shape == (225, 325, 3)
+
+    # a region of a level only reads the tiles it overlaps
+    np.testing.assert_array_equal(pyramid.read(1, 100, 300, 200, 600), downsampled(source, 1)[100:300, 200:600])
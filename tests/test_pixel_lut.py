@@ -0,0 +1,60 @@
+import numpy as np
+from affine import Affine
+
+from pixel_lut import load_pixel_lut, lookup_pixels
+from terrain_projection import ray_to_world, build_max_pyramid, intersect_terrain_pyramid
+
+
+def make_scene():
+    """ A slope with a ridge in front of a mountain, seen from above the slope. Returns project_pixels of a
+    40 x 48 pixel crop of the image around the upper edge of the ridge """
+    n, cell = 200, 2.0
+    rows, cols = np.mgrid[0:n, 0:n]
+    dem = 1000 + 0.3 * cell * rows + 2 * np.sin(cols / 7.0)
+    dem[120:126] += 10  # ridge
+    dem[126:] -= 60  # valley behind it
+    dem[170:] += 150  # mountain behind the valley
+    transform = Affine(cell, 0, 0, 0, -cell, n * cell)
+    pyramid = build_max_pyramid(dem)
+    origin = np.array([200.0, 395.0, 1100.0])
+
+    def project_pixels(x_pix, y_pix):
+        dirs = ray_to_world(np.asarray(x_pix) + 940, np.asarray(y_pix) + 290, 180, 10, 960, 720, 34,
+                            22.3 / 1920, 14.9 / 1440)
+        return intersect_terrain_pyramid(origin, dirs, dem, transform, pyramid, max_dist=800)
+    return project_pixels
+
+
+def test_lookup_matches_projection_across_an_occlusion_edge(tmp_path):
+    project_pixels = make_scene()
+    lut, hit = load_pixel_lut(tmp_path, "test", 40, 48, project_pixels)
+    assert hit.all()
+
+    rng = np.random.default_rng(1)
+    x_pix, y_pix = rng.uniform(0, 39, 2000), rng.uniform(0, 47, 2000)
+    exact = np.column_stack(project_pixels(x_pix, y_pix))
+    error = lambda utm: np.linalg.norm(np.column_stack(utm) - exact, axis=1)
+
+    # plain bilinear interpolation puts points between the ridge and the mountain
+    assert error(lookup_pixels(lut, hit, x_pix, y_pix, max_spread=np.inf)).max() > 50
+
+    # away from the edge the interpolation is within a pixel footprint, at the edge the rays are marched
+    assert error(lookup_pixels(lut, hit, x_pix, y_pix, project_pixels=project_pixels)).max() < 1
+
+    # without project_pixels the edge points take the value of the nearest pixel, on one side of the edge
+    nearest = lut[np.rint(y_pix).astype(int), np.rint(x_pix).astype(int)]
+    utm = np.column_stack(lookup_pixels(lut, hit, x_pix, y_pix))
+    off = error(utm.T) >= 1
+    assert off.any()
+    np.testing.assert_array_equal(utm[off], nearest[off])
+
+
+def test_points_outside_the_image_and_misses_are_nan():
+    lut = np.zeros((3, 3, 3))
+    lut[..., 0] = np.arange(3)[None, :] * 2.0
+    hit = np.ones((3, 3), dtype=bool)
+    lut[0, 2] = np.nan
+    hit[0, 2] = False
+
+    utm_x, _, _ = lookup_pixels(lut, hit, [-0.1, 0.5, 1.0, 1.8, 1.6], [0.0, 0.0, 0.0, 0.2, 2.0])
+    np.testing.assert_allclose(utm_x, [np.nan, 1.0, 2.0, np.nan, 3.2])
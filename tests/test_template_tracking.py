@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+
+from template_tracking import TemplatePredictor, match_template, extract_template, grey
+
+
+def make_frames(n=5, shift=(3, 2)):
+    """ A smooth random texture moving shift = (dx, dy) pixels per frame; frame 3 is a different texture """
+    rng = np.random.default_rng(0)
+    texture = cv2.GaussianBlur(rng.uniform(0, 255, (400, 400)).astype(np.float32), (0, 0), 2)
+    frames = [np.roll(texture, (k * shift[1], k * shift[0]), axis=(0, 1))[:200, :300] for k in range(n)]
+    frames[3] = cv2.GaussianBlur(rng.uniform(0, 255, (200, 300)).astype(np.float32), (0, 0), 2)
+    return frames
+
+
+def test_match_template_finds_the_moved_patch():
+    frames = make_frames()
+    template = extract_template(grey(frames[0]), 120, 90, 10)
+    assert extract_template(grey(frames[0]), 5, 90, 10) is None  # too close to the border
+    assert match_template(grey(frames[1]), template, 120, 90, 15)[:2] == (123, 92)
+
+
+def test_predictions_follow_the_feature_and_stop_at_a_bad_match():
+    frames = make_frames()
+    predictor = TemplatePredictor(lambda i: frames[i], len(frames), half_size=10, search_radius=15, n_ahead=4)
+    assert predictor.predict(1) is None  # no template yet
+
+    predictor.accept(0, 120, 90)
+    x, y, score = predictor.predict(1, timeout=5)
+    assert (x, y) == (123, 92) and score > 0.9
+    assert predictor.predict(2, timeout=5)[:2] == (126, 94)
+
+    # frame 3 does not show the feature: low correlation, nothing predicted after it
+    assert predictor.predict(3, timeout=5)[2] < predictor.min_score
+    assert predictor.predict(4, timeout=5) is None
+    assert not predictor.is_pending(4)
+
+    # a click in frame 3 starts again from there
+    predictor.accept(3, 150, 100)
+    assert predictor.predict(3) is None
+    assert predictor.predict(4, timeout=5) is not None
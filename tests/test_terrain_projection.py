@@ -0,0 +1,52 @@
+import numpy as np
+from affine import Affine
+
+from terrain_projection import (ray_to_world, intersect_terrain, terrain_intersection, build_max_pyramid,
+                                intersect_terrain_pyramid)
+
+
+def make_dem(n=200, cell=2.0):
+    """ A slope rising away from the camera with some bumps, north-up transform """
+    rng = np.random.default_rng(0)
+    rows, cols = np.mgrid[0:n, 0:n]
+    dem = 1000 + 0.3 * cell * rows + 2 * np.sin(cols / 7.0) + rng.normal(0, 0.2, (n, n))
+    dem[:5, :5] = np.nan  # nodata never counts as a hit
+    return dem, Affine(cell, 0, 0, 0, -cell, n * cell)
+
+
+def test_intersect_terrain_matches_legacy_loop():
+    dem, transform = make_dem()
+    origin = np.array([200.0, 395.0, 1100.0])
+    x_pix, y_pix = np.meshgrid(np.linspace(0, 1919, 6), np.linspace(700, 1439, 5))
+    dirs = ray_to_world(x_pix.ravel(), y_pix.ravel(), 180, 10, 960, 720, 34, 22.3 / 1920, 14.9 / 1440)
+
+    utm_x, utm_y, utm_z = intersect_terrain(origin, dirs, dem, transform, max_dist=800)
+    assert (~np.isnan(utm_x)).sum() > 10
+    for i, ray_dir in enumerate(dirs):
+        legacy = terrain_intersection(origin, ray_dir, dem, transform, max_dist=800)
+        if legacy is None:
+            assert np.isnan(utm_x[i])
+            continue
+        # the legacy loop returns the first sample below the ground, the bisection the crossing before it
+        assert np.hypot(utm_x[i] - legacy[0], utm_y[i] - legacy[1]) <= 0.5 + 1e-6
+
+
+def test_max_pyramid_levels_hold_block_maxima():
+    dem, _ = make_dem(n=37)
+    pyramid = build_max_pyramid(dem)
+    assert pyramid[-1].shape == (1, 1)
+    assert pyramid[-1][0, 0] == np.nanmax(dem)
+    assert pyramid[1][3, 4] == np.nanmax(dem[6:8, 8:10])
+
+
+def test_intersect_terrain_pyramid_matches_marching():
+    dem, transform = make_dem()
+    origin = np.array([200.0, 395.0, 1100.0])
+    x_pix, y_pix = np.meshgrid(np.linspace(0, 1919, 9), np.linspace(700, 1439, 7))
+    dirs = ray_to_world(x_pix.ravel(), y_pix.ravel(), 180, 10, 960, 720, 34, 22.3 / 1920, 14.9 / 1440)
+
+    marched = intersect_terrain(origin, dirs, dem, transform, max_dist=800, step=0.05)
+    skipped = intersect_terrain_pyramid(origin, dirs, dem, transform, build_max_pyramid(dem), max_dist=800)
+    np.testing.assert_array_equal(np.isnan(marched[0]), np.isnan(skipped[0]))
+    hit = ~np.isnan(marched[0])
+    assert np.all(np.hypot(marched[0][hit] - skipped[0][hit], marched[1][hit] - skipped[1][hit]) <= 0.05 + 1e-6)
@@ -0,0 +1,47 @@
+import os
+
+from track_manifest import config_hash, rows_to_process, removed_inputs
+
+
+def write(path, text, mtime_offset=0):
+    path.write_text(text)
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + mtime_offset))
+
+
+def processed(csv_path, config, rows):
+    """ manifest entry as the pipeline stages store it after processing the file """
+    _, current = rows_to_process(csv_path, None, config)
+    return dict(current, rows=rows, config=config)
+
+
+def test_rows_to_process(tmp_path):
+    csv_path = tmp_path / "l0.csv"
+    config = config_hash(camera="a")
+    write(csv_path, "filename,x\na.jpg,1\nb.jpg,2\n")
+
+    # never processed: whole file
+    assert rows_to_process(csv_path, None, config)[0] == 0
+    entry = processed(csv_path, config, rows=2)
+
+    # unchanged, also when only the mtime changed
+    assert rows_to_process(csv_path, entry, config)[0] is None
+    write(csv_path, "filename,x\na.jpg,1\nb.jpg,2\n", mtime_offset=10**9)
+    assert rows_to_process(csv_path, entry, config)[0] is None
+
+    # other configuration: whole file
+    assert rows_to_process(csv_path, entry, config_hash(camera="b"))[0] == 0
+
+    # appended rows: only the new ones
+    write(csv_path, "filename,x\na.jpg,1\nb.jpg,2\nc.jpg,3\n")
+    assert rows_to_process(csv_path, entry, config)[0] == 2
+
+    # edited rows: whole file
+    write(csv_path, "filename,x\na.jpg,1\nb.jpg,5\nc.jpg,3\n")
+    assert rows_to_process(csv_path, entry, config)[0] == 0
+
+
+def test_removed_inputs(tmp_path):
+    (tmp_path / "l0.csv").write_text("filename,x\n")
+    manifest = {"l0.csv": {}, "l1.csv": {}}
+    assert removed_inputs(manifest, tmp_path) == ["l1.csv"]
@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from track_store import TrackStore
+
+
+def track(track_id, n, start=0):
+    return pd.DataFrame({'track_id': track_id, 'x': range(start, start + n),
+                         'timestamp': pd.date_range("2025-06-01", periods=n, freq="D").astype(str)})
+
+
+def test_append_and_compact(tmp_path):
+    store = TrackStore(tmp_path)
+    assert not store.exists('tracking')
+    assert store.read('tracking').empty
+
+    for k in range(3):
+        store.append('tracking', track("l0", 2, start=2 * k))
+    assert len(store._parts('tracking')) == 3
+
+    store.compact('tracking', max_parts=3)  # not more parts than max_parts: left as it is
+    assert len(store._parts('tracking')) == 3
+    store.compact('tracking')
+    assert len(store._parts('tracking')) == 1
+
+    df = store.read('tracking')
+    assert df['x'].tolist() == list(range(6))
+    assert pd.api.types.is_datetime64_any_dtype(df['timestamp'])
+
+
+def test_replace_tracks(tmp_path):
+    store = TrackStore(tmp_path)
+    store.replace_tracks('projected', pd.concat([track("l0", 3), track("u1", 2)]))
+    store.replace_tracks('projected', track("u1", 4, start=10))
+    df = store.read('projected')
+    assert df.groupby('track_id')['x'].apply(list).to_dict() == {"l0": [0, 1, 2], "u1": [10, 11, 12, 13]}
+    assert store.read('projected', track_ids=["l0"])['track_id'].unique().tolist() == ["l0"]
+
+    # an empty frame only removes the tracks
+    store.replace_tracks('projected', pd.DataFrame(), ["l0"])
+    assert store.read('projected')['track_id'].unique().tolist() == ["u1"]
+    store.replace_tracks('projected', pd.DataFrame(), ["u1"])
+    assert not store.exists('projected')
+
+
+def test_csv_round_trip(tmp_path):
+    store = TrackStore(tmp_path / "store")
+    track("l0", 3).drop(columns='track_id').to_csv(tmp_path / "l0_projected.csv", index=False)
+    store.import_csv('projected', [tmp_path / "l0_projected.csv"], suffix="_projected")
+    store.export_csv('projected', tmp_path / "out", suffix="_projected")
+    assert pd.read_csv(tmp_path / "out" / "l0_projected.csv")['x'].tolist() == [0, 1, 2]
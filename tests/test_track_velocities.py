@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from track_velocities import SECONDS_PER_YEAR, compute_velocities
+
+
+def test_speeds_signs_and_time_steps():
+    line_unit = np.array([1.0, 0.0])  # reference line pointing east
+    tracks = pd.DataFrame({
+        'track_id': ['a', 'b', 'a', 'b', 'a', 'b'],
+        'timestamp': ['2023-07-02 00:00', '2023-07-01 00:00', '2023-07-01 00:00', '2023-07-03 00:00',
+                      '2023-07-02 00:00', '2023-07-01 00:00'],
+        'utm_x': [101.0, 0.0, 100.0, 0.0, 101.0, 0.0],
+        'utm_y': [0.0, 0.0, 0.0, 2.0, 5.0, 0.0],
+        'utm_z': [0.0] * 6,
+    })
+
+    df = compute_velocities(tracks, line_unit)
+    a, b = df[df['track_id'] == 'a'], df[df['track_id'] == 'b']
+
+    # sorted by time per track, the first point of a track has no previous point
+    assert a['timestamp'].is_monotonic_increasing and b['timestamp'].is_monotonic_increasing
+    assert np.isnan(a['dt_s'].iloc[0]) and np.isnan(b['line_speed_mpy'].iloc[0])
+    np.testing.assert_array_equal(a['dt_s'].iloc[1:], [86400.0, 0.0])
+    np.testing.assert_array_equal(b['dt_s'].iloc[1:], [0.0, 2 * 86400.0])
+
+    # 1 m east in a day: positive along the line
+    assert a['line_speed_mpy'].iloc[1] == SECONDS_PER_YEAR / 86400.0
+    assert a['cross_speed_mpy'].iloc[1] == 0.0
+    # a second point at the same time has a displacement but no speed
+    assert a['cross_displacement_m'].iloc[2] == 5.0 and np.isnan(a['speed_3d_mpy'].iloc[2])
+    # 2 m north in two days: left of the line is positive, nothing along it
+    assert b['cross_speed_mpy'].iloc[2] == SECONDS_PER_YEAR / 86400.0
+    assert b['line_speed_mpy'].iloc[2] == 0.0
+    assert b['speed_3d_mpy'].iloc[2] == SECONDS_PER_YEAR / 86400.0
+
+    # moving west gives a negative speed along the line
+    west = compute_velocities(tracks.assign(utm_x=-tracks['utm_x']), line_unit)
+    assert west.loc[west['track_id'] == 'a', 'line_speed_mpy'].iloc[1] == -SECONDS_PER_YEAR / 86400.0
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from velocity_aggregation import BinnedAccumulator, aggregate_velocities
+
+
+def random_tracks(n_tracks=20, seed=0):
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2025-06-01")
+    return {f"{'ul'[k % 2]}{k}": pd.DataFrame({
+        'timestamp': start + pd.to_timedelta(np.sort(rng.uniform(0, 10, 30)), unit='D'),
+        'line_speed_mpy': rng.normal(-300, 100, 30)}) for k in range(n_tracks)}
+
+
+def test_accumulator_matches_groupby():
+    tracks = random_tracks()
+    acc = BinnedAccumulator("1D", bounds=None)
+    for df in tracks.values():
+        acc.add(df['timestamp'], df['line_speed_mpy'])
+    table = acc.table(std_cutoff=np.inf).set_index('bin_start')
+
+    all_rows = pd.concat(tracks.values())
+    expected = all_rows.groupby(all_rows['timestamp'].dt.floor("1D"))['line_speed_mpy'] \
+        .agg(['count', 'mean', 'median', 'std'])
+    np.testing.assert_array_equal(table['count'], expected['count'])
+    for column in ['mean', 'median', 'std']:
+        np.testing.assert_allclose(table[column], expected[column], rtol=1e-10)
+
+
+def test_bounds_apply_to_the_magnitude():
+    acc = BinnedAccumulator("1D", bounds=(0, 500))
+    acc.add(pd.to_datetime(["2025-06-01 01:00"] * 4), [-200, 300, -800, np.nan])
+    table = acc.table()
+    assert table['count'].tolist() == [2]
+    assert table['median'].tolist() == [50]
+
+
+def test_std_cutoff_and_regions():
+    tracks = random_tracks()
+    table = aggregate_velocities(tracks.items(), std_cutoff=0)
+    assert set(table['region']) == {'upper', 'lower'}
+    assert table['velocity'].isna().all()  # every bin with more than one value has a std above 0
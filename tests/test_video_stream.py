@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+
+from video_stream import encode_video
+
+
+def test_unreadable_frames_are_skipped(tmp_path):
+    images = []
+    for i in range(5):
+        path = tmp_path / f"{i:02d}.png"
+        cv2.imwrite(str(path), np.full((48, 64, 3), 40 * i, np.uint8))
+        images.append(path)
+    images[2].write_bytes(b"not an image")
+    images.insert(4, tmp_path / "missing.png")
+
+    video_path = tmp_path / "video.avi"
+    stats = encode_video(images, video_path, 10, (64, 48), codec='MJPG', n_workers=2, queue_size=3)
+
+    assert stats['frames'] == 4
+    assert stats['skipped'] == 2
+    capture = cv2.VideoCapture(str(video_path))
+    assert int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) == 4
+    capture.release()
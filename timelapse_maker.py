@@ -5,12 +5,11 @@
 
 
 import os
-from PIL import Image,ImageFile
-import matplotlib.pyplot as plt
 import datetime
-import shutil
 
-ImageFile.LOAD_TRUNCATED_IMAGES = True
+from timelapse_stamp import list_images, stamp_images
+from image_catalog import ImageCatalog
+from image_quality import is_good, MIN_BRIGHTNESS, MAX_BRIGHTNESS, MIN_CONTRAST
 # %%
 # set the station_name and path to folder
 camera_name = 'tls_right'
@@ -46,64 +45,34 @@ img_time_gen = time_range_list(img1_time,imgend_time,img_interval)
 # convert to list for easier subscripting
 img_time_list = list(img_time_gen)
 
-# initiate timestamp index: 
-tmstp_idx = 0 
+#%% stamping settings
 
-# %%
+# draw the timestamp onto the pixels in a process pool (False: show every image with matplotlib as before)
+headless = True
+n_workers = None  # None uses all cores
+scale = None  # e.g. 0.5 to downscale, None keeps the native resolution
+
+# drop dark frames by their content (scored at 1/8 resolution, cached in the image catalog) instead of by file size
+use_quality_filter = True
+min_brightness, max_brightness = MIN_BRIGHTNESS, MAX_BRIGHTNESS  # mean grey value (0 - 255)
+min_contrast = MIN_CONTRAST  # std of the grey values
+catalog_path = './cache/image_catalog.sqlite'
 
+# %%
 
-for root, dirs, files in os.walk(imgpath):
-    for file in files:
-        if file.startswith('IMG') and file.endswith('JPG'):
-
-            # get full flepath 
-            file_path = os.path.join(root, file)
-
-            # grab fileize
-            sizeMB = os.path.getsize(file_path)/10e5 # file size in MB
-
-            # the dark images (nighttime) will be smaller than 1 MB, skip those
-            if sizeMB > 4:            
-                # open image and grab time stamp
-                img = Image.open(file_path)
-       
-                if override_timestamps:
-                     img_datetime = img_time_list[tmstp_idx]
-                else:
-                     exif_data = img._getexif()
-                     img_datetime = exif_data[306]
-                     
-                
-
-#                 print(img_datetime)
-
-                # convert from Central Time to AK time
-                if override_timestamps:
-                    img_CT = datetime.datetime.strptime(str(img_datetime),'%Y-%m-%d %H:%M:%S')
-                    img_AKDT = img_CT
-                else:
-                    img_CT = datetime.datetime.strptime(str(img_datetime),'%Y:%m:%d %H:%M:%S')
-                    img_AKDT = img_CT - datetime.timedelta(hours=8) # AK daylight time - we use AKDT instead of UTC
-                img_AK_filename = str(img_AKDT)
-                char_remove = [' ',':','-']
-                for char in char_remove:
-                    img_AK_filename = img_AK_filename.replace(char,'')
-                    
-                # show image
-                plt.imshow(img)
-                plt.text(150, 200, img_AKDT, color='dimgrey',fontsize=12) # add timestamp
-                plt.axis('off'); plt.tight_layout()
-
-                # save to new folder
-                if not os.path.exists(save_path):
-                    os.mkdir(save_path)
-                if not os.path.exists(save_path + img_AK_filename +'.png'): # (no overwriting of images)
-                    plt.savefig(save_path + img_AK_filename+'.png', dpi=300)
-                    
-                plt.show()
-
-            # update the idx for the timestamping 
-            tmstp_idx += 1 
-            print(tmstp_idx)
+# the pools below start worker processes, which import this script again (spawn on Windows)
+if __name__ == "__main__":
+    # the dark images (nighttime) will be smaller than 4 MB, skip those (or filter by the quality scores)
+    image_files = list_images(imgpath, recursive=True)
+    keep = None
+    if use_quality_filter:
+        catalog = ImageCatalog(catalog_path)
+        catalog.update([imgpath], recursive=True, quality=True, n_workers=n_workers)
+        keep = {f for f, scores in catalog.scores(image_files).items()
+                if is_good(scores, min_brightness, max_brightness, min_contrast)}
+    saved = stamp_images(image_files, save_path, extension='.png', min_size_mb=4,
+                         override_times=img_time_list if override_timestamps else None,
+                         headless=headless, n_workers=n_workers, keep=keep, scale=scale)
+    print(f"{len(saved)} new images in {save_path}")
 
 # %%
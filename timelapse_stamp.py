@@ -0,0 +1,194 @@
+""" Timestamping of timelapse images, shared by timelapse_maker.py and timelapse_maker_jpg.py.
+The AKDT time is drawn straight onto the pixels with PIL, so the images keep their native resolution
+(or are downscaled with a chosen filter), and the files are spread over a process pool. The matplotlib
+rendering of the original scripts is kept as a preview mode.
+Processed images are recorded in an ingest manifest (ingest_manifest.py) in the output folder, so reruns skip
+them without opening them. """
+
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFile, ImageFont
+
+from ingest_manifest import source_key, load_ingest_manifest, IngestLog
+from track_manifest import config_hash
+
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+EXIF_DATETIME = 306
+CAMERA_TO_AKDT = datetime.timedelta(hours=8)  # camera clock (Central Time) to AK daylight time
+MANIFEST_NAME = "ingest_manifest.jsonl"
+
+
+def list_images(imgpath, recursive=True):
+    """ Camera images (IMG*.JPG) in a folder, in the order the timestamp override assumes """
+    if not recursive:
+        return [os.path.join(imgpath, f) for f in os.listdir(imgpath) if f.startswith('IMG') and f.endswith('JPG')]
+    return [os.path.join(root, f) for root, dirs, files in os.walk(imgpath)
+            for f in files if f.startswith('IMG') and f.endswith('JPG')]
+
+
+def image_time(img, override_time=None):
+    """ AKDT time of an image: the EXIF time shifted from Central Time, or the override time as it is """
+    if override_time is not None:
+        return datetime.datetime.strptime(str(override_time), '%Y-%m-%d %H:%M:%S')
+    img_CT = datetime.datetime.strptime(str(img._getexif()[EXIF_DATETIME]), '%Y:%m:%d %H:%M:%S')
+    return img_CT - CAMERA_TO_AKDT
+
+
+def akdt_filename(img_AKDT):
+    """ File name (without extension) of a stamped image, e.g. 20230717080812 """
+    return img_AKDT.strftime('%Y%m%d%H%M%S')
+
+
+def stamp_image(img, text, position=(150, 200), color='dimgrey', font_size=None, scale=None,
+                resample=Image.Resampling.LANCZOS):
+    """ Draw the timestamp onto the pixels of an image
+
+    Args:
+        img: PIL image
+        text: text to draw
+        position: top left of the text in pixels of the original image
+        color: text color
+        font_size: in pixels, None for 1/40 of the image height
+        scale: downscale factor (e.g. 0.5), None keeps the native resolution
+        resample: PIL filter for downscaling
+
+    Returns:
+        PIL.Image: the stamped image
+    """
+    img = img.convert('RGB')
+    if scale is not None:
+        img = img.resize((round(img.width * scale), round(img.height * scale)), resample=resample)
+        position = (position[0] * scale, position[1] * scale)
+    size = font_size * (scale or 1) if font_size is not None else img.height / 40
+    try:
+        font = ImageFont.truetype("DejaVuSans.ttf", round(size))
+    except OSError:
+        font = ImageFont.load_default(size=round(size))
+    ImageDraw.Draw(img).text(position, str(text), fill=color, font=font)
+    return img
+
+
+def stamp_file(args):
+    """ Stamp one image and save it as save_path/<AKDT time><extension>, existing files are not overwritten
+
+    Returns:
+        dict: time (AKDT) and output name of the image, created is False if the output existed already
+    """
+    file_path, override_time, save_path, extension, options = args
+    with Image.open(file_path) as img:
+        img_AKDT = image_time(img, override_time)
+        output = akdt_filename(img_AKDT) + extension
+        out_path = os.path.join(save_path, output)
+        if os.path.exists(out_path):  # (no overwriting of images)
+            return dict(time=str(img_AKDT), output=output, created=False)
+        stamped = stamp_image(img, img_AKDT, **options)
+    if extension.lower() in ['.jpg', '.jpeg']:
+        stamped.save(out_path, quality=95)
+    else:
+        stamped.save(out_path)
+    return dict(time=str(img_AKDT), output=output, created=True)
+
+
+def render_frame(job, size):
+    """ Video frame of a raw camera image: decoded at reduced size (JPEG draft mode), resized to size and stamped
+
+    Args:
+        job: (file path, override time or None, folder to also save the frame to or None, extension)
+        size: (width, height) of the video
+
+    Returns:
+        np.ndarray: BGR frame for cv2.VideoWriter
+    """
+    file_path, override_time, save_path, extension = job
+    with Image.open(file_path) as img:
+        img_AKDT = image_time(img, override_time)
+        full_size = img.size
+        img.draft('RGB', tuple(size))  # decodes at the smallest 1/2, 1/4 or 1/8 scale that is still >= size
+        frame = img.convert('RGB').resize(tuple(size), resample=Image.Resampling.LANCZOS)
+    # the timestamp at the same place and relative size as on the full resolution images
+    position = (150 * size[0] / full_size[0], 200 * size[1] / full_size[1])
+    frame = stamp_image(frame, img_AKDT, position=position)
+    if save_path is not None:
+        frame.save(os.path.join(save_path, akdt_filename(img_AKDT) + extension))
+    return np.ascontiguousarray(np.asarray(frame)[:, :, ::-1])
+
+
+def preview_file(args):
+    """ Original matplotlib rendering: show the image with the timestamp and save the figure """
+    import matplotlib.pyplot as plt
+    file_path, override_time, save_path, extension, options = args
+    with Image.open(file_path) as img:
+        img_AKDT = image_time(img, override_time)
+        plt.imshow(img)
+    plt.text(150, 200, img_AKDT, color='dimgrey', fontsize=12)  # add timestamp
+    plt.axis('off'); plt.tight_layout()
+    output = akdt_filename(img_AKDT) + extension
+    created = not os.path.exists(os.path.join(save_path, output))
+    if created:
+        plt.savefig(os.path.join(save_path, output), dpi=300)
+    plt.show()
+    return dict(time=str(img_AKDT), output=output, created=created)
+
+
+def stamp_images(file_paths, save_path, extension='.png', min_size_mb=0, override_times=None, headless=True,
+                 n_workers=None, use_manifest=True, keep=None, **options):
+    """ Timestamp all images above a file size and save them in save_path
+
+    Args:
+        file_paths: images, in order
+        save_path: output folder, created if needed
+        extension: output format, e.g. '.png' or '.jpg'
+        min_size_mb: smaller images (the dark nighttime ones) are skipped
+        override_times: one time per file in file_paths (including skipped ones) instead of the EXIF time
+        headless: draw with PIL in a process pool, False for the matplotlib preview
+        n_workers: number of processes, None for all cores
+        use_manifest: skip images that are in the ingest manifest of save_path (same path, size and mtime,
+            stamped with the same override time, extension and options) and whose output still exists,
+            without opening them
+        keep: set of the images to stamp (e.g. those passing the quality filter) instead of the size filter
+        options: passed to stamp_image (position, color, font_size, scale, resample)
+
+    Returns:
+        list: paths of the new images
+    """
+    os.makedirs(save_path, exist_ok=True)
+    manifest_path = os.path.join(save_path, MANIFEST_NAME)
+    manifest = load_ingest_manifest(manifest_path) if use_manifest else {}
+    outputs = set(os.listdir(save_path))
+
+    jobs, keys = [], []
+    for i, file_path in enumerate(file_paths):
+        stat = os.stat(file_path)
+        if keep is not None and file_path not in keep:
+            continue
+        if keep is None and stat.st_size / 10e5 <= min_size_mb:  # file size in MB
+            continue
+        override_time = override_times[i] if override_times is not None else None
+        key = source_key(file_path, stat)
+        entry = manifest.get(key)
+        config = config_hash(override_time=None if override_time is None else str(override_time),
+                             extension=extension, options=options)
+        if entry is not None and entry.get('config') == config and entry['output'] in outputs:
+            continue  # done in an earlier run
+        jobs.append((file_path, override_time, save_path, extension, options))
+        keys.append((key, config))
+
+    saved = []
+    with IngestLog(manifest_path) as log, ExitStack() as stack:
+        if headless:
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=n_workers))
+            results = pool.map(stamp_file, jobs, chunksize=4)
+        else:
+            results = map(preview_file, jobs)  # shown one by one, no worker processes needed
+        # every finished file is logged right away, an interrupted run resumes from here
+        for job, (key, config), result in zip(jobs, keys, results):
+            log.add(key, path=job[0], override=job[1] is not None, config=config, time=result['time'],
+                    output=result['output'])
+            if result['created']:
+                saved.append(os.path.join(save_path, result['output']))
+    return saved
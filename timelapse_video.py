@@ -0,0 +1,71 @@
+
+""" Timelapse video straight from the raw camera images, in one pass: the frames are filtered, timestamped (AKDT)
+and encoded without writing and reading back a png per frame as timelapse_maker.py + video_maker.py do.
+Each JPEG is decoded at a reduced size close to the video size. """
+#%%
+import os
+import datetime
+
+from timelapse_stamp import list_images, render_frame
+from image_catalog import ImageCatalog, read_exif_header
+from image_quality import is_good, MIN_BRIGHTNESS, MAX_BRIGHTNESS, MIN_CONTRAST
+from video_stream import encode_video
+
+# %%
+# set the station_name and path to folder
+camera_name = 'tls_right'
+dir_name = 'DCIM'
+imgpath = './' + dir_name + '/'  # path to image folder (e.g. the SD card)
+vidName = camera_name + '.mp4'
+
+# size and frames per second of the video
+W = 1800
+H = 1200
+nfs = 120
+
+# drop dark frames by their content (see timelapse_maker.py), or by file size if False
+use_quality_filter = True
+min_brightness, max_brightness = MIN_BRIGHTNESS, MAX_BRIGHTNESS  # mean grey value (0 - 255)
+min_contrast = MIN_CONTRAST  # std of the grey values
+min_size_mb = 4
+catalog_path = './cache/image_catalog.sqlite'
+
+# also save the stamped video frames to this folder, None to only write the video
+save_frames_path = None
+frame_extension = '.jpg'
+
+# decode threads and maximum number of frames in memory
+n_workers = 4
+queue_size = 32
+
+# %%
+# the pool of the quality scores starts worker processes, which import this script again (spawn on Windows)
+if __name__ == "__main__":
+    image_files = list_images(imgpath, recursive=True)
+    catalog = None
+    if use_quality_filter or os.path.exists(catalog_path):
+        catalog = ImageCatalog(catalog_path)
+        catalog.update([imgpath], recursive=True, quality=use_quality_filter)
+    if use_quality_filter:
+        image_files = [f for f, scores in catalog.scores(image_files).items()
+                       if is_good(scores, min_brightness, max_brightness, min_contrast)]
+    else:
+        image_files = [f for f in image_files if os.path.getsize(f) / 10e5 > min_size_mb]  # file size in MB
+
+    # frames in time order, the EXIF times stored in the catalog or read from the EXIF headers only
+    if catalog is not None:
+        times = catalog.times(image_files)
+    else:
+        times = {f: read_exif_header(f)[0] for f in image_files}
+    image_files = sorted((f for f in image_files if times.get(f) is not None), key=lambda f: (times[f], f))
+    print(f"{len(image_files)} frames")
+
+    if save_frames_path is not None:
+        os.makedirs(save_frames_path, exist_ok=True)
+
+    start = datetime.datetime.now()
+    jobs = [(f, None, save_frames_path, frame_extension) for f in image_files]
+    stats = encode_video(jobs, vidName, nfs, (W, H), n_workers=n_workers, queue_size=queue_size, read=render_frame)
+    print(f"Wrote {vidName} in {datetime.datetime.now() - start}")
+
+# %%
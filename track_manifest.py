@@ -0,0 +1,70 @@
+""" Manifest of processed track csv files, so each stage of the pipeline only processes new or changed tracks.
+For every input file the manifest stores its size, mtime, row count, a content hash and the hash of the
+configuration (camera / dem / reference line) it was processed with. """
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+def config_hash(**config):
+    """ Short hash of the configuration a stage was run with. """
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=float).encode()).hexdigest()[:16]
+
+
+def load_manifest(manifest_path):
+    """ Load the manifest, an empty one if it does not exist yet. """
+    manifest_path = Path(manifest_path)
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest_path, manifest):
+    """ Write the manifest, via a temporary file so an interrupted run does not corrupt it. """
+    manifest_path = Path(manifest_path)
+    tmp_path = manifest_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def rows_to_process(csv_path, entry, config):
+    """ Decide what has to be done for an input csv, given its manifest entry from the last run.
+
+    Args:
+        csv_path: input csv
+        entry: manifest entry of this file, None if it was never processed
+        config: configuration hash of the current run
+
+    Returns:
+        tuple:
+            int or None: index of the first data row to process (0 = whole file, None = unchanged)
+            dict: path, size, mtime and sha1 of the current file, to store with the row count once processed
+    """
+    csv_path = Path(csv_path)
+    stat = csv_path.stat()
+    current = {"path": str(csv_path), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+    same_config = entry is not None and entry["config"] == config
+
+    # unchanged size and mtime: skip without reading the file
+    if same_config and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+        return None, dict(current, sha1=entry["sha1"])
+
+    data = csv_path.read_bytes()
+    current["sha1"] = hashlib.sha1(data).hexdigest()
+    if not same_config:
+        return 0, current
+    if current["sha1"] == entry["sha1"]:
+        return None, current
+    # rows were only appended if the old content is an unchanged prefix of the file
+    if len(data) > entry["size"] and hashlib.sha1(data[:entry["size"]]).hexdigest() == entry["sha1"]:
+        return entry["rows"], current
+    return 0, current
+
+
+def removed_inputs(manifest, input_dir):
+    """ Names of the manifest entries whose input file is no longer in input_dir, e.g. a deleted track. """
+    return sorted(name for name in manifest if not (Path(input_dir) / name).exists())
@@ -0,0 +1,140 @@
+""" Columnar store for the tracks of all pipeline stages.
+Instead of one small csv per track and stage, each stage has one table (tracking, projected, velocities)
+with a track_id column and typed datetime64 timestamps. A table is a folder of Arrow IPC (uncompressed
+Feather) files that are memory-mapped on reading, so loading all tracks is one read without csv parsing.
+The per-track csv files stay the source of the data: the stages fill the store from them (import_csv,
+replace_tracks), and export_csv writes them back. Needs pyarrow. """
+
+import os
+import uuid
+from pathlib import Path
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # only needed when the store is used
+    pa = None
+
+# appending writes a new part file, compact(table, MAX_PARTS) merges them once there are more than this
+MAX_PARTS = 64
+
+
+class TrackStore():
+    """ Folder with one table per pipeline stage, every table a folder of Arrow IPC part files.
+    """
+    def __init__(self, root):
+        """ Open (or create on first write) the store
+
+        Args:
+            root: folder of the store, e.g. ./track_store
+        """
+        if pa is None:
+            raise ImportError("The track store needs pyarrow, install it with 'pip install pyarrow'")
+        self.root = Path(root)
+
+    def _parts(self, table: str) -> list:
+        return sorted((self.root / table).glob("part-*.arrow"))
+
+    def exists(self, table: str) -> bool:
+        """ True if anything was stored in the table """
+        return len(self._parts(table)) > 0
+
+    @staticmethod
+    def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+        """ Typed columns: track_id as string, timestamp as datetime64 """
+        df = df.reset_index(drop=True)
+        df['track_id'] = df['track_id'].astype(str)
+        if 'timestamp' in df:
+            df['timestamp'] = pd.to_datetime(df['timestamp'], format='ISO8601')
+        return df
+
+    def _write_part(self, table: str, arrow_table):
+        """ Write a part via a temporary file, so readers never see half-written parts """
+        folder = self.root / table
+        folder.mkdir(parents=True, exist_ok=True)
+        name = f"part-{pd.Timestamp.now():%Y%m%d%H%M%S%f}-{uuid.uuid4().hex[:8]}.arrow"
+        tmp_path = folder / (name + ".tmp")
+        with pa.OSFile(str(tmp_path), "wb") as sink:
+            with pa.ipc.new_file(sink, arrow_table.schema) as writer:
+                writer.write_table(arrow_table)
+        os.replace(tmp_path, folder / name)
+
+    def read_arrow(self, table: str, columns: list = None):
+        """ Memory-map all parts of a table and return them as one Arrow table (no copy, no parsing) """
+        parts = []
+        for path in self._parts(table):
+            with pa.memory_map(str(path), "r") as source:
+                part = pa.ipc.open_file(source).read_all()
+            parts.append(part.select(columns) if columns is not None else part)
+        if not parts:
+            return None
+        return pa.concat_tables(parts, promote_options="default")
+
+    def read(self, table: str, columns: list = None, track_ids: list = None) -> pd.DataFrame:
+        """ Read a table as a DataFrame (converted from Arrow, which copies the data; use read_arrow to avoid it)
+
+        Args:
+            table: "tracking", "projected" or "velocities"
+            columns: only read these columns
+            track_ids: only return these tracks
+
+        Returns:
+            pd.DataFrame: the table, empty if nothing was stored yet
+        """
+        arrow_table = self.read_arrow(table, columns)
+        if arrow_table is None:
+            return pd.DataFrame(columns=columns)
+        df = arrow_table.to_pandas()
+        if track_ids is not None:
+            df = df[df['track_id'].isin(list(track_ids))].reset_index(drop=True)
+        return df
+
+    def append(self, table: str, df: pd.DataFrame):
+        """ Append rows (with a track_id column) to a table as a new part, without touching the existing ones """
+        if df.empty:
+            return
+        self._write_part(table, pa.Table.from_pandas(self._normalize(df), preserve_index=False))
+
+    def replace_tracks(self, table: str, df: pd.DataFrame, track_ids: list = None):
+        """ Replace all rows of the tracks in df (and of track_ids, e.g. tracks that became empty or were deleted:
+        pass an empty frame to only remove them)
+
+        The table is rewritten as one part, old parts are removed afterwards.
+        """
+        replaced = set(track_ids or [])
+        if not df.empty:
+            replaced |= set(df['track_id'].astype(str))
+        existing = self.read(table)
+        if not existing.empty:
+            existing = existing[~existing['track_id'].isin(replaced)]
+        frames = [frame for frame in (existing, df) if not frame.empty]
+        self._rewrite(table, pd.concat([self._normalize(frame) for frame in frames], ignore_index=True)
+                      if frames else pd.DataFrame())
+
+    def compact(self, table: str, max_parts: int = 1):
+        """ Merge all parts of a table into one, if it has more than max_parts parts """
+        if len(self._parts(table)) > max_parts:
+            self._rewrite(table, self.read(table))
+
+    def _rewrite(self, table: str, df: pd.DataFrame):
+        old_parts = self._parts(table)
+        if not df.empty:
+            self._write_part(table, pa.Table.from_pandas(self._normalize(df), preserve_index=False))
+        for path in old_parts:
+            path.unlink()
+
+    def import_csv(self, table: str, csv_paths: list, suffix: str = ""):
+        """ Import per-track csv files, the file stem without suffix is the track_id """
+        frames = [pd.read_csv(p).assign(track_id=Path(p).stem.replace(suffix, "") if suffix else Path(p).stem)
+                  for p in csv_paths]
+        if frames:
+            self.replace_tracks(table, pd.concat(frames, ignore_index=True))
+
+    def export_csv(self, table: str, folder, suffix: str = "", track_ids: list = None):
+        """ Write one csv per track, named <track_id><suffix>.csv, like the per-stage csv folders """
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        for track_id, df in self.read(table, track_ids=track_ids).groupby('track_id', sort=False):
+            df.drop(columns='track_id').to_csv(folder / f"{track_id}{suffix}.csv", index=False)
@@ -0,0 +1,133 @@
+""" Time-binned, robust aggregation of the velocities of many tracks.
+Tracks are streamed into fixed time bins (hourly, daily or custom bin edges) per region of the icefall,
+with running count, mean and std (merged per chunk) and the values needed for the median. The filter is
+the one of wrapper.m for the EMT velocities: values whose magnitude is outside the bounds are dropped (the
+sign of the speed across the reference line depends on the direction of the line), and bins whose spread is
+above a std cutoff get no velocity. The result is one small table with a row per region and bin. """
+
+import numpy as np
+import pandas as pd
+
+# wrapper.m keeps 0 - 10 m/day and drops days with a std above 1.5 m/day, here in m/yr (bounds of the magnitude)
+DAYS_PER_YEAR = 365
+BOUNDS_MPY = (0, 10 * DAYS_PER_YEAR)
+STD_CUTOFF_MPY = 1.5 * DAYS_PER_YEAR
+
+# first letter of the track name, see the naming convention in the README
+REGIONS = {'u': 'upper', 'l': 'lower'}
+
+
+def track_region(track_id):
+    """ Region of the icefall a track belongs to, from the first letter of its name """
+    return REGIONS.get(str(track_id)[:1].lower(), 'other')
+
+
+class BinnedAccumulator():
+    """ Running statistics of values in fixed time bins.
+    """
+    def __init__(self, freq="1D", bin_edges=None, bounds=BOUNDS_MPY):
+        """ Set up the bins
+
+        Args:
+            freq: bin width as a pandas frequency (e.g. "1h", "1D"), bins start at midnight of 1970-01-01
+            bin_edges: custom bin edges (datetimes) instead of fixed bins, values outside are dropped
+            bounds: (min, max) of the magnitude of the values that are kept, None keeps everything
+        """
+        self.bin_width = pd.Timedelta(freq).value
+        self.bin_edges = None if bin_edges is None else pd.to_datetime(bin_edges).as_unit("ns").asi8
+        self.bounds = bounds
+        self.count = {}
+        self.mean = {}
+        self.m2 = {}  # sum of squared differences to the mean (Welford)
+        self.values = {}  # values per bin, for the median
+
+    def _bins(self, timestamps):
+        ns = pd.to_datetime(timestamps).as_unit("ns").asi8 if isinstance(timestamps, pd.DatetimeIndex) \
+            else pd.to_datetime(pd.Series(timestamps)).dt.as_unit("ns").to_numpy().astype(np.int64)
+        if self.bin_edges is None:
+            return ns // self.bin_width
+        bins = np.searchsorted(self.bin_edges, ns, side='right') - 1
+        return np.where((bins >= 0) & (bins < len(self.bin_edges) - 1), bins, -1)
+
+    def bin_start(self, b):
+        """ Start time of a bin """
+        return pd.Timestamp(self.bin_edges[b] if self.bin_edges is not None else b * self.bin_width)
+
+    def add(self, timestamps, values):
+        """ Add a chunk of values (e.g. one track) """
+        values = np.asarray(values, dtype=float)
+        bins = self._bins(timestamps)
+        keep = ~np.isnan(values)
+        if self.bounds is not None:
+            magnitude = np.abs(values)
+            keep &= (magnitude >= self.bounds[0]) & (magnitude <= self.bounds[1])
+        if self.bin_edges is not None:
+            keep &= bins >= 0
+        bins, values = bins[keep], values[keep]
+
+        order = np.argsort(bins, kind='stable')
+        bins, values = bins[order], values[order]
+        chunk_bins, start = np.unique(bins, return_index=True)
+        for b, chunk in zip(chunk_bins, np.split(values, start[1:])):
+            n, mean = len(chunk), chunk.mean()
+            m2 = ((chunk - mean)**2).sum()
+            if b in self.count:
+                # merge the statistics of the chunk into those of the bin (Chan et al.)
+                n_a, mean_a = self.count[b], self.mean[b]
+                delta = mean - mean_a
+                self.count[b] = n_a + n
+                self.mean[b] = mean_a + delta * n / (n_a + n)
+                self.m2[b] += m2 + delta**2 * n_a * n / (n_a + n)
+                self.values[b].append(chunk)
+            else:
+                self.count[b], self.mean[b], self.m2[b], self.values[b] = n, mean, m2, [chunk]
+
+    def table(self, std_cutoff=STD_CUTOFF_MPY):
+        """ Statistics of every bin that has values
+
+        Returns:
+            pd.DataFrame: bin_start, count, mean, median, std and velocity (the median, NaN where the std is
+                above std_cutoff, like in wrapper.m)
+        """
+        bins = sorted(self.count)
+        count = np.array([self.count[b] for b in bins], dtype=int)
+        m2 = np.array([self.m2[b] for b in bins])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(m2 / (count - 1))  # sample std, as matlab std
+        median = np.array([np.median(np.concatenate(self.values[b])) for b in bins])
+        table = pd.DataFrame({
+            'bin_start': pd.to_datetime([self.bin_start(b) for b in bins]),
+            'count': count,
+            'mean': [self.mean[b] for b in bins],
+            'median': median,
+            'std': std,
+        })
+        table['velocity'] = table['median'].where(~(table['std'] > std_cutoff))
+        return table
+
+
+def aggregate_velocities(tracks, value_column='line_speed_mpy', freq="1D", bin_edges=None,
+                         bounds=BOUNDS_MPY, std_cutoff=STD_CUTOFF_MPY):
+    """ Aggregate tracks per region and time bin
+
+    Args:
+        tracks: iterable of (track_id, DataFrame with timestamp and value_column), e.g. a groupby
+        value_column: velocity column to aggregate
+        freq, bin_edges, bounds: see BinnedAccumulator
+        std_cutoff: bins with a larger std get a NaN velocity
+
+    Returns:
+        pd.DataFrame: region, bin_start, count, mean, median, std, velocity
+    """
+    accumulators = {}
+    for track_id, df in tracks:
+        region = track_region(track_id)
+        if region not in accumulators:
+            accumulators[region] = BinnedAccumulator(freq, bin_edges, bounds)
+        accumulators[region].add(df['timestamp'], df[value_column])
+
+    tables = [acc.table(std_cutoff).assign(region=region) for region, acc in sorted(accumulators.items())]
+    columns = ['region', 'bin_start', 'count', 'mean', 'median', 'std', 'velocity']
+    if not tables:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(tables, ignore_index=True)[columns]
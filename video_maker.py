@@ -2,11 +2,12 @@
 #%% convert images that were annotated to a mp4 video 
 
 #%%
-import cv2
-import os, sys
+import os
 from PIL import Image
 import glob
 
+from video_stream import encode_video
+
 #%% 
 camera_name = 'tls_left'
 dir_name = '100CANON_29_07_2023/timelapse'
@@ -25,33 +26,25 @@ nfs = 120
 #Specify toggle variable to scale the images
 n = 1
 
+#Number of decode threads and maximum number of frames in memory
+n_workers = 4
+queue_size = 32
+
 #%%
 #images = [img for img in os.listdir(imagFolder) if img.endswith(".png")]
 #glob.glob(Pathname) fetches all file with extension PNG in that folder
-images = glob.glob(os.path.join(imgFolder, "*.png"))
-#images.sort()
+#sorted, since the file names are the timestamps this puts the frames in time order
+images = sorted(glob.glob(os.path.join(imgFolder, "*.png")))
 for test in images:
     print(test)
 
 #%%
 width, height = Image.open(images[0]).size
 size = (width, height)
-codec = cv2.VideoWriter_fourcc(*'mp4v') #DIVX, DIVD
 if (resize  and n > 0):
-    video = cv2.VideoWriter(vidName, codec, nfs, (W, H))
-else:
-    video = cv2.VideoWriter(vidName, codec, nfs, size)
-
-#Do not open images in 'Image' as well as 'CV2', else following error occurs
-#<built-in function imread> returned NULL without setting an error
-for img in images:
-    #In case images are of different size, resize them to user specified values
-    if (resize and n > 0):
-        newImg = cv2.imread(img)
-        newImg = cv2.resize(newImg, (W, H))
-        video.write(newImg)
-    else:
-        video.write(img)
-
-video.release()
-cv2.destroyAllWindows()
\ No newline at end of file
+    size = (W, H)
+
+#decoding and resizing runs in a thread pool, the frames are written in order by one writer.
+#Frames of another size than the video are resized (the writer silently drops them otherwise)
+stats = encode_video(images, vidName, nfs, size, codec='mp4v', #DIVX, DIVD
+                     n_workers=n_workers, queue_size=queue_size)
\ No newline at end of file
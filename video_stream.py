@@ -0,0 +1,97 @@
+""" Streaming video encoder for video_maker.py.
+Frames are decoded and resized by a pool of threads (cv2 releases the GIL), kept in order by a bounded reorder
+queue and written by a single writer, so at most queue_size frames are in memory whatever the number of frames.
+The encoder reports frames/s and how full the queue is: a queue that is mostly full means the writer (encode)
+is the bottleneck, a mostly empty one that decoding is. Frames that cannot be read are skipped and counted. """
+
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+
+def read_frame(path, size=None):
+    """ Decode an image (BGR) and resize it to size = (width, height) if given """
+    frame = cv2.imread(str(path))
+    if frame is None:
+        raise IOError(f"Could not read {path}")
+    if size is not None and (frame.shape[1], frame.shape[0]) != tuple(size):
+        frame = cv2.resize(frame, tuple(size), interpolation=cv2.INTER_AREA)
+    return frame
+
+
+def encode_video(images, video_path, fps, size, codec='mp4v', n_workers=4, queue_size=32, report_every=100,
+                 read=read_frame):
+    """ Write images as a video, in the order given
+
+    Args:
+        images: image paths (or other inputs of read), in frame order
+        video_path: output video
+        fps: frames per second of the video
+        size: (width, height) of the video, frames of another size are resized
+        codec: fourcc code
+        n_workers: decode threads
+        queue_size: maximum number of frames being decoded or waiting to be written
+        report_every: print the statistics every this many frames
+        read: function (image, size) -> BGR frame of the video size, runs in the decode threads
+
+    Returns:
+        dict: frames written, frames skipped because read failed, seconds, fps, mean queue occupancy
+            (ready frames / queue_size) and the seconds the writer waited for decoding and spent encoding
+    """
+    video = cv2.VideoWriter(str(video_path), cv2.VideoWriter_fourcc(*codec), fps, tuple(size))
+    if not video.isOpened():
+        raise IOError(f"Could not open {video_path} for writing")
+
+    stats = dict(frames=0, skipped=0, decode_wait_s=0.0, encode_s=0.0)
+    occupancy_sum = 0
+    start = time.perf_counter()
+    images = iter(images)
+    pending = deque()  # futures in frame order: the reorder queue
+    try:
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            for path in images:
+                pending.append(pool.submit(read, path, size))
+                if len(pending) >= queue_size:
+                    break
+            while pending:
+                occupancy_sum += sum(f.done() for f in pending)
+
+                t0 = time.perf_counter()
+                try:
+                    frame = pending.popleft().result()  # waits if the next frame is not decoded yet
+                except Exception as e:  # one unreadable frame must not stop the whole video
+                    print(f"Skipping frame: {e}")
+                    stats['skipped'] += 1
+                    frame = None
+                t1 = time.perf_counter()
+                if frame is not None:
+                    video.write(frame)
+                    stats['frames'] += 1
+                t2 = time.perf_counter()
+                stats['decode_wait_s'] += t1 - t0
+                stats['encode_s'] += t2 - t1
+
+                # refill the queue
+                path = next(images, None)
+                if path is not None:
+                    pending.append(pool.submit(read, path, size))
+
+                if frame is not None and report_every and stats['frames'] % report_every == 0:
+                    _report(stats, occupancy_sum, queue_size, time.perf_counter() - start)
+    finally:
+        video.release()
+
+    stats['seconds'] = time.perf_counter() - start
+    stats['fps'] = stats['frames'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+    stats['queue_occupancy'] = occupancy_sum / max(stats['frames'] + stats['skipped'], 1) / queue_size
+    _report(stats, occupancy_sum, queue_size, stats['seconds'])
+    return stats
+
+
+def _report(stats, occupancy_sum, queue_size, seconds):
+    n = max(stats['frames'] + stats['skipped'], 1)  # occupancy is sampled once per queued frame
+    print(f"{stats['frames']} frames ({stats['skipped']} skipped), {stats['frames'] / seconds:.1f} frames/s, "
+          f"queue {occupancy_sum / n:.1f}/{queue_size} ready, "
+          f"waiting for decode {stats['decode_wait_s']:.1f} s, encoding {stats['encode_s']:.1f} s")